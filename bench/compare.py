@@ -0,0 +1,58 @@
+"""Compare two bench/load_test.py result files
+
+    python bench/compare.py bench/results/old.json bench/results/new.json --threshold 10
+
+Exits with status 1 if throughput dropped, or p95/p99 latency rose, by more
+than the threshold (percent) for any endpoint and concurrency level.
+"""
+
+import sys
+import json
+import argparse
+
+
+def _load(path: str) -> tuple:
+    with open(path, encoding="utf-8") as f:
+        report = json.load(f)
+    return report, {(r["endpoint"], r["concurrency"]): r for r in report["results"]}
+
+
+def _change(old: float, new: float) -> float:
+    return (new - old) / old * 100 if old else 0.0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed regression in percent")
+    args = parser.parse_args(argv)
+
+    old_report, old = _load(args.baseline)
+    new_report, new = _load(args.candidate)
+    print(f"baseline  {old_report['version']} ({old_report['timestamp']})")
+    print(f"candidate {new_report['version']} ({new_report['timestamp']})")
+    print(f"{'endpoint':8s} {'conc':>5s} {'rps':>18s} {'p95 ms':>20s} {'p99 ms':>20s}")
+
+    regressions = []
+    for key in sorted(old.keys() & new.keys()):
+        a, b = old[key], new[key]
+        rps = _change(a["throughput_rps"], b["throughput_rps"])
+        p95 = _change(a["latency_ms"]["p95"], b["latency_ms"]["p95"])
+        p99 = _change(a["latency_ms"]["p99"], b["latency_ms"]["p99"])
+        print(
+            f"{key[0]:8s} {key[1]:5d} "
+            f"{b['throughput_rps']:9.1f} ({rps:+6.1f}%) "
+            f"{b['latency_ms']['p95']:10.1f} ({p95:+6.1f}%) "
+            f"{b['latency_ms']['p99']:10.1f} ({p99:+6.1f}%)"
+        )
+        if rps < -args.threshold or p95 > args.threshold or p99 > args.threshold:
+            regressions.append(key)
+
+    for endpoint, concurrency in regressions:
+        print(f"REGRESSION: {endpoint} at concurrency {concurrency}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,300 @@
+"""Load test for the AI server against the local stub LLM
+
+Starts bench/stub_llm.py and the AI server (uvicorn, N workers) as
+subprocesses, drives /v1/chat/completions and /v1/prefill at fixed
+concurrency levels, and writes throughput, latency percentiles and
+per-worker memory to a JSON file that bench/compare.py can diff:
+
+    python bench/load_test.py --concurrency 1,16,64 --requests 400 --workers 2
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from typing import List, Optional
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PREFILL_EMAIL = """Dear Ms. Patel,
+
+This is a gentle reminder regarding Invoice #{invoice} issued on October 28, 2025 for digital advertising campaign management and analytics reporting.
+
+The total amount due is ${amount:,} USD, payable no later than November 25, 2025.
+
+Company: {company}
+Contact: finance@apexmktg.com | +1 (646) 221-9988
+
+Thank you for your prompt attention."""
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def chat_payload() -> dict:
+    return {
+        "model": "llama",
+        "messages": [{"role": "user", "content": f"Say hello ({uuid.uuid4().hex[:8]})"}],
+        "max_tokens": 32,
+    }
+
+
+def prefill_payload() -> dict:
+    # A unique invoice number keeps the extraction cache out of the numbers; a
+    # distinct company and amount keep the duplicate index from flagging
+    # every request after the first as a near-duplicate
+    tag = uuid.uuid4().hex[:10]
+    email_text = PREFILL_EMAIL.format(
+        invoice=f"INV-{tag}", amount=random.randint(100, 99999), company=f"Apex Marketing Group {tag}",
+    )
+    return {"email_text": email_text, "model": "llama"}
+
+
+ENDPOINTS = {
+    "chat": ("/v1/chat/completions", chat_payload),
+    "prefill": ("/v1/prefill", prefill_payload),
+}
+
+
+async def run_level(server_url: str, endpoint: str, concurrency: int, total: int, timeout: float) -> dict:
+    path, make_payload = ENDPOINTS[endpoint]
+    latencies: List[float] = []
+    statuses = {}
+    failures = 0
+    issued = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=server_url, timeout=timeout, limits=limits) as client:
+        async def worker():
+            nonlocal issued, failures
+            while issued < total:
+                issued += 1
+                payload = make_payload()
+                started = time.perf_counter()
+                try:
+                    response = await client.post(path, json=payload)
+                    status = response.status_code
+                    ok = status == 200 and (endpoint != "prefill" or response.json().get("success") is True)
+                except httpx.HTTPError:
+                    status, ok = "error", False
+                latencies.append(time.perf_counter() - started)
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                if not ok:
+                    failures += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "failures": failures,
+        "statuses": statuses,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+            "mean": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+        },
+    }
+
+
+def _children(pid: int) -> List[int]:
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            if int(fields[1]) == pid:
+                children.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    return children
+
+
+def _rss_mb(pid: int) -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+    return None
+
+
+def memory_per_worker(server_pid: int) -> dict:
+    """RSS of the uvicorn master and each worker process (Linux /proc only)"""
+    if not os.path.isdir("/proc"):
+        return {}
+    workers = [pid for pid in _children(server_pid) if _rss_mb(pid) is not None]
+    # With --workers N uvicorn also forks a multiprocessing helper; keep real workers only
+    worker_rss = [_rss_mb(pid) for pid in workers if _rss_mb(pid) and _rss_mb(pid) > 20]
+    return {
+        "master_rss_mb": _rss_mb(server_pid),
+        "worker_rss_mb": worker_rss,
+        "max_worker_rss_mb": max(worker_rss) if worker_rss else _rss_mb(server_pid),
+    }
+
+
+def wait_ready(url: str, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready within {timeout}s")
+
+
+def current_version() -> str:
+    version = "unknown"
+    try:
+        with open(os.path.join(ROOT, "VERSION.md"), encoding="utf-8") as f:
+            match = re.search(r"Current Version:\s*(\S+)", f.read())
+            if match:
+                version = match.group(1)
+    except OSError:
+        pass
+    try:
+        sha = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        if sha:
+            version = f"{version}+{sha}"
+    except OSError:
+        pass
+    return version
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--endpoints", default="chat,prefill", help="comma-separated: chat,prefill")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint and level")
+    parser.add_argument("--warmup", type=int, default=10, help="untimed requests before each endpoint")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the AI server")
+    parser.add_argument("--server-port", type=int, default=8091)
+    parser.add_argument("--server-url", default=None, help="benchmark an already running server instead of starting one")
+    parser.add_argument("--stub-port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=100.0)
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--fast-path", choices=["on", "off"], default="off",
+                        help="rule-based prefill extraction; off makes every prefill reach the stub")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--out", default=os.path.join(ROOT, "bench", "results"))
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    processes = []
+    workdir = tempfile.mkdtemp(prefix="ai-server-bench-")
+
+    try:
+        server_url = args.server_url
+        server_pid = None
+        if server_url is None:
+            stub = subprocess.Popen([
+                sys.executable, os.path.join(ROOT, "bench", "stub_llm.py"),
+                "--port", str(args.stub_port),
+                "--latency-ms", str(args.latency_ms),
+                "--jitter-ms", str(args.jitter_ms),
+                "--tokens-per-second", str(args.tokens_per_second),
+                "--error-rate", str(args.error_rate),
+                "--malformed-rate", str(args.malformed_rate),
+                "--seed", "1",
+            ])
+            processes.append(stub)
+            env = dict(
+                os.environ,
+                GROQ_BASE_URL=f"http://127.0.0.1:{args.stub_port}",
+                GROQ_API_KEY="stub",
+                RATE_LIMIT_REQUESTS="1000000000",
+                PREFILL_FAST_PATH_ENABLED="1" if args.fast_path == "on" else "0",
+                DATA_FILE=os.path.join(workdir, "data.csv"),
+                LOG_FILE=os.path.join(workdir, "input_email_text.log"),
+                # Every file the server writes goes to the work dir, never the repo
+                INVOICE_DB=os.path.join(workdir, "invoices.db"),
+                PREFILL_DEDUP_DB=os.path.join(workdir, "duplicates.db"),
+                PREFILL_JOB_DB=os.path.join(workdir, "jobs.db"),
+                RATE_LIMIT_DB=os.path.join(workdir, "ratelimit.db"),
+                PARQUET_DIR=os.path.join(workdir, "parquet"),
+            )
+            server = subprocess.Popen([
+                sys.executable, "-m", "uvicorn", "main:app",
+                "--host", "127.0.0.1", "--port", str(args.server_port),
+                "--workers", str(args.workers), "--log-level", "warning", "--no-access-log",
+            ], cwd=ROOT, env=env)
+            processes.append(server)
+            server_pid = server.pid
+            server_url = f"http://127.0.0.1:{args.server_port}"
+            wait_ready(f"http://127.0.0.1:{args.stub_port}/docs")
+        wait_ready(f"{server_url}/openapi.json")
+
+        results = []
+        for endpoint in endpoints:
+            if args.warmup:
+                asyncio.run(run_level(server_url, endpoint, min(args.warmup, 4), args.warmup, args.timeout))
+            for level in levels:
+                result = asyncio.run(run_level(server_url, endpoint, level, args.requests, args.timeout))
+                if server_pid is not None:
+                    result["memory"] = memory_per_worker(server_pid)
+                results.append(result)
+                latency = result["latency_ms"]
+                print(
+                    f"{endpoint:8s} c={level:<4d} {result['throughput_rps']:9.1f} req/s  "
+                    f"p50={latency['p50']:8.1f}ms  p95={latency['p95']:8.1f}ms  p99={latency['p99']:8.1f}ms  "
+                    f"failures={result['failures']}"
+                )
+
+        report = {
+            "version": current_version(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": sys.version.split()[0],
+            "config": {k: v for k, v in vars(args).items() if k != "out"},
+            "results": results,
+        }
+        os.makedirs(args.out, exist_ok=True)
+        out_path = os.path.join(args.out, f"{report['version']}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {out_path}")
+        return 0
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""Local OpenAI-compatible stub LLM server for benchmarks
+
+Serves /openai/v1/chat/completions (the path both Groq clients call) with
+configurable latency, token rate, error rate and malformed-JSON rate, so the
+AI server can be load tested without touching Groq:
+
+    python bench/stub_llm.py --port 9100 --latency-ms 200 --tokens-per-second 500
+    GROQ_BASE_URL=http://127.0.0.1:9100 GROQ_API_KEY=stub python main.py
+"""
+
+import re
+import json
+import time
+import random
+import asyncio
+import argparse
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = "invoice payment amount due service account balance report contact thanks".split()
+
+app = FastAPI(title="Stub LLM")
+app.state.config = argparse.Namespace(
+    latency_ms=100.0, jitter_ms=20.0, tokens_per_second=0.0,
+    error_rate=0.0, malformed_rate=0.0, completion_tokens=32, seed=None,
+)
+app.state.rng = random.Random()
+
+
+def _extraction_answer(rng: random.Random, malformed: bool) -> str:
+    fields = {
+        "amount": f"{rng.randint(100, 99999)}.00",
+        "currency": rng.choice(["USD", "EUR", "GBP"]),
+        "due_date": "November 25, 2025",
+        "description": "Consulting services",
+        "company": "Stub Corp",
+        "contact": "billing@stub.example",
+    }
+    text = json.dumps(fields)
+    if malformed:
+        # The kinds of defects real models produce
+        text = rng.choice([
+            "```json\n" + text + "\n```",
+            "Here is the data: " + text,
+            text[:-1] + ",}",
+            text[: len(text) // 2],
+        ])
+    return text
+
+
+def _batch_answer(rng: random.Random, user: str, malformed: bool) -> str:
+    """One extraction per "### Email <id>" section, as a JSON array"""
+    ids = re.findall(r"^### Email (\S+)$", user, re.M)
+    answers = [dict(json.loads(_extraction_answer(rng, False)), id=item_id) for item_id in ids]
+    if malformed and answers:
+        answers.pop(rng.randrange(len(answers)))  # a model that skipped an email
+    return json.dumps(answers)
+
+
+def _chat_answer(rng: random.Random, tokens: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(tokens))
+
+
+def _usage(messages: list, content: str) -> dict:
+    prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages) // 4
+    completion_tokens = max(1, len(content) // 4)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+@app.post("/openai/v1/chat/completions")
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    config = app.state.config
+    rng = app.state.rng
+    body = await request.json()
+    messages = body.get("messages", [])
+    model = body.get("model", "stub")
+
+    delay = max(0.0, rng.gauss(config.latency_ms, config.jitter_ms)) / 1000
+    await asyncio.sleep(delay)
+
+    if rng.random() < config.error_rate:
+        status = rng.choice([429, 500, 503])
+        return JSONResponse(status_code=status, content={"error": {"message": "stub upstream error", "code": status}})
+
+    system = " ".join(str(m.get("content", "")) for m in messages if m.get("role") == "system")
+    if "JSON array" in system:
+        user = " ".join(str(m.get("content", "")) for m in messages if m.get("role") == "user")
+        content = _batch_answer(rng, user, rng.random() < config.malformed_rate)
+    elif "JSON" in system:
+        content = _extraction_answer(rng, rng.random() < config.malformed_rate)
+    else:
+        tokens = min(body.get("max_tokens") or body.get("max_completion_tokens") or config.completion_tokens,
+                     config.completion_tokens)
+        content = _chat_answer(rng, tokens)
+
+    completion_id = f"chatcmpl-stub-{rng.getrandbits(48):x}"
+    created = int(time.time())
+    per_token = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+    words = content.split(" ")
+
+    if body.get("stream"):
+        async def events():
+            for i, word in enumerate(words):
+                if per_token:
+                    await asyncio.sleep(per_token)
+                chunk = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+            final = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            }
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    if per_token:
+        await asyncio.sleep(per_token * len(words))
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": _usage(messages, content),
+    }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="mean time to first token")
+    parser.add_argument("--jitter-ms", type=float, default=20.0, help="standard deviation of the latency")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="0 returns the whole answer at once")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with 429/500/503")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="fraction of extraction answers with broken JSON")
+    parser.add_argument("--completion-tokens", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=None)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    args = parse_args()
+    app.state.config = args
+    app.state.rng = random.Random(args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
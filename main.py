@@ -1,42 +1,202 @@
-import os
 import time
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
-from fastapi.exceptions import RequestValidationError
+# Start of the import-to-ready clock reported by /readyz
+IMPORT_STARTED = time.perf_counter()
+
+import io
+import os
 import csv
+import math
+import asyncio
+from datetime import date
+from fastapi import FastAPI, Request, Depends, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.exceptions import RequestValidationError
 import json
 import traceback
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
 from starlette.exceptions import HTTPException
+from src.settings import settings, MissingAPIKey
 from src.ai.openai_chat import get_ai_platform
 import logging
-from src.ai.openai_prefill import get_ai_platform as get_prefill_platform
-from src.auth.ratelimit import apply_rate_limit
+from src.ai.openai_prefill import get_ai_platform as get_prefill_platform, SYSTEM_PROMPT_VERSION
+from src.ai.limiter import DeadlineMiddleware, Overloaded, PRIORITY_BACKGROUND, request_priority, start_deadline
+from src.ai.context import ContextWindowExceeded, load_encoding
+from src.ai.microbatch import BatchingPlatform, MicroBatcher
+from src.ai.registry import registry as platform_registry
+from src.ai.router import route_label
+from src.ai.singleflight import (
+    SingleFlight, CoalescingPlatform,
+    CHAT_COALESCE_ENABLED, CHAT_COALESCE_WINDOW_SECONDS,
+    PREFILL_COALESCE_ENABLED, PREFILL_COALESCE_WINDOW_SECONDS,
+)
+from src.auth.ratelimit import rate_limit, get_client_id, RateLimitResult
+from src.storage.csv_sink import CsvSink
+from src.storage.row_store import RowStore, FanoutStore
+from src.storage.invoice_store import InvoiceStore
+from src.storage.duplicate_index import DuplicateIndex, PREFILL_DEDUP_MODE, parse_mode
+from src.telemetry.request_log import RequestLog, RequestLogMiddleware
+from src.telemetry import metrics
+from fastapi.responses import PlainTextResponse
+from src.extract import rules
+from src.extract.normalize import normalize_row, PREFILL_NORMALIZE_ENABLED
+from src.extract.json_repair import ExtractionParseError
+from src.extract.preprocess import PreprocessResult, clean_text, preprocess as preprocess_email
+from src.cache.extraction import ExtractionCache, make_cache_key, PREFILL_CACHE_DB
+from src.jobs.job_queue import JobQueue, QueueFull, InvalidCallbackUrl, check_callback_url, PREFILL_JOB_DB
 
-# Define absolute paths for data and log files
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_FILE = os.path.join(BASE_DIR, "data.csv")
-LOG_FILE = os.path.join(BASE_DIR, "input_email_text.log")
 logger = logging.getLogger(__name__)
 
-# Ensure the data file exists with headers
-if not os.path.exists(DATA_FILE):
-    os.makedirs(os.path.dirname(DATA_FILE), exist_ok=True)
-    with open(DATA_FILE, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=["amount", "currency", "due_date", "description", "company", "contact"])
-        writer.writeheader()
+# Extractions keyed by the cleaned email, so repeated invoices skip the LLM
+extraction_cache = ExtractionCache(db_path=PREFILL_CACHE_DB or None)
+
+# Identical prompts that are in flight at the same time share one upstream call
+chat_flight = SingleFlight(enabled=CHAT_COALESCE_ENABLED, window_seconds=CHAT_COALESCE_WINDOW_SECONDS)
+prefill_flight = SingleFlight(enabled=PREFILL_COALESCE_ENABLED, window_seconds=PREFILL_COALESCE_WINDOW_SECONDS)
+
+# Different emails that arrive together share one extraction call (PREFILL_MICROBATCH_ENABLED)
+prefill_batcher = MicroBatcher()
+
+REQUIRED_FIELDS = ["amount", "currency", "due_date", "description", "company", "contact"]
+
+# JSON-lines request log, written off the event loop by a background thread
+request_log = RequestLog(settings.log_file)
+
+# Rows are appended in groups by a background task; the header is written on first flush
+csv_sink = CsvSink(settings.data_file, REQUIRED_FIELDS)
+
+# Queryable index of the CSV rows, caught up after every flush
+invoice_store = InvoiceStore(settings.invoice_db, settings.data_file, REQUIRED_FIELDS)
+csv_sink.listeners.append(invoice_store.request_sync)
+
+# Invoices written so far, so reminders and forwards are flagged or not written twice
+dedup_mode = parse_mode(PREFILL_DEDUP_MODE)
+duplicate_index = DuplicateIndex(settings.duplicate_db) if dedup_mode != "off" else None
+
+def _parquet_store() -> RowStore:
+    # pyarrow is only imported when the parquet backend is configured
+    from src.storage.parquet_store import ParquetStore
+    return ParquetStore(settings.parquet_dir, REQUIRED_FIELDS)
+
+def _build_row_store() -> RowStore:
+    backends = {
+        "csv": lambda: csv_sink,
+        "parquet": _parquet_store,
+    }
+    row_stores = list(settings.row_stores)
+    unknown = set(row_stores) - set(backends)
+    if unknown or not row_stores:
+        raise ValueError(f"ROW_STORES must list some of {sorted(backends)}, got {row_stores}")
+    if "csv" not in row_stores:
+        logger.warning("ROW_STORES has no csv backend; /v1/invoices only covers rows already in data.csv")
+    stores = [backends[name]() for name in row_stores]
+    return stores[0] if len(stores) == 1 else FanoutStore(stores)
+
+row_store = _build_row_store()
+
+# Counters other components already keep, read when /metrics is scraped
+for _name, _doc, _callback in (
+    ("ai_server_prefill_cache_hits", "Extraction cache hits", lambda: extraction_cache.hits),
+    ("ai_server_prefill_cache_misses", "Extraction cache misses", lambda: extraction_cache.misses),
+    ("ai_server_chat_coalesced", "Chat calls that shared an in-flight upstream request", lambda: chat_flight.shared),
+    ("ai_server_prefill_coalesced", "Prefill calls that shared an in-flight upstream request", lambda: prefill_flight.shared),
+    ("ai_server_csv_rows_written", "Rows appended to the CSV file", lambda: csv_sink.rows_written),
+    ("ai_server_request_log_dropped", "Request log records dropped because the queue was full", lambda: request_log.dropped),
+    ("ai_server_prefill_jobs_queued", "Prefill jobs waiting for a worker", lambda: prefill_jobs.stats()["queued"]),
+    ("ai_server_prefill_jobs_rejected", "Prefill jobs refused because the queue was full", lambda: prefill_jobs.rejected),
+    ("ai_server_startup_seconds", "Seconds from import of main to the end of startup", lambda: startup.startup_seconds or 0.0),
+    ("ai_server_ready_seconds", "Seconds from import of main to ready (providers warmed)", lambda: startup.ready_seconds or 0.0),
+):
+    metrics.registry.register(metrics.GaugeCallback(_name, _doc, _callback))
+
+class Startup:
+    """What /readyz reports: timings since import and whether the providers are built"""
+
+    def __init__(self):
+        self.startup_seconds = None
+        self.ready_seconds = None
+        self.providers_ready = False
+        self.providers_error = None
+        self.task = None
+
+    def finished(self):
+        self.startup_seconds = time.perf_counter() - IMPORT_STARTED
+        if not settings.warm_up_providers:
+            self.ready_seconds = self.startup_seconds
+
+    def _warm_up(self):
+        # tiktoken downloads its encoding on first use; do that here, not in a request
+        load_encoding()
+        get_ai_platform("llama")
+        get_prefill_platform("llama")
+
+    async def warm_up(self):
+        """
+        Build the long-lived provider clients (SDK import, client setup) off the
+        event loop, so the first request does not pay for them and startup does
+        not wait for them
+        """
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(self._warm_up)
+        except Exception as e:
+            self.providers_error = str(e)
+            logger.warning("Provider warm-up failed: %s", e)
+            return
+        self.providers_ready = True
+        self.ready_seconds = time.perf_counter() - IMPORT_STARTED
+        logger.info("Providers warmed in %.3fs; ready %.3fs after import",
+                    time.perf_counter() - started, self.ready_seconds)
+
+    def checks(self) -> dict:
+        checks = {
+            "startup": self.startup_seconds is not None,
+            "api_key": bool(settings.groq_api_key),
+        }
+        if settings.warm_up_providers:
+            checks["providers"] = self.providers_ready
+        return checks
+
+startup = Startup()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    request_log.start()
+    await row_store.start()
+    # Indexes in the background, starting with rows written while the server was down
+    await invoice_store.start()
+    await prefill_jobs.start()
+    startup.finished()
+    # After startup, so importing the SDKs does not slow the steps above
+    if settings.warm_up_providers and settings.groq_api_key:
+        startup.task = asyncio.create_task(startup.warm_up())
+    yield
+    if startup.task is not None:
+        await startup.task
+    await prefill_jobs.stop()
+    await row_store.stop()
+    await invoice_store.stop()
+    request_log.stop()
+    await platform_registry.aclose()
+    extraction_cache.close()
+    invoice_store.close()
+    if duplicate_index is not None:
+        duplicate_index.close()
 
 app = FastAPI(
     title="AI Server",
     description="A simple AI server with chat completions and data extraction capabilities.",
+    lifespan=lifespan,
 )
+app.add_middleware(RequestLogMiddleware, request_log=request_log)
+app.add_middleware(DeadlineMiddleware)
 
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     # Get raw request body for debugging
     body = await request.body()
     body_str = body.decode('utf-8')
-    print(f"Raw request body: {repr(body_str)}")
+    logger.info("Validation failed. Raw request body: %r", body_str)
     
     return JSONResponse(
         status_code=422,
@@ -61,8 +221,28 @@ async def http_exception_handler(request: Request, exc: HTTPException):
     return JSONResponse(
         status_code=exc.status_code,
         content={"detail": str(exc.detail)},
+        headers=getattr(exc, "headers", None),
     )
 
+@app.exception_handler(MissingAPIKey)
+async def missing_api_key_handler(request: Request, exc: MissingAPIKey):
+    # The server runs without a provider key (health checks, invoice queries);
+    # only the calls that need the provider fail
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    # Shed by the upstream concurrency limiter before reaching the provider
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))},
+    )
+
+@app.exception_handler(ContextWindowExceeded)
+async def context_window_exceeded_handler(request: Request, exc: ContextWindowExceeded):
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
+
 @app.exception_handler(Exception)
 async def general_exception_handler(request: Request, exc: Exception):
     return JSONResponse(
@@ -70,19 +250,59 @@ async def general_exception_handler(request: Request, exc: Exception):
         content={"detail": str(exc)},
     )
 # 1. Chat Completions Endpoint
-from pydantic import ConfigDict
+from pydantic import ConfigDict, Field, model_validator
+from typing import List, Optional, Union
+
+class ChatMessage(BaseModel):
+    role: str
+    content: Optional[str] = ""
+    name: Optional[str] = None
 
 class ChatRequest(BaseModel):
+    """OpenAI chat completion request; the older {"model_name", "prompt"} form is still accepted"""
     model_config = ConfigDict(protected_namespaces=())
-    model_name: str
-    prompt: str
+    model: Optional[str] = None
+    messages: Optional[List[ChatMessage]] = None
+    max_tokens: Optional[int] = Field(None, ge=1)
+    temperature: Optional[float] = Field(None, ge=0, le=2)
+    n: int = Field(1, ge=1)
+    stop: Optional[Union[str, List[str]]] = None
+    stream: bool = False
+    model_name: Optional[str] = None
+    prompt: Optional[str] = None
 
-from typing import Optional
-import re
+    @model_validator(mode="after")
+    def _check(self):
+        if not self.messages and self.prompt is None:
+            raise ValueError("messages is required")
+        if self.n > settings.chat_max_choices:
+            raise ValueError(f"n can be at most {settings.chat_max_choices}")
+        if self.stream and self.n > 1:
+            raise ValueError("n > 1 is not supported with stream")
+        if isinstance(self.stop, list) and len(self.stop) > 4:
+            raise ValueError("stop takes at most 4 sequences")
+        return self
+
+    def chat_messages(self) -> list:
+        if self.messages:
+            return [message.model_dump(exclude_none=True) for message in self.messages]
+        return [{"role": "user", "content": self.prompt}]
+
+    def params(self) -> dict:
+        """max_tokens, temperature and stop, when set"""
+        return {
+            name: value for name, value in
+            (("max_tokens", self.max_tokens), ("temperature", self.temperature), ("stop", self.stop))
+            if value is not None
+        }
 
 class PrefillRequest(BaseModel):
     email_text: str
     model: str = "llama"
+    # Queue the extraction and answer 202 with a job id instead of waiting for it
+    async_mode: bool = False
+    # Finished async jobs are POSTed here as well as kept for polling
+    callback_url: Optional[str] = None
     model_config = ConfigDict(
         json_schema_extra={
             "example": {
@@ -96,15 +316,7 @@ I hope this message finds you well. """,
 
     def clean_email_text(self) -> str:
         """Clean and normalize email text"""
-        if not self.email_text:
-            return ""
-        # Handle different types of line endings
-        email = self.email_text.replace('\r\n', '\n').replace('\r', '\n')
-        # Normalize multiple newlines
-        email = re.sub(r'\n{3,}', '\n\n', email)
-        # Remove any potential control characters
-        email = ''.join(char for char in email if ord(char) >= 32 or char in '\n\t')
-        return email.strip()
+        return clean_text(self.email_text)
 
 class PrefillResponse(BaseModel):
     success: bool
@@ -123,116 +335,521 @@ class PrefillResponse(BaseModel):
     def clean_email_text(self) -> str:
         """Clean and normalize email text"""
         # First validate the text
-        text = self.validate_text(self.email_text)
-        
-        # Convert to string and normalize line endings
-        text = text.replace('\r\n', '\n').replace('\r', '\n')
-        
-        # Remove null bytes and other control characters
-        text = ''.join(char for char in text if ord(char) >= 32 or char in '\n\t')
-        
-        # Normalize multiple newlines
-        text = re.sub(r'\n{3,}', '\n\n', text)
-        
-        # Final cleanup
-        return text.strip()
+        return clean_text(self.validate_text(self.email_text))
 
 class PrefillResponse(BaseModel):
     success: bool
     message: str
     data: Optional[dict] = None
+    # Input tokens preprocessing kept away from the model
+    tokens_saved: Optional[int] = None
+    # The earlier invoice this one repeats (PREFILL_DEDUP_MODE)
+    duplicate_of: Optional[dict] = None
+
+class PrefillJobResponse(BaseModel):
+    job_id: str
+    status: str
+    result: Optional[PrefillResponse] = None
+    error: Optional[str] = None
+    created_at: float
+    finished_at: Optional[float] = None
+
+class PrefillBatchItemResult(BaseModel):
+    index: int
+    success: bool
+    message: str
+    data: Optional[dict] = None
+    tokens_saved: Optional[int] = None
+    duplicate_of: Optional[dict] = None
+
+class PrefillBatchResponse(BaseModel):
+    success: bool
+    message: str
+    results: List[PrefillBatchItemResult]
+
+class ChatChoice(BaseModel):
+    index: int
+    message: ChatMessage
+    finish_reason: Optional[str] = None
+
+class ChatUsage(BaseModel):
+    prompt_tokens: int
+    completion_tokens: int
+    total_tokens: int
 
 class ChatResponse(BaseModel):
-    response: str
-    
+    id: str
+    object: str = "chat.completion"
+    created: int
+    model: str
+    choices: List[ChatChoice]
+    usage: ChatUsage
+    # Only for the older {"prompt"} requests: the first choice's text
+    response: Optional[str] = None
 
-@app.post("/v1/chat/completions", response_model=ChatResponse)
-async def chat(request: ChatRequest):
-    # Apply rate limit for chat endpoint
-    print("Applying rate limit for chat endpoint")
-    apply_rate_limit("global_unauthenticated_user")
-    response_text = get_ai_platform(request.model_name).chat(request.prompt)
-    return ChatResponse(response=response_text)
 
-# 2. prefill Endpoint
-@app.post("/v1/prefill", response_model=PrefillResponse)
-async def prefill(request_data: PrefillRequest):
+async def _sse_events(http_request: Request, stream):
+    """Relay provider chunks as server-sent events, closing the upstream stream if the client goes away"""
+    try:
+        async for chunk in stream:
+            if await http_request.is_disconnected():
+                request_log.event("chat_stream_cancelled", reason="client_disconnected")
+                return
+            yield f"data: {chunk.model_dump_json(exclude_unset=True)}\n\n"
+        yield "data: [DONE]\n\n"
+    finally:
+        await stream.close()
+
+@app.post("/v1/chat/completions", response_model=ChatResponse, response_model_exclude_none=True)
+async def chat(request: ChatRequest, http_request: Request, limit: RateLimitResult = Depends(rate_limit)):
     """
-    Extracts structured data from email text using an AI model and saves it to a CSV file.
+    OpenAI-compatible chat completions. Conversations longer than the model's
+    context window (or CHAT_MAX_INPUT_TOKENS) lose their oldest turns first.
 
-    Example request: curl -X POST "http://127.0.0.1:8090/v1/prefill" -H "Content-Type: application/json" -d '{"email_text": "Your email content here", "model": "llama"}'
+    Example request: curl -X POST "http://127.0.0.1:8090/v1/chat/completions" -H "Content-Type: application/json" -d '{"model": "llama", "messages": [{"role": "user", "content": "Hi"}], "max_tokens": 50}'
     """
-    try:
+    platform = get_ai_platform(request.model or request.model_name)
+    if request.stream:
+        # Streaming bypasses coalescing; each client gets its own token stream
+        stream = await platform.astream(request.chat_messages(), **request.params())
+        return StreamingResponse(
+            _sse_events(http_request, stream),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **limit.headers()},
+        )
+    ai_instance = CoalescingPlatform(platform, chat_flight)
+    completion = await ai_instance.acomplete(request.chat_messages(), n=request.n, **request.params())
+    response = ChatResponse.model_validate(completion)
+    if not request.messages:
+        response.response = (response.choices[0].message.content or "").strip()
+    return response
 
-        if not request_data.email_text:
-            return JSONResponse(
-                status_code=422,
-                content={"detail": "email_text is required"}
-            )
+async def _get_extraction(cleaned_email: str, model: str) -> dict:
+    """Get the extracted fields for an email, reusing a cached extraction of the same email"""
+    ai_instance = CoalescingPlatform(BatchingPlatform(get_prefill_platform(model), prefill_batcher), prefill_flight)
+    # Keyed on the route's upstream models, not the route name the client sent
+    cache_key = make_cache_key(cleaned_email, ai_instance.targets, SYSTEM_PROMPT_VERSION)
+    cached = await extraction_cache.aget(cache_key)
+    if cached is not None:
+        metrics.PREFILL_PATH.inc(path="cache")
+        return json.loads(cached)
+    metrics.PREFILL_PATH.inc(path="llm")
+    fields = await ai_instance.achat(cleaned_email)
+    # Only cache extractions that actually found something
+    if any(fields.values()):
+        await extraction_cache.aset(cache_key, json.dumps(fields))
+    return fields
 
-        # Apply rate limit for prefill endpoint
-        print("Applying rate limit for prefill endpoint")
-        apply_rate_limit("global_unauthenticated_user")
-        print("Rate limit applied successfully")
-        
-        # Clean and normalize the email text
+async def _extract(cleaned_email: str, model: str) -> dict:
+    """
+    Try the rule-based extractor first and only call the LLM when it leaves
+    fields missing or uncertain; the LLM then fills just those gaps.
+    """
+    if not rules.PREFILL_FAST_PATH_ENABLED:
+        return await _get_extraction(cleaned_email, model)
+    rule_result = rules.extract(cleaned_email)
+    if rule_result.is_confident():
+        metrics.PREFILL_PATH.inc(path="fast_path")
+        request_log.event("prefill_fast_path", used_llm=False, confidence=rule_result.overall)
+        return dict(rule_result.fields)
+
+    llm_fields = await _get_extraction(cleaned_email, model)
+    request_log.event("prefill_fast_path", used_llm=True, confidence=rule_result.overall)
+    return rule_result.merge(llm_fields)
+
+def _row_from_extraction(extracted_data: dict) -> dict:
+    """Turn the extracted fields into a CSV row"""
+    row = {field: extracted_data.get(field, "") for field in REQUIRED_FIELDS}
+
+    # Typed values (5320.00, USD, 2025-11-25) so readers of the CSV don't re-parse them
+    if PREFILL_NORMALIZE_ENABLED:
+        row = normalize_row(row)
+    return row
+
+def _prepare_email(request_data: PrefillRequest, endpoint: str) -> PreprocessResult:
+    """Clean the email, then cut quoted replies, signatures, footers and markup (PREFILL_PREPROCESS_STAGES)"""
+    model = route_label(request_data.model)
+    with metrics.stage(endpoint, "clean_email", model):
         cleaned_email = request_data.clean_email_text()
+    with metrics.stage(endpoint, "preprocess", model):
+        prepared = preprocess_email(cleaned_email)
+    metrics.PREFILL_PREPROCESS_TOKENS.inc(prepared.tokens_before, endpoint=endpoint, kind="before")
+    metrics.PREFILL_PREPROCESS_TOKENS.inc(prepared.tokens_after, endpoint=endpoint, kind="after")
+    return prepared
+
+async def _check_duplicate(cleaned_email: str, row: dict, endpoint: str) -> tuple:
+    """
+    Look the row up in the duplicate index before it is written. Returns the
+    index id of a new invoice (to forget it if the write fails) and the
+    earlier invoice it duplicates; both None with PREFILL_DEDUP_MODE=off.
+    """
+    if duplicate_index is None:
+        return None, None
+    # Off the event loop: an insert now and then waits for a WAL checkpoint
+    invoice_id, match = await asyncio.to_thread(duplicate_index.check_and_add, cleaned_email, row)
+    metrics.PREFILL_DUPLICATES.inc(endpoint=endpoint, match="new" if match is None else match.match)
+    return invoice_id, match
+
+def _forget_unwritten(invoice_ids: list):
+    for invoice_id in invoice_ids:
+        if invoice_id is not None:
+            duplicate_index.remove(invoice_id)
+
+# 2. prefill Endpoint
+async def _run_prefill(request_data: PrefillRequest, endpoint: str = "/v1/prefill") -> dict:
+    """Extract one email and append the row to the CSV file; shared by sync requests and jobs"""
+    try:
+        model = request_data.model
+        # Metrics and logs name the route; the raw model string is client-chosen
+        label = route_label(model)
+
+        # Clean the email text and drop what the model does not need
+        prepared = _prepare_email(request_data, endpoint)
+        cleaned_email = prepared.text
         
         # Log the incoming email text
-        try:
-            os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
-            with open(LOG_FILE, "a", encoding="utf-8") as log_file:
-                log_file.write(f"\n--- New Request at {time.strftime('%Y-%m-%d %H:%M:%S')} ---\n")
-                log_file.write(cleaned_email + "\n")
-        except Exception as e:
-            print(f"Warning: Could not write to log file: {e}")
+        with metrics.stage(endpoint, "log_write", label):
+            request_log.event(
+                "prefill_email", model=label, email=request_log.body(cleaned_email),
+                tokens_before=prepared.tokens_before, tokens_after=prepared.tokens_after, removed=prepared.removed,
+            )
         
         # Get AI response
-        ai_instance = get_prefill_platform(request_data.model)
-        response_text = ai_instance.chat(cleaned_email)
+        started = time.perf_counter()
+        # The platform returns the parsed (and if needed repaired) fields
+        try:
+            with metrics.stage(endpoint, "llm_call", label):
+                extracted = await _extract(cleaned_email, model)
+        except ExtractionParseError as e:
+            error_msg = f"Model did not return valid JSON ({e}). AI response: {e.output}"
+            logger.warning(error_msg)
+            return {"success": False, "message": error_msg}
         
         # Log the AI response
-        try:
-            with open(LOG_FILE, "a", encoding="utf-8") as log_file:
-                log_file.write(f"AI Response:\n{response_text}\n")
-        except Exception as e:
-            print(f"Warning: Could not write AI response to log: {e}")
+        with metrics.stage(endpoint, "log_write", label):
+            request_log.event("prefill_response", response=extracted, llm_ms=round((time.perf_counter() - started) * 1000, 3))
 
-        # Parse JSON response
-        try:
-            extracted_data = json.loads(response_text)
-        except json.JSONDecodeError as e:
-            error_msg = f"Model did not return valid JSON. AI response: {response_text}"
-            print(f"JSONDecodeError: {error_msg}. Error: {e}")
-            return {"success": False, "message": error_msg}
+        with metrics.stage(endpoint, "normalize", label):
+            row = _row_from_extraction(extracted)
 
-        # Validate and process the data
-        required_fields = ["amount", "currency", "due_date", "description", "company", "contact"]
-        row = {field: extracted_data.get(field, "") for field in required_fields}
-        
-        # # Convert amount to float
-        # try:
-        #     row["amount"] = float(row["amount"]) if row["amount"] else int(row["amount"])
-        # except ValueError as e:
-        #     print(f"Warning: Could not convert amount '{row['amount']}' to float. Error: {e}")
-        #     row["amount"] = 0.0
+        # A reminder or forward of an invoice already written
+        with metrics.stage(endpoint, "dedup", label):
+            invoice_id, duplicate = await _check_duplicate(cleaned_email, row, endpoint)
+        duplicate_of = duplicate.to_dict() if duplicate is not None else None
+        if duplicate is not None and dedup_mode == "merge":
+            return {
+                "success": True, "message": "Duplicate of an invoice already written; not written again.",
+                "tokens_saved": prepared.tokens_saved, "duplicate_of": duplicate_of,
+            }
 
         # Save to CSV
         try:
-            with open(DATA_FILE, "a", newline="", encoding="utf-8") as f:
-                writer = csv.DictWriter(f, fieldnames=required_fields)
-                writer.writerow(row)
+            with metrics.stage(endpoint, "csv_write", label):
+                await row_store.write(row)
         except Exception as e:
+            _forget_unwritten([invoice_id])
             error_msg = f"Failed to write to CSV file: {e}"
-            print(f"Error: {error_msg}")
+            logger.error(error_msg)
             return {"success": False, "message": error_msg}
 
-        return {"success": True, "message": "Data extracted and written successfully."}
+        return {
+            "success": True, "message": "Data extracted and written successfully.",
+            "tokens_saved": prepared.tokens_saved, "duplicate_of": duplicate_of,
+        }
+    except Overloaded:
+        raise  # answered with 503 and Retry-After
     except Exception as e:
         error_msg = f"An unexpected error occurred: {str(e)}\n{traceback.format_exc()}"
-        print(f"Exception in prefill endpoint: {error_msg}")
+        logger.error(f"Exception in prefill endpoint: {error_msg}")
         return {"success": False, "message": error_msg}
 
+async def _run_prefill_job(payload: dict) -> dict:
+    # Nobody is waiting on the connection: yield upstream slots to live requests
+    request_priority.set(PRIORITY_BACKGROUND)
+    start_deadline()
+    return await _run_prefill(PrefillRequest.model_validate(payload), "/v1/prefill/jobs")
+
+# Async-mode extractions: bounded queue, fixed worker pool, optional SQLite persistence
+prefill_jobs = JobQueue(_run_prefill_job, db_path=PREFILL_JOB_DB or None)
+
+def _job_response(job) -> dict:
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "result": job.result,
+        "error": job.error,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    }
+
+@app.post("/v1/prefill", response_model=PrefillResponse)
+async def prefill(request_data: PrefillRequest, http_request: Request, limit: RateLimitResult = Depends(rate_limit)):
+    """
+    Extracts structured data from email text using an AI model and saves it to a CSV file.
+
+    With "async_mode": true the email is queued and a job id is returned at once
+    (HTTP 202); poll GET /v1/prefill/{job_id} or pass "callback_url" (http(s),
+    public addresses or PREFILL_CALLBACK_HOSTS only). Retries from the same
+    client that send the same Idempotency-Key header get the original job back.
+
+    Example request: curl -X POST "http://127.0.0.1:8090/v1/prefill" -H "Content-Type: application/json" -d '{"email_text": "Your email content here", "model": "llama"}'
+    """
+    if not request_data.email_text:
+        return JSONResponse(
+            status_code=422,
+            content={"detail": "email_text is required"}
+        )
+
+    if not (request_data.async_mode or request_data.callback_url):
+        return await _run_prefill(request_data)
+
+    if request_data.callback_url:
+        try:
+            await check_callback_url(request_data.callback_url)
+        except InvalidCallbackUrl as e:
+            return JSONResponse(status_code=422, content={"detail": str(e)}, headers=limit.headers())
+
+    try:
+        job = await prefill_jobs.submit(
+            request_data.model_dump(exclude={"async_mode", "callback_url"}),
+            callback_url=request_data.callback_url,
+            idempotency_key=http_request.headers.get("idempotency-key"),
+            client_id=get_client_id(http_request),
+        )
+    except QueueFull as e:
+        logger.warning(f"Prefill job queue full: {e}")
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Prefill job queue is full, retry later"},
+            headers={"Retry-After": "1", **limit.headers()},
+        )
+    return JSONResponse(
+        status_code=202,
+        content=_job_response(job),
+        headers={"Location": f"/v1/prefill/{job.id}", **limit.headers()},
+    )
+
+# 3. Batch prefill Endpoint
+async def _read_batch_items(request: Request) -> list:
+    """Accept a JSON list, {"items": [...]}, or NDJSON (one PrefillRequest per line)"""
+    body = await request.body()
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        return [json.loads(line) for line in body.decode("utf-8").splitlines() if line.strip()]
+    payload = json.loads(body)
+    if isinstance(payload, dict):
+        payload = payload.get("items")
+    if not isinstance(payload, list):
+        raise ValueError("Expected a JSON list of prefill requests or an object with an 'items' list")
+    return payload
+
+@app.post("/v1/prefill/batch", response_model=PrefillBatchResponse)
+async def prefill_batch(request: Request, limit: RateLimitResult = Depends(rate_limit)):
+    """
+    Extracts data from many emails at once. Extractions run concurrently up to
+    PREFILL_BATCH_CONCURRENCY, every extracted row is written to the CSV file in
+    one append, and results are returned in input order. A failed item does not
+    abort the rest of the batch.
+
+    Example request: curl -X POST "http://127.0.0.1:8090/v1/prefill/batch" -H "Content-Type: application/x-ndjson" --data-binary @emails.ndjson
+    """
+    try:
+        raw_items = await _read_batch_items(request)
+    except (ValueError, UnicodeDecodeError) as e:
+        return JSONResponse(status_code=422, content={"detail": f"Invalid batch body: {e}"})
+    if len(raw_items) > settings.prefill_batch_max_items:
+        return JSONResponse(
+            status_code=413,
+            content={"detail": f"Batch has {len(raw_items)} items; the limit is {settings.prefill_batch_max_items}"}
+        )
+
+    semaphore = asyncio.Semaphore(settings.prefill_batch_concurrency)
+    # Bulk imports queue behind chat and single prefill requests for upstream slots
+    request_priority.set(PRIORITY_BACKGROUND)
+    request_log.event("prefill_batch", items=len(raw_items))
+
+    endpoint = "/v1/prefill/batch"
+
+    async def run_item(index: int, raw_item) -> tuple:
+        try:
+            item = PrefillRequest.model_validate(raw_item)
+            if not item.email_text:
+                return None, None, PrefillBatchItemResult(index=index, success=False, message="email_text is required")
+            prepared = _prepare_email(item, endpoint)
+            cleaned_email = prepared.text
+            label = route_label(item.model)
+            async with semaphore:
+                # Each item gets its own budget once it is let through, not the whole batch's
+                start_deadline()
+                started = time.perf_counter()
+                with metrics.stage(endpoint, "llm_call", label):
+                    extracted = await _extract(cleaned_email, item.model)
+            with metrics.stage(endpoint, "log_write", label):
+                request_log.event(
+                    "prefill_response", index=index, model=label, email=request_log.body(cleaned_email),
+                    response=extracted, llm_ms=round((time.perf_counter() - started) * 1000, 3),
+                )
+            with metrics.stage(endpoint, "normalize", label):
+                row = _row_from_extraction(extracted)
+            with metrics.stage(endpoint, "dedup", label):
+                invoice_id, duplicate = await _check_duplicate(cleaned_email, row, endpoint)
+            result = PrefillBatchItemResult(
+                index=index, success=True, message="Data extracted successfully.", data=row,
+                tokens_saved=prepared.tokens_saved, duplicate_of=duplicate.to_dict() if duplicate is not None else None,
+            )
+            if duplicate is not None and dedup_mode == "merge":
+                result.message = "Duplicate of an invoice already written; not written again."
+                return None, None, result
+            return row, invoice_id, result
+        except ExtractionParseError as e:
+            return None, None, PrefillBatchItemResult(index=index, success=False, message=f"Model did not return valid JSON ({e}).")
+        except Exception as e:
+            logger.warning(f"Exception in prefill batch item {index}: {e}")
+            return None, None, PrefillBatchItemResult(index=index, success=False, message=f"An unexpected error occurred: {e}")
+
+    outcomes = await asyncio.gather(*(run_item(i, item) for i, item in enumerate(raw_items)))
+    rows = [row for row, _, _ in outcomes if row is not None]
+    results = [result for _, _, result in outcomes]
+
+    if rows:
+        try:
+            with metrics.stage(endpoint, "csv_write"):
+                await row_store.write_many(rows)
+        except Exception as e:
+            _forget_unwritten([invoice_id for row, invoice_id, _ in outcomes if row is not None])
+            error_msg = f"Failed to write to CSV file: {e}"
+            logger.error(error_msg)
+            for row, _, result in outcomes:
+                if row is not None:
+                    result.success = False
+                    result.message = error_msg
+
+    succeeded = sum(1 for result in results if result.success)
+    return PrefillBatchResponse(
+        success=succeeded == len(results),
+        message=f"{succeeded} of {len(results)} emails extracted and written successfully.",
+        results=results,
+    )
+
+
+@app.get("/v1/prefill/cache")
+async def prefill_cache_stats():
+    """Hit/miss counters for the prefill extraction cache"""
+    return extraction_cache.stats()
+
+
+@app.get("/v1/prefill/duplicates")
+async def prefill_duplicate_stats():
+    """Size of the duplicate index and how many extractions matched an earlier invoice"""
+    if duplicate_index is None:
+        return {"mode": dedup_mode}
+    return {"mode": dedup_mode, **await asyncio.to_thread(duplicate_index.stats)}
+
+
+def _invoice_filters(company, currency, due_from, due_to, min_amount, max_amount) -> dict:
+    return dict(company=company, currency=currency, due_from=due_from, due_to=due_to,
+                min_amount=min_amount, max_amount=max_amount)
+
+
+@app.get("/v1/invoices")
+async def list_invoices(
+    company: Optional[str] = None,
+    currency: Optional[str] = None,
+    due_from: Optional[date] = None,
+    due_to: Optional[date] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[int] = None,
+):
+    """
+    Extracted invoices matching every given filter, a page at a time. Pass the
+    returned next_cursor to get the following page.
+
+    Example request: curl "http://127.0.0.1:8090/v1/invoices?company=Apex%20Marketing%20Group&due_to=2025-11-30"
+    """
+    filters = _invoice_filters(company, currency, due_from, due_to, min_amount, max_amount)
+    return await asyncio.to_thread(invoice_store.query, limit=limit, cursor=cursor, **filters)
+
+
+@app.get("/v1/invoices/export")
+async def export_invoices(
+    company: Optional[str] = None,
+    currency: Optional[str] = None,
+    due_from: Optional[date] = None,
+    due_to: Optional[date] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+):
+    """Matching invoices as CSV with the same columns as data.csv, streamed page by page"""
+    filters = _invoice_filters(company, currency, due_from, due_to, min_amount, max_amount)
+    rows = invoice_store.iter_rows(**filters)
+
+    async def lines():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(REQUIRED_FIELDS)
+        while True:
+            page = await asyncio.to_thread(lambda: [row for _, row in zip(range(1000), rows)])
+            writer.writerows(page)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            if len(page) < 1000:
+                return
+
+    return StreamingResponse(
+        lines(), media_type="text/csv",
+        headers={"Content-Disposition": 'attachment; filename="invoices.csv"'},
+    )
+
+
+@app.get("/v1/prefill/jobs")
+async def prefill_job_stats():
+    """Queue depth and completion counters for async-mode prefill jobs"""
+    return prefill_jobs.stats()
+
+
+@app.get("/v1/prefill/{job_id}", response_model=PrefillJobResponse)
+async def prefill_job(job_id: str):
+    """Status of an async-mode prefill job, with its result once it has finished"""
+    job = await prefill_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown or expired job {job_id}")
+    return _job_response(job)
+
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving; never calls a provider"""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """
+    Readiness: startup has finished, a provider key is configured and (with
+    AI_WARM_UP_PROVIDERS) the provider clients are built. 503 until then.
+    Answers from local state only, never calls a provider.
+    """
+    checks = startup.checks()
+    ready = all(checks.values())
+    content = {
+        "status": "ready" if ready else "not_ready",
+        "checks": checks,
+        "startup_seconds": startup.startup_seconds,
+        "ready_seconds": startup.ready_seconds,
+    }
+    if startup.providers_error:
+        content["error"] = startup.providers_error
+    return JSONResponse(status_code=200 if ready else 503, content=content)
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus text exposition of request, stage and upstream latency histograms"""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
     
 if __name__ == "__main__":
     import uvicorn
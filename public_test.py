@@ -1,9 +1,16 @@
 """Simple public test for candidate to run"""
 
+import os
 import json
+import tempfile
 import requests
 
 SERVER_URL = "http://localhost:8090"
+# Start the server with the same DATA_FILE, so the tests never touch the tracked data.csv
+DATA_FILE = os.getenv("DATA_FILE", os.path.join(tempfile.gettempdir(), "ai_server_test", "data.csv"))
+REPO_DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data.csv")
+# Rate-limited requests the suite sends; the server's RATE_LIMIT_REQUESTS must allow them
+SUITE_REQUESTS = 50
 
 
 def test_chat_completions():
@@ -16,6 +23,11 @@ def test_chat_completions():
     }
 
     response = requests.post(url, json=payload)
+    limit = int(response.headers.get("x-ratelimit-limit", SUITE_REQUESTS))
+    assert limit >= SUITE_REQUESTS, (
+        f"The server allows {limit} requests per window; start it with RATE_LIMIT_REQUESTS={SUITE_REQUESTS * 20} "
+        "(see Running Tests in README.md)"
+    )
     assert response.status_code == 200
     data = response.json()
     assert "choices" in data
@@ -23,6 +35,46 @@ def test_chat_completions():
     print(f"✓ Chat completions: {content}")
 
 
+def test_chat_multi_turn():
+    """Test a multi-turn conversation with sampling options"""
+    url = f"{SERVER_URL}/v1/chat/completions"
+    payload = {
+        "model": "gpt-5-mini",
+        "messages": [
+            {"role": "system", "content": "Answer with a single word."},
+            {"role": "user", "content": "My name is Ada."},
+            {"role": "assistant", "content": "Noted."},
+            {"role": "user", "content": "What is my name?"},
+        ],
+        "max_tokens": 10,
+        "temperature": 0,
+        "n": 2,
+        "stop": ["\n"],
+    }
+
+    response = requests.post(url, json=payload)
+    assert response.status_code == 200
+    data = response.json()
+    assert [choice["index"] for choice in data["choices"]] == [0, 1]
+    usage = data["usage"]
+    assert usage["total_tokens"] == usage["prompt_tokens"] + usage["completion_tokens"]
+    print(f"✓ Chat multi-turn: {data['choices'][0]['message']['content'].strip()} ({usage['total_tokens']} tokens)")
+
+
+def test_chat_context_too_long():
+    """Test that a prompt that cannot be trimmed to fit is refused with 400 before reaching the model"""
+    payload = {
+        "model": "llama",
+        "messages": [
+            {"role": "system", "content": "Follow these rules. " * 20000},
+            {"role": "user", "content": "Hi"},
+        ],
+    }
+    response = requests.post(f"{SERVER_URL}/v1/chat/completions", json=payload)
+    assert response.status_code == 400, response.text
+    print(f"✓ Chat context too long: {response.json()['detail']}")
+
+
 def escape_json_string(s: str) -> str:
     """Escape a string exactly like Groq playground does"""
     # Replace backslashes first to avoid double escaping
@@ -95,29 +147,166 @@ Thank you for your prompt attention.'''
     assert data["success"] is True
 
     # Show CSV
-    import os
     import csv
 
-    if os.path.exists("data.csv"):
-        with open("data.csv", "r") as f:
+    if os.path.exists(DATA_FILE):
+        with open(DATA_FILE, "r") as f:
             reader = csv.DictReader(f)
             for i, row in enumerate(reader):
                 print(f"Row {i + 1}: {json.dumps(dict(row), separators=(',', ':'))}")
 
 
-def cleanup_csv():
-    """Clean up CSV file after tests"""
-    import os
+def test_prefill_batch():
+    """Test batch prefill endpoint with a mix of valid and invalid items"""
+    url = f"{SERVER_URL}/v1/prefill/batch"
+    payload = [
+        {"email_text": "Invoice from Acme Corp for $1,500.00 USD, due January 15, 2025. Contact: billing@acme.com", "model": "llama"},
+        {"model": "llama"},
+    ]
+
+    response = requests.post(url, json=payload)
+    assert response.status_code == 200
+    data = response.json()
+    assert [r["index"] for r in data["results"]] == [0, 1]
+    assert data["results"][0]["success"] is True
+    assert data["results"][1]["success"] is False
+    print(f"✓ Prefill batch: {data['message']}")
+
+
+def test_prefill_thread():
+    """Test that the quoted reply chain and footer of a thread are not sent to the model"""
+    url = f"{SERVER_URL}/v1/prefill"
+    email_text = """Hi team,
+
+The amount due is $4,250.00 USD, payable by December 5, 2025.
+
+Thanks,
+Maria
+--
+Maria Lopez | Northwind Traders Ltd.
+maria.lopez@northwind.example
+
+On Fri, Oct 31, 2025 at 4:02 PM John Carter <john.carter@client.example> wrote:
+> Could you resend the invoice? Our finance team migrated to a new platform
+> last month and some attachments were lost. Thanks for your patience.
+>
+> John
+
+CONFIDENTIALITY NOTICE: This e-mail message is for the sole use of the intended recipient(s)."""
+
+    response = requests.post(url, json={"email_text": email_text, "model": "llama"})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["success"] is True
+    assert data["tokens_saved"] > 0
+    print(f"✓ Prefill thread: {data['tokens_saved']} tokens saved")
+
+
+def test_prefill_duplicate():
+    """Test that an invoice sent again is reported as a duplicate of the first one"""
+    mode = requests.get(f"{SERVER_URL}/v1/prefill/duplicates").json()["mode"]
+    if mode == "off":
+        print("- Prefill duplicate: skipped, PREFILL_DEDUP_MODE=off")
+        return
+    email_text = "Invoice from Globex Ltd for $2,780.00 USD for the November hosting plan, due December 20, 2025. Contact: ar@globex.example"
+    url = f"{SERVER_URL}/v1/prefill"
+    requests.post(url, json={"email_text": email_text, "model": "llama"})
+    response = requests.post(url, json={"email_text": email_text, "model": "llama"})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["success"] is True
+    assert data["duplicate_of"] is not None
+    print(f"✓ Prefill duplicate: {data['duplicate_of']['match']} match, seen {data['duplicate_of']['seen']} times")
+
+
+def test_prefill_async():
+    """Test async-mode prefill: 202 with a job id, then poll for the result"""
+    import time
+
+    payload = {
+        "email_text": "Invoice from Acme Corp for $1,500.00 USD, due January 15, 2025. Contact: billing@acme.com",
+        "model": "llama",
+        "async_mode": True,
+    }
+    response = requests.post(f"{SERVER_URL}/v1/prefill", json=payload)
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    for _ in range(60):
+        job = requests.get(f"{SERVER_URL}/v1/prefill/{job_id}").json()
+        if job["status"] in ("done", "failed"):
+            break
+        time.sleep(0.5)
+    assert job["status"] == "done", job
+    assert job["result"]["success"] is True
+    print(f"✓ Prefill async job {job_id}: {job['result']['message']}")
+
 
-    if os.path.exists("data.csv"):
-        os.remove("data.csv")
-        print("Cleaned up data.csv file")
+def test_prefill_callback_url():
+    """Test that callbacks to the server's own network are refused"""
+    for callback_url in ("http://127.0.0.1:8090/hook", "http://169.254.169.254/latest", "file:///etc/passwd"):
+        payload = {"email_text": "Invoice from Acme Corp for $10", "model": "llama", "callback_url": callback_url}
+        response = requests.post(f"{SERVER_URL}/v1/prefill", json=payload)
+        assert response.status_code == 422, (callback_url, response.text)
+    print("✓ Prefill callback URL: private and non-http targets refused")
+
+
+def test_invoices():
+    """Test that extracted rows can be queried back and exported"""
+    response = requests.get(f"{SERVER_URL}/v1/invoices", params={"company": "Acme Corp", "limit": 5})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["items"], "expected the rows written by the prefill tests"
+    assert all(item["company"].lower() == "acme corp" for item in data["items"])
+
+    export = requests.get(f"{SERVER_URL}/v1/invoices/export", params={"company": "Acme Corp"})
+    assert export.status_code == 200
+    assert export.text.splitlines()[0] == "amount,currency,due_date,description,company,contact"
+    print(f"✓ Invoices query: {len(data['items'])} rows for Acme Corp")
+
+
+def test_metrics():
+    """Test that /metrics exposes the per-stage prefill histograms"""
+    response = requests.get(f"{SERVER_URL}/metrics")
+    assert response.status_code == 200
+    assert 'ai_server_stage_seconds_count{endpoint="/v1/prefill",stage="llm_call"' in response.text
+    print("✓ Metrics endpoint")
+
+
+def test_health_checks():
+    """Test the liveness and readiness endpoints"""
+    response = requests.get(f"{SERVER_URL}/healthz")
+    assert response.status_code == 200
+    response = requests.get(f"{SERVER_URL}/readyz")
+    assert response.status_code in (200, 503)
+    data = response.json()
+    assert data["checks"]["startup"] is True
+    print(f"✓ Health checks: {data['status']} (startup {data['startup_seconds']:.2f}s)")
+
+
+def cleanup_csv():
+    """Clean up the CSV file the tests wrote to (never the tracked data.csv)"""
+    if os.path.abspath(DATA_FILE) == REPO_DATA_FILE:
+        return
+    if os.path.exists(DATA_FILE):
+        os.remove(DATA_FILE)
+        print(f"Cleaned up {DATA_FILE}")
 
 
 if __name__ == "__main__":
     try:
+        test_health_checks()
         test_chat_completions()
+        test_chat_multi_turn()
+        test_chat_context_too_long()
         test_prefill_simple()
+        test_prefill_batch()
+        test_prefill_thread()
+        test_prefill_duplicate()
+        test_prefill_async()
+        test_prefill_callback_url()
+        test_invoices()
+        test_metrics()
         print("All tests passed!")
     finally:
         cleanup_csv()
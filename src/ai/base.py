@@ -1,7 +1,119 @@
+import json
+import time
+import uuid
+import asyncio
 from abc import ABC, abstractmethod
+from typing import List, Optional, Tuple, Union
+
+
+class _Chunk(dict):
+    """A chat.completion.chunk as a dict, with the one pydantic method the SSE relay uses"""
+
+    def model_dump_json(self, **kwargs) -> str:
+        return json.dumps(self)
+
+
+class _CompletionStream:
+    """A finished completion served as a stream of chunks, one per choice"""
+
+    def __init__(self, completion: dict):
+        self._chunks = [
+            _Chunk(
+                id=completion["id"], object="chat.completion.chunk", created=completion["created"],
+                model=completion["model"],
+                choices=[{"index": choice["index"], "delta": choice["message"], "finish_reason": choice["finish_reason"]}],
+            )
+            for choice in completion["choices"]
+        ]
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> _Chunk:
+        if not self._chunks:
+            raise StopAsyncIteration
+        return self._chunks.pop(0)
+
+    async def close(self):
+        self._chunks = []
+
+
+def limit_reply(content: str, max_tokens: Optional[int] = None,
+                stop: Union[str, List[str], None] = None) -> Tuple[str, str]:
+    """(content, finish_reason) after cutting at the first stop sequence and at max_tokens"""
+    from .context import count_tokens, head_tokens
+
+    stops = [stop] if isinstance(stop, str) else [s for s in stop or [] if s]
+    cuts = [i for i in (content.find(s) for s in stops) if i >= 0]
+    if cuts:
+        content = content[:min(cuts)]
+    if max_tokens is not None and count_tokens(content) > max_tokens:
+        return head_tokens(content, max_tokens), "length"
+    return content, "stop"
 
 
 class AIPlatform(ABC):
     @abstractmethod
-    def chat(self, prompt: str) -> str:
-        pass
\ No newline at end of file
+    def chat(self, prompt: str) -> Union[str, dict]:
+        """The reply: text for chat platforms, the extracted fields for prefill platforms"""
+
+    async def achat(self, prompt: str) -> Union[str, dict]:
+        """Async variant of chat().
+
+        Platforms backed by an async client should override this. The default
+        runs the blocking chat() in a worker thread so it never stalls the
+        event loop.
+        """
+        return await asyncio.to_thread(self.chat, prompt)
+
+
+    async def acomplete(self, messages: list, n: int = 1, **params) -> dict:
+        """
+        OpenAI-style chat completion (choices, usage) for a list of
+        {"role", "content"} messages. params are max_tokens, temperature
+        and stop.
+
+        The default sends the conversation as one prompt to achat(), once per
+        choice, and applies stop and max_tokens to each reply afterwards.
+        achat() has no sampling options, so temperature has no effect here;
+        chat platforms override this.
+        """
+        from .context import count_tokens, prompt_tokens
+
+        if len(messages) == 1:
+            prompt = str(messages[0].get("content") or "")
+        else:
+            prompt = "\n\n".join(f"{m.get('role', 'user')}: {m.get('content') or ''}" for m in messages)
+        replies = await asyncio.gather(*(self.achat(prompt) for _ in range(max(n, 1))))
+        limited = [
+            limit_reply(reply if isinstance(reply, str) else json.dumps(reply), params.get("max_tokens"), params.get("stop"))
+            for reply in replies
+        ]
+        contents = [content for content, _ in limited]
+        prompt_count = prompt_tokens(messages)
+        completion_count = sum(count_tokens(content) for content in contents)
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": str(getattr(self, "model", type(self).__name__)),
+            "choices": [
+                {"index": i, "message": {"role": "assistant", "content": content}, "finish_reason": finish_reason}
+                for i, (content, finish_reason) in enumerate(limited)
+            ],
+            "usage": {
+                "prompt_tokens": prompt_count * len(contents),
+                "completion_tokens": completion_count,
+                "total_tokens": prompt_count * len(contents) + completion_count,
+            },
+        }
+
+    async def astream(self, messages: list, **params):
+        """
+        Start a streaming completion and return an async iterator of
+        OpenAI-style chat.completion.chunk objects; callers close() it.
+
+        The default waits for acomplete() and streams the whole reply as one
+        chunk.
+        """
+        return _CompletionStream(await self.acomplete(messages, **params))
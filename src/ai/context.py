@@ -0,0 +1,198 @@
+"""Fit a chat conversation into the model's context window
+
+fit_messages() keeps the system messages and the newest turns that fit the
+token budget. Older turns are replaced by one short system note quoting the
+start of each, so the model knows what came before without paying for it.
+
+Tokens are counted with tiktoken's cl100k_base encoding, which is not the
+tokenizer of the Llama (or other) models behind the API. For English text the
+counts are within a few percent, so budgets keep CHAT_TOKEN_COUNT_MARGIN of
+the window in reserve. tiktoken downloads the encoding the first time it is
+loaded, which the server does during its startup warm-up (point
+TIKTOKEN_CACHE_DIR at a filled cache on hosts without network access). Without
+tiktoken, or when the encoding cannot be loaded, 4 characters count as one token.
+"""
+
+import os
+import logging
+from dataclasses import dataclass
+from typing import List, Optional
+
+try:
+    import tiktoken
+except ImportError:  # optional: without it tokens are estimated from length
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Tokens the model can take in (prompt + reply); unknown models get the default
+MODEL_CONTEXT_WINDOWS = {
+    "llama-3.1-8b-instant": 131072,
+    "llama-3.3-70b-versatile": 131072,
+    "meta-llama/llama-4-scout-17b-16e-instruct": 131072,
+    "openai/gpt-oss-20b": 131072,
+    "openai/gpt-oss-120b": 131072,
+    "gemma2-9b-it": 8192,
+}
+CHAT_DEFAULT_CONTEXT_WINDOW = int(os.getenv("CHAT_DEFAULT_CONTEXT_WINDOW", "8192"))
+# Upper bound on prompt tokens sent upstream, whatever the window; 0 means the window only
+CHAT_MAX_INPUT_TOKENS = int(os.getenv("CHAT_MAX_INPUT_TOKENS", "16384"))
+# Room kept for the reply when the request does not set max_tokens
+CHAT_DEFAULT_REPLY_TOKENS = int(os.getenv("CHAT_DEFAULT_REPLY_TOKENS", "1024"))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "256"))
+# Share of the window kept free because our token counts only approximate the model's
+CHAT_TOKEN_COUNT_MARGIN = float(os.getenv("CHAT_TOKEN_COUNT_MARGIN", "0.1"))
+
+# Per-message framing the chat format adds around the content (role, separators)
+_MESSAGE_OVERHEAD = 4
+_REPLY_PRIMING = 3
+_SNIPPET_WORDS = 20
+_TRUNCATED = " … [truncated] … "
+
+_encoding = None
+_encoding_failed = False
+
+
+class ContextWindowExceeded(ValueError):
+    """Even trimmed, the prompt does not fit (e.g. the system messages alone are too long)"""
+
+    status_code = 400
+
+
+def load_encoding() -> bool:
+    """Load the tokenizer once; False when tokens are estimated from length instead"""
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed and tiktoken is not None:
+        try:
+            # An approximation: not the Llama tokenizer, see the module docstring
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:  # the download failed or the cache is unreadable
+            _encoding_failed = True
+            logger.warning(f"Could not load the cl100k_base encoding, estimating tokens from length: {e}")
+    return _encoding is not None
+
+
+def _get_encoding():
+    if _encoding is None:
+        load_encoding()
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text or "", disallowed_special=()))
+    return (len(text or "") + 3) // 4
+
+
+def message_tokens(message: dict) -> int:
+    return count_tokens(str(message.get("content") or "")) + _MESSAGE_OVERHEAD
+
+
+def prompt_tokens(messages: List[dict]) -> int:
+    return sum(message_tokens(m) for m in messages) + _REPLY_PRIMING
+
+
+def input_budget(model: str, max_tokens: Optional[int] = None) -> int:
+    """Prompt tokens available for model once the reply and the counting margin have room"""
+    window = MODEL_CONTEXT_WINDOWS.get(model, CHAT_DEFAULT_CONTEXT_WINDOW)
+    budget = int(window * (1 - CHAT_TOKEN_COUNT_MARGIN)) - (max_tokens or CHAT_DEFAULT_REPLY_TOKENS)
+    if CHAT_MAX_INPUT_TOKENS > 0:
+        budget = min(budget, CHAT_MAX_INPUT_TOKENS)
+    return max(budget, 1)
+
+
+def truncate_text(text: str, max_tokens: int) -> str:
+    """Keep the start and end of text, dropping the middle"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    keep = max(max_tokens - count_tokens(_TRUNCATED), 2)
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return encoding.decode(tokens[: keep // 2]) + _TRUNCATED + encoding.decode(tokens[-(keep - keep // 2):])
+    chars = keep * 4
+    return text[: chars // 2] + _TRUNCATED + text[-(chars - chars // 2):]
+
+
+def head_tokens(text: str, max_tokens: int) -> str:
+    """The first max_tokens tokens of text"""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    return text[: max_tokens * 4]
+
+
+def _summary(dropped: List[dict], max_tokens: int) -> Optional[dict]:
+    """A system note quoting the start of each dropped turn, oldest first, within max_tokens"""
+    if max_tokens <= _MESSAGE_OVERHEAD:
+        return None
+    header = f"{len(dropped)} earlier messages were left out. They began:"
+    lines, used = [header], message_tokens({"content": header})
+    for message in dropped:
+        words = str(message.get("content") or "").split()
+        if not words:
+            continue
+        snippet = " ".join(words[:_SNIPPET_WORDS]) + ("…" if len(words) > _SNIPPET_WORDS else "")
+        line = f"- {message.get('role', 'user')}: {snippet}"
+        cost = count_tokens(line) + 1
+        if used + cost > max_tokens:
+            break
+        lines.append(line)
+        used += cost
+    return {"role": "system", "content": "\n".join(lines)}
+
+
+@dataclass
+class FitResult:
+    messages: List[dict]
+    prompt_tokens: int
+    dropped: int = 0
+    tokens_saved: int = 0
+
+
+def fit_messages(messages: List[dict], budget: int, summary_tokens: int = CHAT_SUMMARY_MAX_TOKENS) -> FitResult:
+    """
+    The messages trimmed to at most `budget` prompt tokens. System messages
+    and the last message are always kept (the last one truncated in the
+    middle if it alone is too big); older turns go first. Raises
+    ContextWindowExceeded when even that is over the budget.
+    """
+    costs = [message_tokens(m) for m in messages]
+    total = sum(costs) + _REPLY_PRIMING
+    if total <= budget or not messages:
+        return FitResult(list(messages), total)
+
+    last = len(messages) - 1
+    system = [i for i in range(last) if messages[i].get("role") == "system"]
+    turns = [i for i in range(last) if messages[i].get("role") != "system"]
+    fixed = sum(costs[i] for i in system) + _REPLY_PRIMING
+    summary_budget = min(summary_tokens, max(budget - fixed - costs[last], 0))
+
+    # Newest turns first, as many as fit next to the last message and the summary
+    available = budget - fixed - costs[last] - summary_budget
+    kept = []
+    for i in reversed(turns):
+        if costs[i] > available:
+            break
+        kept.append(i)
+        available -= costs[i]
+    kept_set = set(kept)
+    dropped = [messages[i] for i in turns if i not in kept_set]
+
+    fitted = [messages[i] for i in system]
+    note = _summary(dropped, summary_budget) if dropped else None
+    if note is not None:
+        fitted.append(note)
+    fitted.extend(messages[i] for i in sorted(kept))
+
+    last_message = messages[last]
+    room = budget - prompt_tokens(fitted) - _MESSAGE_OVERHEAD
+    if costs[last] - _MESSAGE_OVERHEAD > room:
+        last_message = dict(last_message, content=truncate_text(str(last_message.get("content") or ""), max(room, 1)))
+    fitted.append(last_message)
+
+    used = prompt_tokens(fitted)
+    if used > budget:
+        raise ContextWindowExceeded(f"The prompt needs {used} tokens after trimming; the model takes {budget}")
+    return FitResult(fitted, used, dropped=len(dropped), tokens_saved=max(total - used, 0))
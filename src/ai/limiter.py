@@ -0,0 +1,275 @@
+"""
+Adaptive concurrency limit per upstream model
+
+Each provider model ("groq:llama-3.1-8b-instant") gets one AdaptiveLimiter,
+shared by the chat and prefill routers. The limit follows AIMD: it doubles
+every round trip until the first sign of congestion (slow start), then grows
+by about one slot per round trip while calls succeed at normal latency. It is
+cut by AI_LIMIT_BACKOFF_RATIO when the upstream answers 429/5xx, times out,
+or its short-term latency rises well above the long-term average. Calls over
+the limit wait in a bounded queue, highest priority (lowest number) first;
+calls that could not finish before their deadline are rejected up front
+instead of queueing only to time out.
+
+The deadline is fixed once per request by DeadlineMiddleware (or by
+start_deadline() for batch items and async jobs), so retries and hedges
+of the same request all count against the same budget.
+"""
+
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from contextvars import ContextVar
+from collections import Counter
+from typing import Dict, Optional
+
+from ..telemetry import metrics
+
+AI_LIMIT_ENABLED = os.getenv("AI_LIMIT_ENABLED", "1") == "1"
+AI_LIMIT_INITIAL = int(os.getenv("AI_LIMIT_INITIAL", "16"))
+AI_LIMIT_MIN = int(os.getenv("AI_LIMIT_MIN", "2"))
+AI_LIMIT_MAX = int(os.getenv("AI_LIMIT_MAX", "256"))
+AI_LIMIT_BACKOFF_RATIO = float(os.getenv("AI_LIMIT_BACKOFF_RATIO", "0.7"))
+# Short-term latency above this multiple of the long-term average counts as congestion
+AI_LIMIT_LATENCY_TOLERANCE = float(os.getenv("AI_LIMIT_LATENCY_TOLERANCE", "2.0"))
+AI_LIMIT_QUEUE_SIZE = int(os.getenv("AI_LIMIT_QUEUE_SIZE", "256"))
+# Deadline for calls that do not set one; matches the provider request timeout by default
+AI_LIMIT_DEFAULT_DEADLINE_SECONDS = float(os.getenv(
+    "AI_LIMIT_DEFAULT_DEADLINE_SECONDS", os.getenv("AI_REQUEST_TIMEOUT_SECONDS", "60")
+))
+
+# Lower runs first
+PRIORITY_INTERACTIVE = 0  # /v1/chat/completions
+PRIORITY_EXTRACTION = 1  # synchronous /v1/prefill
+PRIORITY_BACKGROUND = 2  # batch items and async prefill jobs
+
+# Clients may ask for a shorter deadline, in seconds; longer ones are capped at the default
+DEADLINE_HEADER = b"x-request-timeout"
+
+# Set by request handlers; copied into the tasks the router starts
+request_priority: ContextVar[Optional[int]] = ContextVar("request_priority", default=None)
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)  # time.monotonic()
+
+_LIMIT_EVENTS = metrics.registry.register(metrics.Counter(
+    "ai_server_upstream_limit_events_total", "Concurrency limit cuts and shed calls",
+    ("backend", "event"),
+))
+
+
+class Overloaded(RuntimeError):
+    """The call was shed before reaching the upstream"""
+
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdaptiveLimiter:
+    def __init__(self, name: str, initial: int = AI_LIMIT_INITIAL, min_limit: int = AI_LIMIT_MIN,
+                 max_limit: int = AI_LIMIT_MAX, queue_size: int = AI_LIMIT_QUEUE_SIZE,
+                 backoff_ratio: float = AI_LIMIT_BACKOFF_RATIO,
+                 latency_tolerance: float = AI_LIMIT_LATENCY_TOLERANCE):
+        self.name = name
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.queue_size = queue_size
+        self.backoff_ratio = backoff_ratio
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self.short_latency: Optional[float] = None
+        self.long_latency: Optional[float] = None
+        self._decreased_at = 0.0
+        self._slow_start = True
+        self._waiters = []  # heap of (priority, seq, future); abandoned futures are skipped lazily
+        self._seq = itertools.count()
+        self.queued = 0  # live waiters, kept as counts so acquire() never walks the heap
+        self._queued_by_priority = Counter()
+
+    def _dequeued(self, priority: int):
+        self.queued -= 1
+        self._queued_by_priority[priority] -= 1
+
+    def _expected_latency(self) -> float:
+        return self.short_latency or 0.0
+
+    def _expected_wait(self, priority: int) -> float:
+        """Rough time until a slot frees up for a new call of this priority"""
+        ahead = sum(count for p, count in self._queued_by_priority.items() if p <= priority)
+        return (ahead + 1) / max(self.limit, 1.0) * self._expected_latency()
+
+    def _reject(self, reason: str, message: str):
+        _LIMIT_EVENTS.inc(backend=self.name, event=f"reject_{reason}")
+        raise Overloaded(f"{self.name}: {message}", retry_after=max(self._expected_latency(), 1.0))
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE, deadline: Optional[float] = None,
+                      wait: bool = True):
+        """
+        Take a slot. deadline is a time.monotonic() value; wait=False fails at
+        once instead of queueing (used for hedges). Raises Overloaded.
+        """
+        if self.in_flight < int(self.limit) and not self.queued:
+            self.in_flight += 1
+            return
+        if not wait:
+            self._reject("busy", "no free slot")
+        if self.queued >= self.queue_size:
+            self._reject("queue_full", f"{self.queue_size} calls are already waiting")
+        remaining = None
+        if deadline is not None:
+            # Leave time for the call itself once a slot is free
+            remaining = deadline - time.monotonic() - self._expected_latency()
+            if remaining <= 0 or self._expected_wait(priority) > remaining:
+                self._reject("deadline", "the call would not finish before its deadline")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self.queued += 1
+        self._queued_by_priority[priority] += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(future), remaining)
+        except asyncio.TimeoutError:
+            self._abandon(priority, future)
+            self._reject("deadline", "no slot freed up before the deadline")
+        except asyncio.CancelledError:
+            self._abandon(priority, future)
+            raise
+
+    def _abandon(self, priority: int, future: asyncio.Future):
+        if future.done() and not future.cancelled():
+            self.in_flight -= 1  # granted just as the wait ended
+            self._wake()
+        else:
+            self._dequeued(priority)
+        future.cancel()
+
+    def _wake(self):
+        """Hand free slots to the waiters in priority order"""
+        while self._waiters and self.in_flight < int(self.limit):
+            priority, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self._dequeued(priority)
+            self.in_flight += 1
+            future.set_result(None)
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+
+    def release(self, latency: Optional[float] = None, dropped: bool = False):
+        """
+        Give the slot back. latency is the call's duration when it got an
+        answer; dropped marks a 429/5xx/timeout. Calls that ended without a
+        verdict (cancelled, a 4xx) pass neither and leave the limit alone.
+        """
+        self.in_flight -= 1
+        now = time.monotonic()
+        if dropped:
+            self._decrease(now, "decrease_drop")
+        elif latency is not None:
+            self.short_latency = latency if self.short_latency is None else 0.8 * self.short_latency + 0.2 * latency
+            self.long_latency = latency if self.long_latency is None else 0.98 * self.long_latency + 0.02 * latency
+            if self.short_latency > self.long_latency * self.latency_tolerance:
+                self._decrease(now, "decrease_latency")
+            elif self.in_flight + 1 >= int(self.limit) and self.limit < self.max_limit:
+                # Only grow while the limit is actually the bottleneck
+                step = 1.0 if self._slow_start else 1.0 / self.limit
+                self.limit = min(self.limit + step, float(self.max_limit))
+        self._wake()
+
+    def _decrease(self, now: float, event: str):
+        # At most one cut per round trip: the calls already in flight were
+        # sent under the old limit and will report the same congestion
+        if now - self._decreased_at < max(self._expected_latency(), 0.05):
+            return
+        self._decreased_at = now
+        self._slow_start = False
+        self.limit = max(self.limit * self.backoff_ratio, float(self.min_limit))
+        _LIMIT_EVENTS.inc(backend=self.name, event=event)
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "latency_ms": None if self.short_latency is None else round(self.short_latency * 1000, 3),
+        }
+
+
+class LimiterRegistry:
+    """One limiter per upstream model, whichever router the call comes from"""
+
+    def __init__(self):
+        self._limiters: Dict[str, AdaptiveLimiter] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> AdaptiveLimiter:
+        limiter = self._limiters.get(name)
+        if limiter is None:
+            with self._lock:
+                limiter = self._limiters.setdefault(name, AdaptiveLimiter(name))
+        return limiter
+
+    def all(self) -> list:
+        return list(self._limiters.values())
+
+    def stats(self) -> list:
+        return [limiter.stats() for limiter in self.all()]
+
+
+limiters = LimiterRegistry()
+
+for _name, _doc, _attribute in (
+    ("ai_server_upstream_concurrency_limit", "Current adaptive concurrency limit per upstream model", "limit"),
+    ("ai_server_upstream_in_flight", "Calls in flight per upstream model", "in_flight"),
+    ("ai_server_upstream_queued", "Calls waiting for an upstream slot", "queued"),
+):
+    metrics.registry.register(metrics.LabelledGaugeCallback(
+        _name, _doc, ("backend",),
+        lambda attribute=_attribute: {(limiter.name,): getattr(limiter, attribute) for limiter in limiters.all()},
+    ))
+
+
+def start_deadline(timeout: Optional[float] = None) -> Optional[float]:
+    """
+    Fix the deadline of the current request (or batch item, or job): `timeout`
+    seconds from now, capped at AI_LIMIT_DEFAULT_DEADLINE_SECONDS.
+    """
+    seconds = AI_LIMIT_DEFAULT_DEADLINE_SECONDS
+    if timeout is not None and timeout > 0:
+        seconds = min(timeout, seconds) if seconds > 0 else timeout
+    deadline = time.monotonic() + seconds if seconds > 0 else None
+    request_deadline.set(deadline)
+    return deadline
+
+
+class DeadlineMiddleware:
+    """ASGI middleware that starts each request's deadline as it arrives, honouring X-Request-Timeout"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            timeout = None
+            for name, value in scope.get("headers", []):
+                if name == DEADLINE_HEADER:
+                    try:
+                        timeout = float(value.decode("latin-1"))
+                    except ValueError:
+                        pass
+                    break
+            start_deadline(timeout)
+        await self.app(scope, receive, send)
+
+
+def current_deadline() -> Optional[float]:
+    deadline = request_deadline.get()
+    if deadline is None and AI_LIMIT_DEFAULT_DEADLINE_SECONDS > 0:
+        deadline = time.monotonic() + AI_LIMIT_DEFAULT_DEADLINE_SECONDS
+    return deadline
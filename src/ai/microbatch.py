@@ -0,0 +1,152 @@
+import os
+import asyncio
+import logging
+import itertools
+from typing import Dict, List, Optional
+
+from .base import AIPlatform
+from ..extract.json_repair import ExtractionParseError
+from ..telemetry import metrics
+
+logger = logging.getLogger(__name__)
+
+# Off by default: a batched reply is one model answer for several emails,
+# which trades a little extraction quality for fewer prompt tokens
+PREFILL_MICROBATCH_ENABLED = os.getenv("PREFILL_MICROBATCH_ENABLED", "0") == "1"
+PREFILL_MICROBATCH_WINDOW_MS = float(os.getenv("PREFILL_MICROBATCH_WINDOW_MS", "20"))
+PREFILL_MICROBATCH_MAX_ITEMS = int(os.getenv("PREFILL_MICROBATCH_MAX_ITEMS", "8"))
+# Long emails leave little room for the answer, so a batch is also capped by size
+PREFILL_MICROBATCH_MAX_CHARS = int(os.getenv("PREFILL_MICROBATCH_MAX_CHARS", "16000"))
+
+MICROBATCH_ITEMS = metrics.registry.register(metrics.Counter(
+    "ai_server_prefill_microbatch_items_total",
+    "Prefill extractions by how they were sent: single, batched, or fallback after an unusable batch answer",
+    ("outcome",),
+))
+MICROBATCH_CALLS = metrics.registry.register(metrics.Counter(
+    "ai_server_prefill_microbatch_calls_total", "Batched extraction calls sent upstream", (),
+))
+
+
+class _Batch:
+    def __init__(self, platform: AIPlatform):
+        self.platform = platform
+        self.items: Dict[str, tuple] = {}  # id -> (text, future)
+        self.chars = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class MicroBatcher:
+    """
+    Gathers prefill extractions that arrive within `window_seconds` of each
+    other and sends them as one achat_many() call, so the system prompt is
+    paid once per batch instead of once per email.
+
+    A batch goes out when the window closes, when it has `max_items` emails,
+    or when it reaches `max_chars`. Emails the batched answer misses or
+    garbles are extracted again on their own; upstream errors fail the
+    whole batch, as they would have failed each call.
+    """
+
+    def __init__(self, enabled: bool = PREFILL_MICROBATCH_ENABLED,
+                 window_seconds: float = PREFILL_MICROBATCH_WINDOW_MS / 1000,
+                 max_items: int = PREFILL_MICROBATCH_MAX_ITEMS,
+                 max_chars: int = PREFILL_MICROBATCH_MAX_CHARS):
+        self.enabled = enabled and max_items > 1
+        self.window_seconds = window_seconds
+        self.max_items = max_items
+        self.max_chars = max_chars
+        self._pending: Dict[int, _Batch] = {}  # id(platform) -> batch being filled
+        self._ids = itertools.count(1)
+        self._tasks = set()
+
+    async def submit(self, platform: AIPlatform, text: str) -> dict:
+        if not self.enabled:
+            return await platform.achat(text)
+
+        key = id(platform)
+        batch = self._pending.get(key)
+        if batch is not None and batch.chars + len(text) > self.max_chars:
+            self._flush(key)
+            batch = None
+        if batch is None:
+            batch = self._pending[key] = _Batch(platform)
+            batch.timer = asyncio.get_running_loop().call_later(self.window_seconds, self._flush, key)
+
+        future = asyncio.get_running_loop().create_future()
+        batch.items[str(next(self._ids))] = (text, future)
+        batch.chars += len(text)
+        if len(batch.items) >= self.max_items:
+            self._flush(key)
+        # A caller that goes away must not cancel the extraction of the others
+        return await asyncio.shield(future)
+
+    def _flush(self, key: int):
+        batch = self._pending.pop(key, None)
+        if batch is None:
+            return
+        batch.timer.cancel()
+        task = asyncio.ensure_future(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: _Batch):
+        items = batch.items
+        if len(items) == 1:
+            MICROBATCH_ITEMS.inc(outcome="single")
+            await self._run_single(batch.platform, *next(iter(items.values())))
+            return
+
+        MICROBATCH_CALLS.inc()
+        try:
+            results = await batch.platform.achat_many({item_id: text for item_id, (text, _) in items.items()})
+        except ExtractionParseError as e:
+            logger.warning("Unusable batched extraction for %d emails, extracting them one by one: %s", len(items), e)
+            results = {}
+        except Exception as e:
+            for _, future in items.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        missing: List[tuple] = []
+        for item_id, (text, future) in items.items():
+            if item_id in results:
+                MICROBATCH_ITEMS.inc(outcome="batched")
+                if not future.done():
+                    future.set_result(results[item_id])
+            else:
+                missing.append((text, future))
+        if missing:
+            MICROBATCH_ITEMS.inc(len(missing), outcome="fallback")
+            await asyncio.gather(*(self._run_single(batch.platform, text, future) for text, future in missing))
+
+    async def _run_single(self, platform: AIPlatform, text: str, future: asyncio.Future):
+        try:
+            result = await platform.achat(text)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {"pending": sum(len(batch.items) for batch in self._pending.values()), "running": len(self._tasks)}
+
+
+class BatchingPlatform(AIPlatform):
+    """Wraps a prefill platform so its achat() calls go through a MicroBatcher"""
+
+    def __init__(self, platform: AIPlatform, batcher: MicroBatcher):
+        self.platform = platform
+        self.batcher = batcher
+
+    def __getattr__(self, name):
+        return getattr(self.platform, name)
+
+    def chat(self, prompt: str) -> dict:
+        return self.platform.chat(prompt)
+
+    async def achat(self, prompt: str) -> dict:
+        return await self.batcher.submit(self.platform, prompt)
@@ -1,74 +1,140 @@
-import os
-from openai import OpenAI
+import asyncio
+import logging
 from .base import AIPlatform
-from dotenv import load_dotenv
-load_dotenv()
-
-def load_api_keys():
-    keys = {}
-    if os.path.exists("api_keys.txt"):
-        with open("api_keys.txt", "r") as f:
-            for line in f:
-                if "=" in line:
-                    key, value = line.strip().split("=", 1)
-                    keys[key.strip()] = value.strip()
-    return keys
-
-def load_system_prompt():
-    try:
-        with open("prompts/system_prompt.md", "r") as f:
-            return f.read()
-    except FileNotFoundError:
-        return None
-
-# Load from environment first
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-
-# If not found, fallback to api_keys.txt
-if not GROQ_API_KEY:
-    api_keys = load_api_keys()
-    GROQ_API_KEY = GROQ_API_KEY or api_keys.get("GROQ_API_KEY")
-
-if not GROQ_API_KEY:
-    raise ValueError("GROQ_API_KEY not set in env or api_keys.txt")
+from .context import count_tokens, fit_messages, input_budget, prompt_tokens
+from .prompts import load_prompt
+from .registry import registry
+from .router import Backend, build_router, resolve_route
+from ..settings import settings
+from ..telemetry import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "llama-3.1-8b-instant"
+DEFAULT_SYSTEM_PROMPT = "You are a helpful assistant. Keep answers concise (3–5 sentences max)."
 
 
 class GroqPlatform(AIPlatform):
-    def __init__(self, api_key: str = None, system_prompt: str = None):
-        self.api_key = api_key or os.getenv("GROQ_API_KEY")
-        if not self.api_key:
-            raise ValueError("Groq API key not provided")
+    def __init__(self, api_key: str = None, system_prompt: str = None, model: str = DEFAULT_MODEL,
+                 http_client=None, async_http_client=None, base_url: str = None):
+        # Imported here: the SDK takes longer to import than the rest of the app together
+        from openai import AsyncOpenAI
 
-        self.client = OpenAI(
+        self.api_key = api_key or settings.require_groq_api_key()
+        self.base_url = f"{(base_url or settings.groq_base_url).rstrip('/')}/openai/v1"
+        self._http_client = http_client
+        self._client = None
+        self.async_client = AsyncOpenAI(
             api_key=self.api_key,
-            base_url="https://api.groq.com/openai/v1"
+            base_url=self.base_url,
+            http_client=async_http_client
         )
-        self.model = "llama-3.1-8b-instant"
-        self.system_prompt = system_prompt or self._load_system_prompt()
-
-    def _load_system_prompt(self) -> str:
-        """Load system prompt from prompts/system_prompt.txt if available"""
-        try:
-            with open("prompts/system_prompt.txt", "r", encoding="utf-8") as f:
-                return f.read().strip()
-        except FileNotFoundError:
-            return "You are a helpful assistant. Keep answers concise (3–5 sentences max)."
-        
+        self.model = model
+        self.system_prompt = system_prompt or load_prompt("system_prompt") or DEFAULT_SYSTEM_PROMPT
+
+    @property
+    def client(self):
+        """Blocking client, only built if chat() is used"""
+        if self._client is None:
+            from openai import OpenAI
+            http_client = self._http_client if self._http_client is not None else registry.http_client
+            self._client = OpenAI(api_key=self.api_key, base_url=self.base_url, http_client=http_client)
+        return self._client
+
+    def _fit(self, messages: list, max_tokens: int = None) -> list:
+        """Our system prompt unless the client sent one, trimmed to fit the model's context window"""
+        if self.system_prompt and not any(m.get("role") == "system" for m in messages):
+            messages = [{"role": "system", "content": self.system_prompt}] + list(messages)
+        fit = fit_messages(messages, input_budget(self.model, max_tokens))
+        if fit.tokens_saved:
+            metrics.CHAT_CONTEXT_TRIMMED_TOKENS.inc(fit.tokens_saved, model=self.model)
+            logger.info(f"Trimmed {fit.dropped} old messages ({fit.tokens_saved} tokens) to fit {self.model}")
+        return fit.messages
+
+    def _request_params(self, messages: list, max_tokens: int = None, temperature: float = None, stop=None) -> dict:
+        params = {"model": self.model, "messages": self._fit(messages, max_tokens)}
+        if max_tokens is not None:
+            params["max_tokens"] = max_tokens
+        if temperature is not None:
+            params["temperature"] = temperature
+        if stop:
+            params["stop"] = stop
+        return params
+
+    def _completion(self, responses: list, params: dict) -> dict:
+        """One OpenAI-style completion from one or more upstream responses"""
+        result = responses[0].model_dump(exclude_none=True)
+        choices, usage = [], {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        for response in responses:
+            metrics.record_usage("groq", self.model, response.usage)
+            for choice in response.choices:
+                choice = choice.model_dump(exclude_none=True)
+                choice["index"] = len(choices)
+                choices.append(choice)
+            if response.usage is not None:
+                prompt, completion = response.usage.prompt_tokens, response.usage.completion_tokens
+            else:
+                # Estimated when the provider does not report usage
+                prompt = prompt_tokens(params["messages"])
+                completion = sum(count_tokens(c.message.content or "") for c in response.choices)
+            usage["prompt_tokens"] += prompt
+            usage["completion_tokens"] += completion
+            usage["total_tokens"] += prompt + completion
+        result["choices"], result["usage"] = choices, usage
+        return result
+
     def chat(self, prompt: str) -> str:
-        messages = []
-        if self.system_prompt:
-            messages.append({"role": "system", "content": self.system_prompt})
-        messages.append({"role": "user", "content": prompt})
-
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=messages
-        )
+        params = self._request_params([{"role": "user", "content": prompt}])
+        with metrics.upstream("groq", self.model):
+            response = self.client.chat.completions.create(**params)
+        metrics.record_usage("groq", self.model, response.usage)
         return response.choices[0].message.content.strip()
 
-system_prompt = load_system_prompt()
+    async def achat(self, prompt: str) -> str:
+        completion = await self.acomplete([{"role": "user", "content": prompt}])
+        return completion["choices"][0]["message"]["content"].strip()
+
+    async def _create(self, params: dict):
+        with metrics.upstream("groq", self.model):
+            return await self.async_client.chat.completions.create(**params)
+
+    async def acomplete(self, messages: list, n: int = 1, **params) -> dict:
+        params = self._request_params(messages, **params)
+        # Groq returns one choice per request, so n > 1 is sent as n parallel requests
+        responses = await asyncio.gather(*(self._create(params) for _ in range(max(n, 1))))
+        return self._completion(responses, params)
+
+    async def astream(self, messages: list, **params):
+        """
+        Start a streaming completion and return the provider's async chunk
+        iterator as-is. Callers must close() it if they stop reading early.
+        """
+        return await self.async_client.chat.completions.create(
+            **self._request_params(messages, **params),
+            stream=True
+        )
+
+def _groq_backend(model: str, api_key: str) -> Backend:
+    return registry.get(
+        "groq-chat", api_key, model,
+        lambda: Backend(f"groq:{model}", GroqPlatform(
+            api_key=api_key,
+            model=model,
+            async_http_client=registry.async_http_client,
+        )),
+    )
+
+# Providers a route in AI_MODEL_ROUTES may name
+PROVIDERS = {"groq": _groq_backend}
+
+def get_ai_platform(model_name: str = None, groq_api_key: str = None) -> AIPlatform:
+    """The ModelRouter for model_name; see AI_MODEL_ROUTES in src/ai/router.py"""
+    api_key = groq_api_key or settings.require_groq_api_key()
+    route, targets = resolve_route(model_name, DEFAULT_MODEL)
+
+    def backend(provider: str, model: str) -> Backend:
+        if provider not in PROVIDERS:
+            raise ValueError(f"Unknown provider {provider!r} in route {route!r}")
+        return PROVIDERS[provider](model, api_key)
 
-def get_ai_platform(model_name: str, groq_api_key: str = None) -> AIPlatform:
-    # Since we're only using one model, we'll return the GroqPlatform instance
-    # regardless of the model name input
-    return GroqPlatform(api_key=groq_api_key or GROQ_API_KEY)
+    return registry.get("router-chat", api_key, route, lambda: build_router(route, targets, backend))
@@ -1,21 +1,16 @@
 import os
-import json
-from groq import Groq
+import hashlib
+from typing import Dict
 from .base import AIPlatform
+from .limiter import PRIORITY_EXTRACTION
+from .registry import registry
+from .router import Backend, build_router, resolve_route
+from ..extract.json_repair import ExtractionParseError, parse_extraction, parse_extraction_batch
+from ..settings import settings
+from ..telemetry import metrics
 import logging
-from dotenv import load_dotenv
-load_dotenv()
 
 logger = logging.getLogger(__name__)
-def load_api_keys():
-    keys = {}
-    if os.path.exists("api_keys.txt"):
-        with open("api_keys.txt", "r") as f:
-            for line in f:
-                if "=" in line:
-                    key, value = line.strip().split("=", 1)
-                    keys[key.strip()] = value.strip()
-    return keys
 
 SYSTEM_PROMPT = """You are a specialized JSON data extraction API. You must follow these rules EXACTLY:
 
@@ -39,76 +34,165 @@ Your task is to parse the provided email content and identify the following deta
 
 If a field is not explicitly found in the input text, you MUST use an empty string ("") for its value. Ensure all values are strings, even for amounts."""
 
-# Load from environment first
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+# Changes whenever SYSTEM_PROMPT is edited, so cached extractions made with an
+# older prompt are never served
+SYSTEM_PROMPT_VERSION = hashlib.sha256(SYSTEM_PROMPT.encode("utf-8")).hexdigest()[:12]
 
-# If not found, fallback to api_keys.txt
-if not GROQ_API_KEY:
-    api_keys = load_api_keys()
-    GROQ_API_KEY = GROQ_API_KEY or api_keys.get("GROQ_API_KEY")
+# Several emails in one call (see src/ai/microbatch.py); same fields as SYSTEM_PROMPT
+BATCH_SYSTEM_PROMPT = """You are a specialized JSON data extraction API. You will receive several emails, each starting with a line "### Email <id>". You must follow these rules EXACTLY:
 
-if not GROQ_API_KEY:
-    raise ValueError("GROQ_API_KEY not set in env or api_keys.txt")
+1. Output ONLY a single, valid JSON array with one object per email, in the order given
+2. Each object has an "id" key holding the email's id as a string, plus the keys below
+3. NO text before or after the JSON
+4. Use ONLY double quotes for strings
+5. ALL values must be strings (even numbers)
+6. NO comments, explanations, line breaks within values or trailing commas
+
+""" + SYSTEM_PROMPT[SYSTEM_PROMPT.index("Your task is"):].replace("the provided email content", "each email")
+
+DEFAULT_MODEL = "llama-3.1-8b-instant"
+
+# How many times to ask again when the output has no JSON object that can be repaired
+PREFILL_PARSE_RETRIES = int(os.getenv("PREFILL_PARSE_RETRIES", "1"))
+
+RETRY_PROMPT = (
+    "Your reply could not be parsed. Reply with ONLY the JSON object with the keys "
+    "amount, currency, due_date, description, company and contact."
+)
 
 
 class GroqPlatform(AIPlatform):
-    def __init__(self, api_key: str = None):
-        self.api_key = api_key or os.getenv("GROQ_API_KEY")
-        if not self.api_key:
-            raise ValueError("Groq API key not provided")
+    def __init__(self, api_key: str = None, model: str = DEFAULT_MODEL,
+                 http_client=None, async_http_client=None, base_url: str = None):
+        from groq import AsyncGroq  # imported on first use, not at server start
+
+        self.api_key = api_key or settings.require_groq_api_key()
+        self.base_url = base_url or settings.groq_base_url
+        self._http_client = http_client
+        self._client = None
+        self.async_client = AsyncGroq(api_key=self.api_key, base_url=self.base_url, http_client=async_http_client)
+        self.model = model
+        self.system_prompt = SYSTEM_PROMPT
 
-        self.client = Groq(api_key=self.api_key)
-        self.model = "llama-3.1-8b-instant"
+    @property
+    def client(self):
+        """Blocking client, only built if chat() is used"""
+        if self._client is None:
+            from groq import Groq
+            http_client = self._http_client if self._http_client is not None else registry.http_client
+            self._client = Groq(api_key=self.api_key, base_url=self.base_url, http_client=http_client)
+        return self._client
 
-    def chat(self, email_text: str) -> str:
-        messages = [
+    def _build_messages(self, email_text: str) -> list:
+        return [
             {
                 "role": "system",
-                "content": SYSTEM_PROMPT
+                "content": self.system_prompt
             },
             {
                 "role": "user",
                 "content": email_text
             }
         ]
-        logging.info(f"Prompt: {email_text}")
-        completion = self.client.chat.completions.create(
+
+    def _completion_params(self, email_text: str) -> dict:
+        logger.debug("Prompt: %s", email_text)
+        return dict(
             model=self.model,
-            messages=messages,
+            messages=self._build_messages(email_text),
             temperature=0.1,
             max_completion_tokens=1024,
             top_p=1,
             stream=False,
             stop=None
         )
-        
-        # Get the response content and ensure it's valid JSON
-        response = completion.choices[0].message.content.strip()
-        
-        # Basic cleanup of potential formatting issues
-        response = response.replace('\n', ' ').replace('\r', ' ')
-        response = ' '.join(response.split())  # normalize whitespace
-        
-        try:
-            # Validate JSON by parsing and re-stringifying
-            parsed = json.loads(response)
-            # Ensure all values are strings
-            for key in parsed:
-                parsed[key] = str(parsed[key]).strip()
-            return json.dumps(parsed)
-        except json.JSONDecodeError as e:
-            logging.error(f"Invalid JSON response from model: {response}")
-            # Return a minimal valid JSON if parsing fails
-            return json.dumps({
-                "amount": "",
-                "currency": "",
-                "due_date": "",
-                "description": "",
-                "company": "",
-                "contact": ""
-            })
 
+    def _parse_completion(self, completion) -> dict:
+        metrics.record_usage("groq", self.model, completion.usage)
+        fields, repaired = parse_extraction(completion.choices[0].message.content)
+        metrics.PREFILL_JSON.inc(model=self.model, outcome="repaired" if repaired else "valid")
+        return fields
+
+    def _retry_params(self, email_text: str, completion, error: ExtractionParseError, attempt: int) -> dict:
+        """Ask again, showing the model its unusable reply; raises once retries are used up"""
+        logger.warning("Unusable JSON from model (%s): %s", error, error.output)
+        if attempt >= PREFILL_PARSE_RETRIES:
+            metrics.PREFILL_JSON.inc(model=self.model, outcome="failed")
+            raise error
+        metrics.PREFILL_JSON.inc(model=self.model, outcome="retried")
+        params = self._completion_params(email_text)
+        params["messages"] += [
+            {"role": "assistant", "content": completion.choices[0].message.content or ""},
+            {"role": "user", "content": RETRY_PROMPT},
+        ]
+        return params
+
+    def chat(self, email_text: str) -> dict:
+        """The extracted fields; raises ExtractionParseError if the model never returns usable JSON"""
+        params = self._completion_params(email_text)
+        for attempt in range(PREFILL_PARSE_RETRIES + 1):
+            with metrics.upstream("groq", self.model):
+                completion = self.client.chat.completions.create(**params)
+            try:
+                return self._parse_completion(completion)
+            except ExtractionParseError as e:
+                params = self._retry_params(email_text, completion, e, attempt)
+
+    async def achat(self, email_text: str) -> dict:
+        params = self._completion_params(email_text)
+        for attempt in range(PREFILL_PARSE_RETRIES + 1):
+            with metrics.upstream("groq", self.model):
+                completion = await self.async_client.chat.completions.create(**params)
+            try:
+                return self._parse_completion(completion)
+            except ExtractionParseError as e:
+                params = self._retry_params(email_text, completion, e, attempt)
+
+    async def achat_many(self, emails: Dict[str, str]) -> Dict[str, dict]:
+        """
+        Extract several emails ({id: text}) in one call. Returns {id: fields}
+        for the emails the reply covered; ExtractionParseError when none.
+        """
+        content = "\n\n".join(f"### Email {item_id}\n{text}" for item_id, text in emails.items())
+        params = dict(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": BATCH_SYSTEM_PROMPT},
+                {"role": "user", "content": content},
+            ],
+            temperature=0.1,
+            max_completion_tokens=max(1024, 256 * len(emails)),
+            top_p=1,
+            stream=False,
+            stop=None
+        )
+        with metrics.upstream("groq", self.model):
+            completion = await self.async_client.chat.completions.create(**params)
+        metrics.record_usage("groq", self.model, completion.usage)
+        return parse_extraction_batch(completion.choices[0].message.content, list(emails))
+
+
+def _groq_backend(model: str, api_key: str) -> Backend:
+    return registry.get(
+        "groq-prefill", api_key, model,
+        lambda: Backend(f"groq:{model}", GroqPlatform(
+            api_key=api_key,
+            model=model,
+            async_http_client=registry.async_http_client,
+        ), priority=PRIORITY_EXTRACTION),
+    )
+
+# Providers a route in AI_MODEL_ROUTES may name
+PROVIDERS = {"groq": _groq_backend}
 
 def get_ai_platform(model: str = None, api_key: str = None) -> AIPlatform:
-    # We're only using Groq now, so model parameter is ignored
-    return GroqPlatform(api_key=api_key or GROQ_API_KEY)
+    """The ModelRouter for the requested model; see AI_MODEL_ROUTES in src/ai/router.py"""
+    api_key = api_key or settings.require_groq_api_key()
+    route, targets = resolve_route(model, DEFAULT_MODEL)
+
+    def backend(provider: str, target_model: str) -> Backend:
+        if provider not in PROVIDERS:
+            raise ValueError(f"Unknown provider {provider!r} in route {route!r}")
+        return PROVIDERS[provider](target_model, api_key)
+
+    return registry.get("router-prefill", api_key, route, lambda: build_router(route, targets, backend))
@@ -0,0 +1,15 @@
+import os
+from functools import lru_cache
+from typing import Optional
+
+from ..settings import PROMPTS_DIR
+
+
+@lru_cache(maxsize=None)
+def load_prompt(name: str) -> Optional[str]:
+    """src/prompts/<name>.md, read once per process; None when there is no such file"""
+    try:
+        with open(os.path.join(PROMPTS_DIR, f"{name}.md"), "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,89 @@
+import os
+import threading
+import logging
+from typing import Any, Callable, Dict, Tuple
+
+import httpx
+
+from .base import AIPlatform
+
+logger = logging.getLogger(__name__)
+
+# Connection pool limits shared by every provider client
+AI_MAX_CONNECTIONS = int(os.getenv("AI_MAX_CONNECTIONS", "200"))
+AI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("AI_MAX_KEEPALIVE_CONNECTIONS", "50"))
+AI_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("AI_KEEPALIVE_EXPIRY_SECONDS", "60"))
+AI_CONNECT_TIMEOUT_SECONDS = float(os.getenv("AI_CONNECT_TIMEOUT_SECONDS", "5"))
+AI_REQUEST_TIMEOUT_SECONDS = float(os.getenv("AI_REQUEST_TIMEOUT_SECONDS", "60"))
+
+
+class PlatformRegistry:
+    """
+    Holds one long-lived AIPlatform (or router backend) per (provider, api_key, model).
+
+    All platforms share the same sync and async httpx clients, so repeated
+    requests reuse keep-alive connections instead of opening a new pool (and
+    paying a new TLS handshake) every time.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = AI_MAX_CONNECTIONS,
+        max_keepalive_connections: int = AI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = AI_KEEPALIVE_EXPIRY_SECONDS,
+        connect_timeout: float = AI_CONNECT_TIMEOUT_SECONDS,
+        request_timeout: float = AI_REQUEST_TIMEOUT_SECONDS,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(request_timeout, connect=connect_timeout)
+        self._http_client = None
+        self._async_http_client = None
+        self._platforms: Dict[Tuple[str, str, str], Any] = {}
+        self._lock = threading.RLock()
+
+    @property
+    def http_client(self) -> httpx.Client:
+        if self._http_client is None:
+            with self._lock:
+                if self._http_client is None:
+                    self._http_client = httpx.Client(limits=self.limits, timeout=self.timeout)
+        return self._http_client
+
+    @property
+    def async_http_client(self) -> httpx.AsyncClient:
+        if self._async_http_client is None:
+            with self._lock:
+                if self._async_http_client is None:
+                    self._async_http_client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+        return self._async_http_client
+
+    def get(self, provider: str, api_key: str, model: str, factory: Callable[[], Any]) -> Any:
+        """Return the cached platform for the key, building it with factory() on first use"""
+        key = (provider, api_key, model)
+        platform = self._platforms.get(key)
+        if platform is None:
+            with self._lock:
+                platform = self._platforms.get(key)
+                if platform is None:
+                    logger.info(f"Creating {provider} platform for model {model}")
+                    platform = factory()
+                    self._platforms[key] = platform
+        return platform
+
+    async def aclose(self):
+        """Close the shared connection pools and forget every platform"""
+        with self._lock:
+            http_client, self._http_client = self._http_client, None
+            async_http_client, self._async_http_client = self._async_http_client, None
+            self._platforms.clear()
+        if http_client is not None:
+            http_client.close()
+        if async_http_client is not None:
+            await async_http_client.aclose()
+
+
+registry = PlatformRegistry()
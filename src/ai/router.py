@@ -0,0 +1,452 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from .base import AIPlatform
+from .limiter import (
+    AI_LIMIT_ENABLED, PRIORITY_INTERACTIVE, Overloaded, current_deadline, limiters, request_priority,
+)
+from ..telemetry import metrics
+
+logger = logging.getLogger(__name__)
+
+# model_name -> backends, as JSON: {"llama": ["groq:llama-3.1-8b-instant", "groq:llama-3.3-70b-versatile"]}.
+# A backend without a "provider:" prefix is a Groq model. Names that are not
+# listed use the "default" route.
+AI_MODEL_ROUTES = os.getenv("AI_MODEL_ROUTES", "")
+DEFAULT_ROUTE = "default"
+DEFAULT_PROVIDER = "groq"
+
+AI_ROUTER_HEDGE_ENABLED = os.getenv("AI_ROUTER_HEDGE_ENABLED", "1") == "1"
+AI_ROUTER_HEDGE_DELAY_SECONDS = float(os.getenv("AI_ROUTER_HEDGE_DELAY_SECONDS", "2.0"))  # until p95 is known
+AI_ROUTER_HEDGE_MIN_DELAY_SECONDS = float(os.getenv("AI_ROUTER_HEDGE_MIN_DELAY_SECONDS", "0.05"))
+AI_ROUTER_LATENCY_WINDOW = int(os.getenv("AI_ROUTER_LATENCY_WINDOW", "200"))
+AI_ROUTER_MIN_SAMPLES = int(os.getenv("AI_ROUTER_MIN_SAMPLES", "20"))
+AI_ROUTER_MAX_RETRIES = int(os.getenv("AI_ROUTER_MAX_RETRIES", "2"))
+AI_ROUTER_BACKOFF_BASE_SECONDS = float(os.getenv("AI_ROUTER_BACKOFF_BASE_SECONDS", "0.2"))
+AI_ROUTER_BACKOFF_MAX_SECONDS = float(os.getenv("AI_ROUTER_BACKOFF_MAX_SECONDS", "5.0"))
+AI_ROUTER_BREAKER_FAILURES = int(os.getenv("AI_ROUTER_BREAKER_FAILURES", "5"))
+AI_ROUTER_BREAKER_COOLDOWN_SECONDS = float(os.getenv("AI_ROUTER_BREAKER_COOLDOWN_SECONDS", "30"))
+
+# Client errors that are worth trying again; any other 4xx is the request's fault
+_RETRYABLE_STATUS = {408, 409, 429}
+
+
+class NoBackendAvailable(RuntimeError):
+    pass
+
+
+def parse_routes(spec: str) -> Dict[str, List[Tuple[str, str]]]:
+    """Parse AI_MODEL_ROUTES into {route: [(provider, model), ...]}"""
+    if not spec.strip():
+        return {}
+    routes = {}
+    for name, targets in json.loads(spec).items():
+        if isinstance(targets, str):
+            targets = [targets]
+        parsed = []
+        for target in targets:
+            provider, sep, model = target.partition(":")
+            parsed.append((provider, model) if sep else (DEFAULT_PROVIDER, target))
+        routes[name] = parsed
+    return routes
+
+
+ROUTES = parse_routes(AI_MODEL_ROUTES)
+
+
+def resolve_route(model_name: Optional[str], default_model: str) -> Tuple[str, List[Tuple[str, str]]]:
+    """Map a requested model name to (route name, [(provider, model), ...])"""
+    if model_name in ROUTES:
+        return model_name, ROUTES[model_name]
+    return DEFAULT_ROUTE, ROUTES.get(DEFAULT_ROUTE, [(DEFAULT_PROVIDER, default_model)])
+
+
+def route_label(model_name: Optional[str]) -> str:
+    """The route a requested model name resolves to; a bounded metric label, unlike the raw name"""
+    return model_name if model_name in ROUTES else DEFAULT_ROUTE
+
+
+def is_retryable(exc: BaseException) -> bool:
+    status = getattr(exc, "status_code", None)
+    return status is None or status >= 500 or status in _RETRYABLE_STATUS
+
+
+def backoff_delay(attempt: int, base: float = AI_ROUTER_BACKOFF_BASE_SECONDS,
+                  cap: float = AI_ROUTER_BACKOFF_MAX_SECONDS) -> float:
+    """Exponential backoff with full jitter, so retries from many requests spread out"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for
+    `cooldown_seconds`. After that one trial call is let through (half-open);
+    its result closes the breaker or opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = AI_ROUTER_BREAKER_FAILURES,
+                 cooldown_seconds: float = AI_ROUTER_BREAKER_COOLDOWN_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> bool:
+        """Count a failure; True when this failure opened the breaker"""
+        with self._lock:
+            self.failures += 1
+            reopen = self._trial_in_flight
+            self._trial_in_flight = False
+            if reopen or (self.opened_at is None and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def release(self):
+        """A call that was let through ended without a verdict (e.g. cancelled)"""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class Backend:
+    """
+    One provider model plus the latency and health state the router keeps for
+    it. priority orders its calls in the model's concurrency limiter when the
+    request does not set one.
+    """
+
+    def __init__(self, name: str, platform: AIPlatform, window: int = AI_ROUTER_LATENCY_WINDOW,
+                 priority: int = PRIORITY_INTERACTIVE, limit: bool = AI_LIMIT_ENABLED):
+        self.name = name
+        self.platform = platform
+        self.priority = priority
+        self.breaker = CircuitBreaker()
+        self.limiter = limiters.get(name) if limit else None
+        self._latencies = deque(maxlen=window)
+        self._p95: Optional[float] = None
+        self.ewma: Optional[float] = None
+
+    def observe(self, seconds: float):
+        self._latencies.append(seconds)
+        self.ewma = seconds if self.ewma is None else 0.8 * self.ewma + 0.2 * seconds
+        self._p95 = None
+
+    def p95(self) -> Optional[float]:
+        if len(self._latencies) < AI_ROUTER_MIN_SAMPLES:
+            return None
+        if self._p95 is None:
+            ordered = sorted(self._latencies)
+            self._p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        return self._p95
+
+    def hedge_delay(self) -> float:
+        p95 = self.p95()
+        return max(AI_ROUTER_HEDGE_MIN_DELAY_SECONDS, AI_ROUTER_HEDGE_DELAY_SECONDS if p95 is None else p95)
+
+    async def acquire(self, wait: bool = True):
+        if self.limiter is not None:
+            priority = request_priority.get()
+            await self.limiter.acquire(self.priority if priority is None else priority, current_deadline(), wait)
+
+    def release(self, latency: Optional[float] = None, error: Optional[BaseException] = None):
+        if self.limiter is not None:
+            self.limiter.release(latency, dropped=error is not None and is_retryable(error))
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "breaker": self.breaker.state,
+            "ewma_ms": None if self.ewma is None else round(self.ewma * 1000, 3),
+            "p95_ms": None if self.p95() is None else round(self.p95() * 1000, 3),
+            "samples": len(self._latencies),
+            "limit": None if self.limiter is None else self.limiter.stats(),
+        }
+
+
+class ModelRouter(AIPlatform):
+    """
+    Sends each call to the fastest healthy backend of a route.
+
+    achat() and acomplete() hedge: if the chosen backend has not answered by
+    its own p95, the next backend is started as well and the first answer
+    wins. Failures feed each backend's circuit breaker and are retried on
+    another backend after a jittered backoff.
+    """
+
+    def __init__(self, route: str, backends: List[Backend], hedge: bool = AI_ROUTER_HEDGE_ENABLED,
+                 max_retries: int = AI_ROUTER_MAX_RETRIES):
+        if not backends:
+            raise ValueError(f"Route {route!r} has no backends")
+        self.model = route
+        self.backends = backends
+        self.hedge = hedge
+        self.max_retries = max_retries
+
+    @property
+    def system_prompt(self):
+        return getattr(self.backends[0].platform, "system_prompt", "")
+
+    @property
+    def targets(self) -> str:
+        """The upstream models that may answer, e.g. groq:llama-3.1-8b-instant,groq:llama-3.3-70b-versatile"""
+        return ",".join(sorted(backend.name for backend in self.backends))
+
+    def _candidates(self, exclude=()) -> List[Backend]:
+        """
+        Healthy backends, fastest first. Backends with recent failures go last;
+        unmeasured ones count as fastest so they get measured.
+        """
+        ordered = sorted(
+            (b for b in self.backends if b not in exclude and b.breaker.state != "open"),
+            key=lambda b: (b.breaker.failures > 0, b.ewma or 0.0, self.backends.index(b)),
+        )
+        if not ordered and exclude:
+            return self._candidates()
+        return ordered
+
+    def _event(self, backend: Backend, event: str):
+        metrics.ROUTER_EVENTS.inc(route=self.model, backend=backend.name, event=event)
+
+    def _failed(self, backend: Backend, exc: BaseException):
+        logger.warning(f"Backend {backend.name} failed for route {self.model}: {exc}")
+        if backend.breaker.record_failure():
+            logger.warning(f"Circuit breaker opened for {backend.name}")
+            self._event(backend, "breaker_open")
+
+    async def _call(self, backend: Backend, request: Callable[[AIPlatform], Awaitable[Any]],
+                    wait: bool = True) -> Any:
+        try:
+            await backend.acquire(wait)
+        except BaseException:
+            # Shed before reaching the upstream: says nothing about its health
+            backend.breaker.release()
+            raise
+        started = time.perf_counter()
+        try:
+            result = await request(backend.platform)
+        except asyncio.CancelledError:
+            backend.release()
+            backend.breaker.release()
+            raise
+        except Exception as e:
+            backend.release(error=e)
+            if is_retryable(e):
+                self._failed(backend, e)
+            else:
+                backend.breaker.release()
+            raise
+        elapsed = time.perf_counter() - started
+        backend.release(elapsed)
+        backend.observe(elapsed)
+        backend.breaker.record_success()
+        return result
+
+    def _claim(self, candidates: List[Backend]) -> Optional[Backend]:
+        """First candidate whose breaker lets a call through"""
+        return next((b for b in candidates if b.breaker.allow()), None)
+
+    async def _race(self, primary: Backend, candidates: List[Backend],
+                    request: Callable[[AIPlatform], Awaitable[Any]], tried: set) -> Any:
+        """Run the primary, hedging to the next candidate once the primary passes its p95"""
+        tried.add(primary)
+        tasks = {asyncio.ensure_future(self._call(primary, request)): primary}
+        others = [b for b in candidates if b is not primary]
+        hedge_with = others[0] if self.hedge and others else None
+        errors = []
+        try:
+            while tasks:
+                timeout = primary.hedge_delay() if hedge_with is not None else None
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    backend = tasks.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        if backend is not primary:
+                            self._event(backend, "hedge_win")
+                        return task.result()
+                    if not is_retryable(error):
+                        raise error
+                    errors.append(error)
+                if hedge_with is not None:
+                    # The primary is past its p95 or has already failed: start the hedge
+                    if hedge_with.breaker.allow():
+                        tried.add(hedge_with)
+                        self._event(hedge_with, "hedge")
+                        # A hedge is extra load: only sent if its backend has a free slot
+                        tasks[asyncio.ensure_future(self._call(hedge_with, request, wait=False))] = hedge_with
+                    hedge_with = None
+            raise errors[-1]
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _route(self, request: Callable[[AIPlatform], Awaitable[Any]]) -> Any:
+        """Run request(platform) on the best backend, hedging and failing over as needed"""
+        tried = set()
+        last_error: Optional[BaseException] = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await asyncio.sleep(backoff_delay(attempt - 1))
+            candidates = self._candidates(exclude=tried)
+            primary = self._claim(candidates)
+            if primary is None:
+                break
+            if attempt:
+                self._event(primary, "retry")
+            try:
+                return await self._race(primary, candidates, request, tried)
+            except Exception as e:
+                last_error = e
+                if not is_retryable(e):
+                    raise
+                if isinstance(e, Overloaded) and all(b in tried for b in self.backends):
+                    raise  # every backend is saturated; waiting more only adds load
+        raise last_error or NoBackendAvailable(f"No healthy backend for route {self.model!r}")
+
+    async def achat(self, prompt: str) -> Union[str, dict]:
+        return await self._route(lambda platform: platform.achat(prompt))
+
+    async def acomplete(self, messages: list, **params) -> dict:
+        return await self._route(lambda platform: platform.acomplete(messages, **params))
+
+    async def achat_many(self, prompts: Dict[str, str]) -> Dict[str, Any]:
+        """One call for several prompts, on backends whose platform supports it (prefill)"""
+        return await self._route(lambda platform: platform.achat_many(prompts))
+
+    def chat(self, prompt: str) -> Union[str, dict]:
+        """Blocking variant: failover and retry, without hedging"""
+        tried = set()
+        last_error: Optional[BaseException] = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(backoff_delay(attempt - 1))
+            backend = self._claim(self._candidates(exclude=tried))
+            if backend is None:
+                break
+            tried.add(backend)
+            started = time.perf_counter()
+            try:
+                result = backend.platform.chat(prompt)
+            except Exception as e:
+                last_error = e
+                if not is_retryable(e):
+                    backend.breaker.release()
+                    raise
+                self._failed(backend, e)
+                continue
+            backend.observe(time.perf_counter() - started)
+            backend.breaker.record_success()
+            return result
+        raise last_error or NoBackendAvailable(f"No healthy backend for route {self.model!r}")
+
+    async def astream(self, messages: list, **params):
+        """Fail over until a backend starts streaming; once chunks flow the stream is not retried"""
+        tried = set()
+        last_error: Optional[BaseException] = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await asyncio.sleep(backoff_delay(attempt - 1))
+            backend = self._claim(self._candidates(exclude=tried))
+            if backend is None:
+                break
+            tried.add(backend)
+            try:
+                await backend.acquire()
+            except BaseException as e:
+                backend.breaker.release()
+                if not isinstance(e, Overloaded):
+                    raise
+                last_error = e
+                continue
+            try:
+                stream = await backend.platform.astream(messages, **params)
+            except asyncio.CancelledError:
+                backend.release()
+                backend.breaker.release()
+                raise
+            except Exception as e:
+                backend.release(error=e)
+                last_error = e
+                if not is_retryable(e):
+                    backend.breaker.release()
+                    raise
+                self._failed(backend, e)
+                continue
+            backend.breaker.record_success()
+            # The slot is held until the stream is closed
+            return _SlotStream(stream, backend)
+        raise last_error or NoBackendAvailable(f"No healthy backend for route {self.model!r}")
+
+    def stats(self) -> dict:
+        return {"route": self.model, "backends": [b.stats() for b in self.backends]}
+
+
+class _SlotStream:
+    """A provider stream that gives its backend's limiter slot back when closed or exhausted"""
+
+    def __init__(self, stream, backend: Backend):
+        self._stream = stream
+        self._backend = backend
+        self._released = False
+
+    def _release(self):
+        if not self._released:
+            self._released = True
+            self._backend.release()
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        try:
+            async for chunk in self._stream:
+                yield chunk
+        finally:
+            self._release()
+
+    async def close(self):
+        try:
+            await self._stream.close()
+        finally:
+            self._release()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def build_router(route: str, targets: List[Tuple[str, str]],
+                 backend_factory: Callable[[str, str], Backend]) -> ModelRouter:
+    return ModelRouter(route, [backend_factory(provider, model) for provider, model in targets])
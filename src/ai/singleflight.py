@@ -0,0 +1,102 @@
+import os
+import json
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Dict, Optional, Union
+
+from .base import AIPlatform
+
+# Per-endpoint coalescing settings. The window keeps a finished result around
+# for late duplicates; 0 shares only calls that are still in flight.
+CHAT_COALESCE_ENABLED = os.getenv("CHAT_COALESCE_ENABLED", "1") == "1"
+CHAT_COALESCE_WINDOW_SECONDS = float(os.getenv("CHAT_COALESCE_WINDOW_SECONDS", "0"))
+PREFILL_COALESCE_ENABLED = os.getenv("PREFILL_COALESCE_ENABLED", "1") == "1"
+PREFILL_COALESCE_WINDOW_SECONDS = float(os.getenv("PREFILL_COALESCE_WINDOW_SECONDS", "0"))
+
+
+def coalesce_key(*parts: str) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update((part or "").encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def default_key(platform: AIPlatform, prompt: str) -> str:
+    """Key on (model, system prompt, user content)"""
+    return coalesce_key(
+        getattr(platform, "model", ""),
+        getattr(platform, "system_prompt", ""),
+        prompt,
+    )
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls that share a key into one upstream call.
+
+    The first caller starts the work as its own task; every caller with the
+    same key awaits that task. A caller disconnecting therefore never cancels
+    the upstream call the others are waiting on.
+    """
+
+    def __init__(self, enabled: bool = True, window_seconds: float = 0.0):
+        self.enabled = enabled
+        self.window_seconds = window_seconds
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        if not self.enabled:
+            return await fn()
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.shared += 1
+        else:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_done(key, t))
+        return await asyncio.shield(task)
+
+    def _on_done(self, key: str, task: asyncio.Task):
+        # Failed calls are forgotten straight away so the next caller retries
+        failed = task.cancelled() or task.exception() is not None
+        if failed or self.window_seconds <= 0:
+            self._forget(key, task)
+        else:
+            asyncio.get_running_loop().call_later(self.window_seconds, self._forget, key, task)
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "shared": self.shared, "in_flight": len(self._inflight)}
+
+
+class CoalescingPlatform(AIPlatform):
+    """Wraps a platform so identical concurrent achat() calls share one request"""
+
+    def __init__(self, platform: AIPlatform, flight: SingleFlight,
+                 key_func: Optional[Callable[[AIPlatform, str], str]] = None):
+        self.platform = platform
+        self.flight = flight
+        self.key_func = key_func or default_key
+
+    def __getattr__(self, name):
+        return getattr(self.platform, name)
+
+    def chat(self, prompt: str) -> Union[str, dict]:
+        return self.platform.chat(prompt)
+
+    async def achat(self, prompt: str) -> Union[str, dict]:
+        key = self.key_func(self.platform, prompt)
+        return await self.flight.do(key, lambda: self.platform.achat(prompt))
+
+    async def acomplete(self, messages: list, **params) -> dict:
+        # Callers share the result dict, so it must be treated as read-only
+        key = self.key_func(self.platform, json.dumps({"messages": messages, **params}, sort_keys=True))
+        return await self.flight.do(key, lambda: self.platform.acomplete(messages, **params))
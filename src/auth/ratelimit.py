@@ -1,35 +1,231 @@
+import os
 import time
-from collections import defaultdict
-from fastapi import HTTPException, status
+import math
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Set, Tuple
+from fastapi import HTTPException, Request, Response, status
+from ..settings import BASE_DIR
+from ..telemetry import metrics
 
-GLOBAL_RATE_LIMIT = 3  # Maximum requests per minute
-GLOBAL_TIME_WINDOW_SECONDS = 60  # 1 minute window
+GLOBAL_RATE_LIMIT = int(os.getenv("RATE_LIMIT_REQUESTS", "3"))  # Maximum requests per window
+GLOBAL_TIME_WINDOW_SECONDS = float(os.getenv("RATE_LIMIT_WINDOW_SECONDS", "60"))  # 1 minute window
 
-# Store request timestamps for each user
-user_requests = defaultdict(list)
+# "sqlite" shares buckets across the workers on one host; "memory" keeps them
+# per process, so N workers would allow N times the limit
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "sqlite")
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", os.path.join(BASE_DIR, "ratelimit.db"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
 
-def apply_rate_limit(user_id: str):
+# Per API key overrides, e.g. RATE_LIMIT_PER_KEY="key-abc=120,key-def=10"
+RATE_LIMIT_PER_KEY = os.getenv("RATE_LIMIT_PER_KEY", "")
+# Keys that get a bucket of their own, e.g. RATE_LIMIT_API_KEYS="key-abc,key-def"
+# (keys in RATE_LIMIT_PER_KEY count too). Any other key, or none, is limited
+# by client address, so inventing a new key per request does not help.
+RATE_LIMIT_API_KEYS = os.getenv("RATE_LIMIT_API_KEYS", "")
+
+UNAUTHENTICATED_USER = "global_unauthenticated_user"
+
+
+def _parse_key_limits(spec: str) -> Dict[str, int]:
+    limits = {}
+    for item in spec.split(","):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            limits[key.strip()] = int(value.strip())
+    return limits
+
+
+@dataclass
+class RateLimitResult:
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_after: float  # seconds until the bucket is full again
+    retry_after: float  # seconds until the next request would be allowed
+
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(math.ceil(self.reset_after)),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(math.ceil(self.retry_after))
+        return headers
+
+
+def _take_token(tokens: float, updated: float, now: float, limit: int, window: float) -> Tuple[float, RateLimitResult]:
+    """Refill a token bucket for the elapsed time and try to take one token"""
+    rate = limit / window
+    tokens = min(float(limit), tokens + (now - updated) * rate)
+    allowed = tokens >= 1.0
+    if allowed:
+        tokens -= 1.0
+    result = RateLimitResult(
+        allowed=allowed,
+        limit=limit,
+        remaining=int(tokens),
+        reset_after=(limit - tokens) / rate,
+        retry_after=0.0 if allowed else (1.0 - tokens) / rate,
+    )
+    return tokens, result
+
+
+class MemoryBackend:
     """
-    Apply rate limiting for the specified user.
-    Allows 3 requests per minute per user.
+    Token buckets in an LRU-ordered dict. A bucket idle for a whole window is
+    full again and indistinguishable from a new one, so it is evicted.
+
+    Buckets live in this process only: under ``uvicorn --workers N`` each worker
+    has its own, so the effective limit is up to N times the setting. Only
+    used with RATE_LIMIT_BACKEND=memory.
     """
-    current_time = time.time()
-    time_window = GLOBAL_TIME_WINDOW_SECONDS
 
-    # Clean up old requests
-    user_requests[user_id] = [
-        t for t in user_requests[user_id] 
-        if t > current_time - time_window
-    ]
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, key: str, limit: int, window: float, now: float) -> RateLimitResult:
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (float(limit), now))
+            tokens, result = _take_token(tokens, updated, now, limit, window)
+            self._buckets[key] = (tokens, now)
+            self._evict(now, window)
+            return result
+
+    def _evict(self, now: float, window: float):
+        while self._buckets:
+            oldest_key, (_, updated) = next(iter(self._buckets.items()))
+            if now - updated < window and len(self._buckets) <= self.max_keys:
+                break
+            del self._buckets[oldest_key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SQLiteBackend:
+    """
+    Token buckets in a SQLite WAL database so every uvicorn worker on the host
+    shares one limit. Each check is a single short IMMEDIATE transaction.
+    """
+
+    _PRUNE_EVERY = 1000
+
+    def __init__(self, path: str = RATE_LIMIT_DB):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit_buckets ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+        self._checks = 0
 
-    # Check if user has exceeded rate limit
-    if len(user_requests[user_id]) >= GLOBAL_RATE_LIMIT:
-        remaining_time = int(time_window - (current_time - user_requests[user_id][0]))
+    def take(self, key: str, limit: int, window: float, now: float) -> RateLimitResult:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT tokens, updated FROM rate_limit_buckets WHERE key = ?", (key,)
+                ).fetchone()
+                tokens, updated = row if row else (float(limit), now)
+                tokens, result = _take_token(tokens, updated, now, limit, window)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO rate_limit_buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                    (key, tokens, now),
+                )
+                self._checks += 1
+                if self._checks % self._PRUNE_EVERY == 0:
+                    # Idle buckets have refilled completely; drop them
+                    self._conn.execute("DELETE FROM rate_limit_buckets WHERE updated < ?", (now - window,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return result
+
+
+class RateLimiter:
+    """O(1) token-bucket limiter with per-key limits"""
+
+    def __init__(self, backend=None, limit: int = GLOBAL_RATE_LIMIT,
+                 window_seconds: float = GLOBAL_TIME_WINDOW_SECONDS,
+                 key_limits: Optional[Dict[str, int]] = None,
+                 api_keys: Optional[Set[str]] = None):
+        self.backend = backend or MemoryBackend()
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self.key_limits = key_limits or {}
+        self.api_keys = set(api_keys or ()) | set(self.key_limits)
+
+    def is_known_key(self, api_key: str) -> bool:
+        return api_key in self.api_keys
+
+    def check(self, user_id: str) -> RateLimitResult:
+        limit = self.key_limits.get(user_id, self.limit)
+        # Never keep raw API keys in the bucket store
+        bucket_key = hashlib.sha256(user_id.encode("utf-8")).hexdigest()[:32]
+        return self.backend.take(bucket_key, limit, self.window_seconds, time.time())
+
+
+def _build_limiter() -> RateLimiter:
+    backend = MemoryBackend() if RATE_LIMIT_BACKEND == "memory" else SQLiteBackend(RATE_LIMIT_DB)
+    api_keys = {key.strip() for key in RATE_LIMIT_API_KEYS.split(",") if key.strip()}
+    return RateLimiter(backend=backend, key_limits=_parse_key_limits(RATE_LIMIT_PER_KEY), api_keys=api_keys)
+
+
+limiter = _build_limiter()
+
+
+def apply_rate_limit(user_id: str) -> RateLimitResult:
+    """
+    Apply rate limiting for the specified user.
+    Allows GLOBAL_RATE_LIMIT requests per GLOBAL_TIME_WINDOW_SECONDS per user,
+    unless RATE_LIMIT_PER_KEY sets a different limit for that key.
+    """
+    result = limiter.check(user_id)
+    if not result.allowed:
         raise HTTPException(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-            detail=f"Rate limit exceeded. Please try again in {remaining_time} seconds. Limit is {GLOBAL_RATE_LIMIT} requests per {time_window} seconds."
+            detail=f"Rate limit exceeded. Please try again in {math.ceil(result.retry_after)} seconds. Limit is {result.limit} requests per {limiter.window_seconds:g} seconds.",
+            headers=result.headers(),
         )
+    return result
+
+
+def get_api_key(request: Request) -> str:
+    """The API key the caller sent (Bearer token or X-API-Key header), or an empty string"""
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        return authorization[7:].strip()
+    return request.headers.get("x-api-key", "").strip()
+
+
+def get_client_id(request: Request) -> str:
+    """
+    Identify the caller: a configured API key, otherwise the client address.
+    Unknown keys are not trusted as an identity, or a client could get a fresh
+    bucket on every request by sending a new key.
+    """
+    api_key = get_api_key(request)
+    if api_key and limiter.is_known_key(api_key):
+        return api_key
+    return f"ip:{request.client.host}" if request.client else UNAUTHENTICATED_USER
+
 
-    # Add current request timestamp
-    user_requests[user_id].append(current_time)
-    return True
\ No newline at end of file
+def rate_limit(request: Request, response: Response) -> RateLimitResult:
+    """FastAPI dependency: rate limit by API key or client address and add X-RateLimit-* headers"""
+    with metrics.stage(request.url.path, "rate_limit"):
+        result = apply_rate_limit(get_client_id(request))
+    response.headers.update(result.headers())
+    request.state.rate_limit = result
+    return result
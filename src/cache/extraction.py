@@ -0,0 +1,193 @@
+import os
+import time
+import asyncio
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+PREFILL_CACHE_MAX_ENTRIES = int(os.getenv("PREFILL_CACHE_MAX_ENTRIES", "10000"))
+PREFILL_CACHE_TTL_SECONDS = float(os.getenv("PREFILL_CACHE_TTL_SECONDS", "86400"))  # 1 day
+PREFILL_CACHE_DB = os.getenv("PREFILL_CACHE_DB", "")  # empty means memory only
+
+# How many writes between sweeps of expired rows in the SQLite backend
+_DISK_PRUNE_EVERY = 500
+
+
+def make_cache_key(cleaned_email: str, model: str, prompt_version: str) -> str:
+    """
+    Content-address an extraction by the cleaned email, model and prompt
+    version. `model` names the upstream model(s) that answer, not the route
+    the client asked for, so re-pointing a route does not serve stale entries.
+    """
+    digest = hashlib.sha256()
+    for part in (model, prompt_version, cleaned_email):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """
+    LRU + TTL cache for prefill extractions.
+
+    Entries live in an in-memory OrderedDict. When db_path is set they are
+    also written to a SQLite table, so cached extractions survive restarts
+    and can be shared by workers on the same host. aget()/aset() do the
+    SQLite part in a worker thread, as the CSV sink does, so it never blocks
+    the event loop; the in-memory part stays inline.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = PREFILL_CACHE_MAX_ENTRIES,
+        ttl_seconds: float = PREFILL_CACHE_TTL_SECONDS,
+        db_path: Optional[str] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()  # the in-memory entries and counters
+        self._db_lock = threading.Lock()
+        self._db = None
+        self._writes_since_prune = 0
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self.expirations = 0
+        if db_path:
+            self._open_db(db_path)
+
+    def _open_db(self, db_path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS extraction_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._get_memory(key)
+        if value is None and self._db is not None:
+            return self._get_disk(key)
+        if value is None:
+            self._miss()
+        return value
+
+    async def aget(self, key: str) -> Optional[str]:
+        """get() with the SQLite lookup, when one is needed, in a worker thread"""
+        value = self._get_memory(key)
+        if value is None and self._db is not None:
+            return await asyncio.to_thread(self._get_disk, key)
+        if value is None:
+            self._miss()
+        return value
+
+    def set(self, key: str, value: str):
+        self._persist(key, value, self._set_memory(key, value))
+
+    async def aset(self, key: str, value: str):
+        """set() with the SQLite write in a worker thread"""
+        expires_at = self._set_memory(key, value)
+        if self._db is not None:
+            await asyncio.to_thread(self._persist, key, value, expires_at)
+
+    def _miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def _get_memory(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+            self.expirations += 1
+            return None
+
+    def _get_disk(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._db_lock:
+            row = None if self._db is None else self._db.execute(
+                "SELECT value, expires_at FROM extraction_cache WHERE key = ?", (key,)
+            ).fetchone()
+        with self._lock:
+            if row is not None and row[1] > now:
+                self._remember(key, row[1], row[0])
+                self.hits += 1
+                self.disk_hits += 1
+                return row[0]
+            self.misses += 1
+            return None
+
+    def _set_memory(self, key: str, value: str) -> float:
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._remember(key, expires_at, value)
+        return expires_at
+
+    def _persist(self, key: str, value: str, expires_at: float):
+        with self._db_lock:
+            if self._db is None:
+                return
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO extraction_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, expires_at),
+                )
+                self._writes_since_prune += 1
+                if self._writes_since_prune >= _DISK_PRUNE_EVERY:
+                    self._db.execute("DELETE FROM extraction_cache WHERE expires_at <= ?", (time.time(),))
+                    self._writes_since_prune = 0
+            except sqlite3.Error as e:
+                logger.warning(f"Could not persist extraction cache entry: {e}")
+
+    def _remember(self, key: str, expires_at: float, value: str):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        with self._db_lock:
+            if self._db is not None:
+                self._db.execute("DELETE FROM extraction_cache")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "persistent": self._db is not None,
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def close(self):
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
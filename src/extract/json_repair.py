@@ -0,0 +1,271 @@
+"""Pull the extraction object out of model output
+
+Models wrap the JSON in code fences or prose, leave trailing commas, use
+single quotes or forget to quote keys. parse_extraction() finds the first
+JSON object, repairs those defects and checks it against the extraction
+fields, returning a dict of strings. ExtractionParseError means the output
+could not be saved and the model has to be asked again.
+parse_extraction_batch() does the same for a reply covering several emails.
+"""
+
+import json
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .rules import FIELDS
+
+_BARE_WORDS = {"true": "true", "false": "false", "null": "null", "True": "true", "False": "false", "None": "null"}
+_VALUE_START = "{[,:"
+
+
+class ExtractionParseError(ValueError):
+    # The backend answered and is healthy; its output was not usable. The
+    # model router treats this like a 4xx: no failover, no breaker failure.
+    status_code = 422
+
+    def __init__(self, message: str, output: str = ""):
+        super().__init__(message)
+        self.output = output
+
+
+class ObjectScanner:
+    """
+    Finds the first top-level {...} in text fed to it chunk by chunk.
+
+    String and escape state are tracked, so braces inside values, and
+    prose or code fences around the object, are skipped. feed() returns True
+    once the object is closed; text() is the object so far.
+    """
+
+    def __init__(self):
+        self._parts: List[str] = []
+        self._closers: List[str] = []
+        self._quote: Optional[str] = None
+        self._escaped = False
+        self.complete = False
+
+    def feed(self, chunk: str) -> bool:
+        if self.complete:
+            return True
+        start = 0
+        if not self._closers:
+            start = chunk.find("{")
+            if start < 0:
+                return False
+        for i in range(start, len(chunk)):
+            c = chunk[i]
+            if self._quote is not None:
+                if self._escaped:
+                    self._escaped = False
+                elif c == "\\":
+                    self._escaped = True
+                elif c == self._quote:
+                    self._quote = None
+            elif c == '"' or (c == "'" and self._closers):
+                self._quote = c
+            elif c in "{[":
+                self._closers.append("}" if c == "{" else "]")
+            elif c in "}]" and self._closers:
+                self._closers.pop()
+                if not self._closers:
+                    self._parts.append(chunk[start:i + 1])
+                    self.complete = True
+                    return True
+        self._parts.append(chunk[start:])
+        return False
+
+    @property
+    def in_string(self) -> bool:
+        return self._quote is not None
+
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def closers(self) -> str:
+        """What would close the object if the text stopped here"""
+        return "".join(reversed(self._closers))
+
+
+def _skip_space(text: str, i: int) -> int:
+    while i < len(text) and text[i].isspace():
+        i += 1
+    return i
+
+
+def _repair(text: str) -> str:
+    """
+    One pass over an almost-JSON object: single quotes become double quotes,
+    bare keys and words are quoted, Python literals are mapped, comments and
+    trailing commas are dropped and missing commas between members are added.
+    """
+    out: List[str] = []
+    last = ""  # last significant character written
+    i, n = 0, len(text)
+
+    def emit_value(token: str):
+        nonlocal last
+        if last and last not in _VALUE_START:
+            out.append(",")  # '"a": "1" "b": "2"'
+        out.append(token)
+        last = token[-1]
+
+    while i < n:
+        c = text[i]
+        if c in "\"'":
+            j, chars = i + 1, []
+            while j < n and text[j] != c:
+                if text[j] == "\\" and j + 1 < n:
+                    chars.append("'" if text[j + 1] == "'" else text[j:j + 2])
+                    j += 2
+                    continue
+                chars.append('\\"' if c == "'" and text[j] == '"' else text[j])
+                j += 1
+            emit_value('"' + "".join(chars) + '"')
+            i = j + 1
+        elif text.startswith("//", i):
+            end = text.find("\n", i)
+            i = n if end < 0 else end
+        elif text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            i = n if end < 0 else end + 2
+        elif c == ",":
+            following = _skip_space(text, i + 1)
+            if last not in _VALUE_START and not (following < n and text[following] in "}],"):
+                out.append(",")
+                last = ","
+            i += 1
+        elif c.isalpha() or c == "_":
+            j = i
+            while j < n and (text[j].isalnum() or text[j] in "_-$"):
+                j += 1
+            word = text[i:j]
+            following = _skip_space(text, j)
+            if following < n and text[following] == ":":
+                emit_value(json.dumps(word))
+            else:
+                emit_value(_BARE_WORDS.get(word) or json.dumps(word))
+            i = j
+        elif c.isdigit() or c in "-.":
+            j = i
+            while j < n and (text[j].isdigit() or text[j] in "-+.eE"):
+                j += 1
+            emit_value(text[i:j])
+            i = j
+        elif c.isspace():
+            out.append(c)
+            i += 1
+        else:
+            if c in "{[" and last and last not in _VALUE_START:
+                out.append(",")
+            out.append(c)
+            last = c
+            i += 1
+    return "".join(out)
+
+
+def _key(name: str) -> str:
+    return name.strip().lower().replace(" ", "_").replace("-", "_")
+
+
+def _validate(obj, fields: List[str], output: str) -> dict:
+    """The extraction fields as stripped strings; missing fields become ''"""
+    if not isinstance(obj, dict):
+        raise ExtractionParseError(f"expected a JSON object, got {type(obj).__name__}", output)
+    found = {_key(str(name)): value for name, value in obj.items()}
+    if not any(name in found for name in fields):
+        nested = [value for value in obj.values() if isinstance(value, dict)]
+        if len(nested) == 1:  # {"invoice": {...}}
+            return _validate(nested[0], fields, output)
+        raise ExtractionParseError(f"none of the fields {', '.join(fields)} in the JSON object", output)
+    result = {}
+    for name in fields:
+        value = found.get(name)
+        if value is None:
+            value = ""
+        elif isinstance(value, (dict, list)):
+            value = json.dumps(value, ensure_ascii=False)
+        result[name] = " ".join(str(value).split())
+    return result
+
+
+def parse_extraction(output: str, fields: List[str] = FIELDS) -> Tuple[dict, bool]:
+    """
+    (fields dict, whether it needed repair) for a model response.
+    Raises ExtractionParseError when no usable object can be recovered.
+    """
+    output = output or ""
+    try:
+        return _validate(json.loads(output), fields, output), False
+    except (json.JSONDecodeError, ExtractionParseError):
+        pass
+
+    scanner = ObjectScanner()
+    scanner.feed(output)
+    candidate = scanner.text()
+    if not candidate:
+        raise ExtractionParseError("no JSON object in the output", output)
+    if not scanner.complete:
+        if scanner.in_string:
+            # Cut off mid-value: whatever is there may be truncated, ask again
+            raise ExtractionParseError("the output ends inside the JSON object", output)
+        candidate += scanner.closers()  # only the closing brackets are missing
+
+    for text in (candidate, _repair(candidate)):
+        try:
+            return _validate(json.loads(text, strict=False), fields, output), True
+        except json.JSONDecodeError:
+            continue
+    raise ExtractionParseError("the JSON object could not be repaired", output)
+
+
+def _load_batch(output: str):
+    try:
+        return json.loads(output)
+    except json.JSONDecodeError:
+        pass
+    # Fences or prose around the array: take the outermost brackets
+    start = min((i for i in (output.find("["), output.find("{")) if i >= 0), default=-1)
+    end = max(output.rfind("]"), output.rfind("}"))
+    if start < 0 or end <= start:
+        raise ExtractionParseError("no JSON array in the output", output)
+    candidate = output[start:end + 1]
+    for text in (candidate, _repair(candidate)):
+        try:
+            return json.loads(text, strict=False)
+        except json.JSONDecodeError:
+            continue
+    raise ExtractionParseError("the JSON array could not be repaired", output)
+
+
+def parse_extraction_batch(output: str, ids: Sequence[str], fields: List[str] = FIELDS) -> Dict[str, dict]:
+    """
+    {id: fields dict} for a reply that should hold one object per email,
+    either [{"id": ..., <fields>}, ...] or {id: {<fields>}, ...}. Items that
+    are missing or unusable are left out, so the caller can extract them on
+    their own; ExtractionParseError when nothing in the reply is usable.
+    """
+    output = output or ""
+    data = _load_batch(output)
+    if isinstance(data, dict):
+        nested = [value for value in data.values() if isinstance(value, list)]
+        if len(nested) == 1:  # {"results": [...]}
+            data = nested[0]
+        else:
+            data = [dict(value, id=key) for key, value in data.items() if isinstance(value, dict)]
+    if not isinstance(data, list):
+        raise ExtractionParseError(f"expected a JSON array, got {type(data).__name__}", output)
+
+    wanted = {str(item_id) for item_id in ids}
+    results = {}
+    for obj in data:
+        if not isinstance(obj, dict):
+            continue
+        item_id = str(obj.get("id", "")).strip()
+        if item_id not in wanted or item_id in results:
+            continue
+        try:
+            results[item_id] = _validate({k: v for k, v in obj.items() if k != "id"}, fields, output)
+        except ExtractionParseError:
+            continue
+    if not results:
+        raise ExtractionParseError("no usable item in the JSON array", output)
+    return results
@@ -0,0 +1,267 @@
+"""Normalize extracted invoice fields to typed, canonical values
+
+amount   -> plain decimal string with the currency's minor units ("5320.00")
+currency -> ISO-4217 code ("USD")
+due_date -> ISO-8601 date ("2025-11-25")
+
+Values that cannot be parsed are kept as they were, so nothing the model
+extracted is lost. normalize_columns() does the same for whole columns by
+normalizing each distinct value once, which is how an existing data.csv is
+re-normalized in one pass:
+
+    python -m src.extract.normalize data.csv
+"""
+
+import gc
+import os
+import re
+import csv
+import sys
+import time
+import argparse
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from functools import lru_cache
+from typing import Callable, Dict, Hashable, List, Optional, Sequence
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, run a single worker there
+    fcntl = None
+
+PREFILL_NORMALIZE_ENABLED = os.getenv("PREFILL_NORMALIZE_ENABLED", "1") == "1"
+
+ISO_CURRENCIES = {
+    "AED", "ARS", "AUD", "BRL", "CAD", "CHF", "CLP", "CNY", "COP", "CZK", "DKK", "EGP", "EUR", "GBP",
+    "HKD", "HUF", "IDR", "ILS", "INR", "JPY", "KES", "KRW", "MXN", "MYR", "NGN", "NOK", "NZD", "PEN",
+    "PHP", "PKR", "PLN", "RON", "RUB", "SAR", "SEK", "SGD", "THB", "TRY", "TWD", "UAH", "USD", "VND", "ZAR",
+}
+# Currencies without minor units; everything else gets two decimals
+_ZERO_DECIMAL = {"CLP", "IDR", "JPY", "KRW", "VND"}
+# Currencies that usually write "1.234,56"
+_COMMA_DECIMAL = {"BRL", "CZK", "DKK", "EUR", "HUF", "IDR", "NOK", "PLN", "RON", "RUB", "SEK", "TRY", "UAH", "VND"}
+
+# Longest first, so "US$" wins over "$"
+_SYMBOLS = [
+    ("US$", "USD"), ("CA$", "CAD"), ("AU$", "AUD"), ("NZ$", "NZD"), ("HK$", "HKD"), ("R$", "BRL"),
+    ("C$", "CAD"), ("A$", "AUD"), ("S$", "SGD"), ("Fr.", "CHF"), ("zł", "PLN"),
+    ("$", "USD"), ("€", "EUR"), ("£", "GBP"), ("¥", "JPY"), ("₹", "INR"), ("₩", "KRW"),
+    ("₽", "RUB"), ("₺", "TRY"), ("₪", "ILS"), ("₱", "PHP"), ("₫", "VND"),
+]
+_NAMES = [
+    (re.compile(r"\b(?:canadian dollars?)\b", re.I), "CAD"),
+    (re.compile(r"\b(?:australian dollars?)\b", re.I), "AUD"),
+    (re.compile(r"\b(?:us dollars?|dollars?|bucks)\b", re.I), "USD"),
+    (re.compile(r"\b(?:euros?)\b", re.I), "EUR"),
+    (re.compile(r"\b(?:pounds?(?: sterling)?|sterling)\b", re.I), "GBP"),
+    (re.compile(r"\b(?:yen)\b", re.I), "JPY"),
+    (re.compile(r"\b(?:rupees?)\b", re.I), "INR"),
+    (re.compile(r"\b(?:swiss francs?|francs?)\b", re.I), "CHF"),
+    (re.compile(r"\b(?:yuan|renminbi|rmb)\b", re.I), "CNY"),
+]
+_CODE_RE = re.compile(r"\b[A-Z]{3}\b")
+_NUMBER_RE = re.compile(r"\d(?:[\d.,' \u00a0\u202f]*\d)?")
+_PLAIN_NUMBER_RE = re.compile(r"-?\d+(?:\.\d{1,2})?$")
+_GROUPING_RE = re.compile(r"[' \u00a0\u202f]")
+
+# Formats the extraction prompt and the rule extractor produce for due_date
+DATE_FORMATS = ("%B %d, %Y", "%b %d, %Y", "%B %d %Y", "%b %d %Y", "%d %B %Y", "%d %b %Y", "%m/%d/%Y", "%d.%m.%Y")
+_ORDINAL_RE = re.compile(r"(\d{1,2})(?:st|nd|rd|th)\b", re.I)
+_MONTH_DOT_RE = re.compile(r"\b([A-Za-z]{3,4})\.")
+_SLASH_DATE_RE = re.compile(r"^(\d{1,2})/(\d{1,2})/(\d{4})$")
+
+
+@lru_cache(maxsize=1024)
+def normalize_currency(text: str, amount_text: str = "") -> str:
+    """ISO-4217 code for a currency field, falling back to symbols in the amount"""
+    for candidate in (text or "", amount_text or ""):
+        candidate = candidate.strip()
+        if not candidate:
+            continue
+        for code in _CODE_RE.findall(candidate.upper()):
+            if code in ISO_CURRENCIES:
+                return code
+        for symbol, code in _SYMBOLS:
+            if symbol in candidate:
+                return code
+        for pattern, code in _NAMES:
+            if pattern.search(candidate):
+                return code
+    return (text or "").strip()
+
+
+def parse_amount(text: str, currency: str = "") -> Optional[Decimal]:
+    """
+    The number in an amount: "$5,320 USD" -> 5320, "€2.400,50" -> 2400.50,
+    "CHF 1'250.00" -> 1250.00. None when there is no number.
+    """
+    text = text or ""
+    if _PLAIN_NUMBER_RE.match(text):
+        return Decimal(text)  # already normalized
+    match = _NUMBER_RE.search(text)
+    if match is None:
+        return None
+    number = _GROUPING_RE.sub("", match.group(0))
+    last_dot, last_comma = number.rfind("."), number.rfind(",")
+    if last_dot >= 0 and last_comma >= 0:
+        decimal_mark = "." if last_dot > last_comma else ","
+    elif last_comma >= 0 or last_dot >= 0:
+        mark = "," if last_comma >= 0 else "."
+        digits_after = len(number) - number.rfind(mark) - 1
+        if number.count(mark) > 1:
+            decimal_mark = None  # "1,234,567"
+        elif digits_after == 3:
+            # "5,320" is thousands; so is "2.400" for currencies that write "2.400,00"
+            comma_decimal = currency.upper() in _COMMA_DECIMAL
+            decimal_mark = "." if mark == "." and not comma_decimal else None
+        else:
+            decimal_mark = mark
+    else:
+        decimal_mark = None
+
+    if decimal_mark is None:
+        number = number.replace(",", "").replace(".", "")
+    else:
+        thousands = "," if decimal_mark == "." else "."
+        number = number.replace(thousands, "").replace(decimal_mark, ".")
+    try:
+        value = Decimal(number)
+    except InvalidOperation:
+        return None
+    prefix = text[: match.start()]
+    if "-" in prefix[-2:] or ("(" in prefix and ")" in text[match.end():]):
+        value = -value
+    return value
+
+
+@lru_cache(maxsize=8192)
+def normalize_amount(text: str, currency: str = "") -> str:
+    value = parse_amount(text, currency)
+    if value is None:
+        return (text or "").strip()
+    places = Decimal(1) if currency.upper() in _ZERO_DECIMAL else Decimal("0.01")
+    return str(value.quantize(places, rounding=ROUND_HALF_UP))
+
+
+@lru_cache(maxsize=4096)  # due dates repeat a lot across invoices
+def parse_date(text: str) -> Optional[date]:
+    text = (text or "").strip()
+    try:
+        return date.fromisoformat(text)
+    except ValueError:
+        pass
+    cleaned = _MONTH_DOT_RE.sub(r"\1", _ORDINAL_RE.sub(r"\1", text)).replace("Sept ", "Sep ")
+    slash = _SLASH_DATE_RE.match(cleaned)
+    if slash and int(slash.group(1)) > 12:
+        cleaned = f"{slash.group(2)}/{slash.group(1)}/{slash.group(3)}"  # 25/11/2025 is day-first
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(cleaned, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def normalize_date(text: str) -> str:
+    parsed = parse_date(text)
+    return parsed.isoformat() if parsed else (text or "").strip()
+
+
+def normalize_row(row: dict) -> dict:
+    """Normalize the amount, currency and due_date of one extracted row"""
+    row = dict(row)
+    currency = normalize_currency(str(row.get("currency") or ""), str(row.get("amount") or ""))
+    if "currency" in row:
+        row["currency"] = currency
+    if "amount" in row:
+        row["amount"] = normalize_amount(str(row["amount"] or ""), currency)
+    if "due_date" in row:
+        row["due_date"] = normalize_date(str(row["due_date"] or ""))
+    return row
+
+
+def _map_distinct(values: Sequence[Hashable], fn: Callable) -> List:
+    """fn applied to every value, computed once per distinct value"""
+    results = {value: fn(value) for value in set(values)}
+    return [results[value] for value in values]
+
+
+def normalize_columns(columns: Dict[str, Sequence[str]]) -> Dict[str, List[str]]:
+    """
+    Column-wise normalize_row(). Currencies and due dates have few distinct
+    values, so each is parsed once no matter how many rows share it; only
+    rows whose currency field is not recognised look at the amount for a symbol.
+    """
+    columns = {name: list(values) for name, values in columns.items()}
+    amounts = columns.get("amount")
+    if "currency" in columns or amounts is not None:
+        currencies = columns.get("currency") or [""] * len(amounts)
+        codes = _map_distinct(currencies, normalize_currency)
+        if amounts is not None:
+            unresolved = [i for i, code in enumerate(codes) if code not in ISO_CURRENCIES]
+            inferred = _map_distinct([(currencies[i], amounts[i]) for i in unresolved], lambda pair: normalize_currency(*pair))
+            for i, code in zip(unresolved, inferred):
+                codes[i] = code
+        if "currency" in columns:
+            columns["currency"] = codes
+        if amounts is not None:
+            format_amount = normalize_amount.__wrapped__  # every value is seen once here, skip the LRU
+            columns["amount"] = _map_distinct(list(zip(amounts, codes)), lambda pair: format_amount(*pair))
+    if "due_date" in columns:
+        columns["due_date"] = _map_distinct(columns["due_date"], normalize_date)
+    return columns
+
+
+def normalize_csv(path: str, fieldnames: List[str], output: Optional[str] = None) -> int:
+    """
+    Re-normalize a CSV file (with or without a header row) in one pass.
+    In place, the file is rewritten under the same exclusive lock the server
+    appends with, so no rows are lost while it runs.
+    """
+    with open(path, "r+" if output is None else "r", newline="", encoding="utf-8") as f:
+        if fcntl is not None and output is None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            records = [values for values in csv.reader(f) if values]
+            has_header = bool(records) and records[0] == fieldnames
+            rows = records[1:] if has_header else records
+            width = len(fieldnames)
+            rows = [values if len(values) == width else (values + [""] * width)[:width] for values in rows]
+            columns = normalize_columns(dict(zip(fieldnames, zip(*rows))) if rows else {name: [] for name in fieldnames})
+
+            target = f if output is None else open(output, "w", newline="", encoding="utf-8")
+            try:
+                if output is None:
+                    target.seek(0)
+                writer = csv.writer(target)
+                if has_header:
+                    writer.writerow(fieldnames)
+                writer.writerows(zip(*(columns[name] for name in fieldnames)))
+                target.truncate()
+                target.flush()
+            finally:
+                if target is not f:
+                    target.close()
+        finally:
+            if fcntl is not None and output is None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    return len(rows)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Re-normalize amount, currency and due_date in a data.csv file")
+    parser.add_argument("csv_path")
+    parser.add_argument("-o", "--output", help="write here instead of rewriting csv_path in place")
+    args = parser.parse_args(argv)
+
+    fieldnames = ["amount", "currency", "due_date", "description", "company", "contact"]
+    # Millions of short-lived row lists would otherwise trigger a full GC again and again
+    gc.disable()
+    started = time.perf_counter()
+    count = normalize_csv(args.csv_path, fieldnames, args.output)
+    print(f"Normalized {count} rows in {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
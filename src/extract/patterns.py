@@ -0,0 +1,37 @@
+"""
+Regular expressions shared by the rule extractor (rules.py) and email
+preprocessing (preprocess.py). Both depend on what they match: a change
+here changes which fields the fast path finds and which lines
+preprocessing keeps.
+"""
+
+import re
+
+CURRENCY_CODES = "USD|EUR|GBP|CAD|AUD|NZD|CHF|JPY|CNY|INR|SGD|HKD|SEK|NOK|DKK|MXN|BRL|ZAR"
+CURRENCY_SYMBOLS = {"$": "USD", "€": "EUR", "£": "GBP", "¥": "JPY", "₹": "INR"}
+
+MONTHS = (
+    r"(?:Jan(?:uary)?|Feb(?:ruary)?|Mar(?:ch)?|Apr(?:il)?|May|Jun(?:e)?|Jul(?:y)?|Aug(?:ust)?"
+    r"|Sep(?:t(?:ember)?)?|Oct(?:ober)?|Nov(?:ember)?|Dec(?:ember)?)"
+)
+DATE = (
+    rf"(?:{MONTHS}\.?\s+\d{{1,2}}(?:st|nd|rd|th)?,?\s+\d{{4}}"  # November 25, 2025
+    rf"|\d{{1,2}}(?:st|nd|rd|th)?\s+{MONTHS}\.?,?\s+\d{{4}}"  # 25 November 2025
+    r"|\d{4}-\d{2}-\d{2}"  # 2025-11-25
+    r"|\d{1,2}/\d{1,2}/\d{4})"  # 11/25/2025
+)
+# A whole number: "5,320", "1,500.00", "2.400,00", "1234,5"; never the tail of a longer one
+NUMBER = (
+    r"(?<![\d.,])(?:\d{1,3}(?:,\d{3})+(?:\.\d{1,2})?|\d{1,3}(?:\.\d{3})+(?:,\d{1,2})?|\d+(?:[.,]\d{1,2})?)"
+    r"(?!\d|[.,]\d)"
+)
+
+# Money: "$5,320 USD", "€2,400.00", "USD 1,500.00", "1500 EUR", "1.234,56 €".
+# The number is in group num, num2 or num3, with its symbol (sym*) and code (code*) alongside
+MONEY_RE = re.compile(
+    rf"(?P<sym>[$€£¥₹])\s?(?P<num>{NUMBER})(?:\s*(?P<code>{CURRENCY_CODES})\b)?"
+    rf"|\b(?P<code2>{CURRENCY_CODES})\s?(?P<sym2>[$€£¥₹])?\s?(?P<num2>{NUMBER})"
+    rf"|\b(?P<num3>{NUMBER})\s?(?:(?P<code3>{CURRENCY_CODES})\b|(?P<sym3>[$€£¥₹]))"
+)
+
+EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
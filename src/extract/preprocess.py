@@ -0,0 +1,255 @@
+"""
+Shrink an email before extraction
+
+Reply chains, signatures, disclaimers and HTML markup are paid input tokens
+that never hold the invoice fields. preprocess() runs the stages listed in
+PREFILL_PREPROCESS_STAGES over the cleaned email, in that order:
+
+- html: markup to plain text
+- quotes: drop the quoted reply chain when the new message alone has the
+  amount, company, due date and contact, otherwise keep it without the ">"
+  prefixes; headers inside a forwarded message are not reply boundaries
+- forward: drop forward separators and the Date/To/Cc lines of forwarded
+  headers (From and Subject are kept, they name the sender)
+- signature: drop "-- " signature blocks (up to a kept reply chain) and
+  "Sent from my ..." lines, keeping lines with an email address or phone number
+- footer: drop legal disclaimer and unsubscribe paragraphs
+- window: for long emails, keep only the lines around money, date and
+  contact cues (not in the default list)
+
+Every stage is a handful of precompiled patterns or a str.translate table.
+"""
+
+import os
+import re
+import sys
+import html
+import argparse
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Sequence
+
+from . import rules
+from .patterns import CURRENCY_CODES, DATE, EMAIL_RE, MONEY_RE
+from ..ai.context import count_tokens
+
+PREFILL_PREPROCESS_STAGES = os.getenv("PREFILL_PREPROCESS_STAGES", "html,quotes,forward,signature,footer")
+# The window stage only trims emails longer than this, keeping this many lines around each cue
+PREFILL_WINDOW_MIN_CHARS = int(os.getenv("PREFILL_WINDOW_MIN_CHARS", "2000"))
+PREFILL_WINDOW_LINES = int(os.getenv("PREFILL_WINDOW_LINES", "2"))
+
+# Control characters other than tab and newline; \r is turned into \n first
+_CONTROL_CHARS = dict.fromkeys(c for c in range(32) if c not in (9, 10))
+# Invisible or odd spacing that HTML mail is full of
+_SPACES = str.maketrans({
+    "\u00a0": " ", "\u2007": " ", "\u202f": " ",  # no-break spaces
+    "\u200b": None, "\u200c": None, "\u200d": None, "\u2060": None, "\ufeff": None, "\u00ad": None,
+})
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+_TRAILING_SPACE_RE = re.compile(r"[ \t]+\n")
+
+_HTML_RE = re.compile(r"<(?:html|body|div|p|br|table|td|span|a|font)\b[^>]*>", re.I)
+_HTML_DROP_RE = re.compile(r"<(script|style|head|title)\b.*?</\1\s*>|<!--.*?-->", re.I | re.S)
+_HTML_BREAK_RE = re.compile(r"<br\s*/?>|</?(?:p|div|tr|li|ul|ol|h[1-6]|table|blockquote)\b[^>]*>", re.I)
+_HTML_CELL_RE = re.compile(r"</t[dh]\s*>", re.I)
+_HTML_TAG_RE = re.compile(r"<[^>]+>")
+_HTML_SPACES_RE = re.compile(r"[ \t]{2,}")
+
+# Where the quoted part of a reply starts
+_REPLY_HEADER_RE = re.compile(
+    r"^(?:On\s[^\n]{0,200}?(?:\n[^\n]{0,200}?)?\bwrote:[ \t]*$"  # On Mon, Nov 3, 2025 at 9:14 AM Jane <j@x.com> wrote:
+    r"|-{2,}\s*Original Message\s*-{2,}[ \t]*$"
+    r"|From:[^\n]*\n(?:Sent|Date):[^\n]*\n(?:To|Subject):)",  # Outlook reply header
+    re.I | re.M,
+)
+_QUOTED_LINE_RE = re.compile(r"^[ \t]*>[ \t]?", re.M)
+_FORWARD_SEPARATOR_RE = re.compile(
+    r"^[ \t]*(?:-{3,}\s*Forwarded message\s*-{3,}|Begin forwarded message:)[ \t]*\n", re.I | re.M
+)
+_FORWARD_HEADER_RE = re.compile(r"^[ \t]*(?:Date|Sent|To|Cc|Bcc|Reply-To):[^\n]*\n", re.I | re.M)
+
+_SIGNATURE_RE = re.compile(r"^-- ?$", re.M)
+_MOBILE_RE = re.compile(r"^[ \t]*(?:Sent from my [^\n]*|Get Outlook for [^\n]*|Sent from (?:Mail|Outlook)[^\n]*)$\n?", re.I | re.M)
+_PHONE_RE = re.compile(r"(?:\+?\d[\d ().-]{7,}\d)")
+
+_DISCLAIMER_RE = re.compile(
+    r"\b(?:confidential(?:ity)?(?: notice)?|intended (?:solely |only )?for the (?:use of the )?"
+    r"(?:individual|addressee|recipient|named)|received this (?:e-?mail|message|communication) in error"
+    r"|unsubscribe|privacy (?:policy|notice)|do not reply to this|please consider the environment"
+    r"|virus(?:es)? (?:free|scanned|checked)|not (?:be )?liable for|this (?:e-?mail|message) and any attachments)\b",
+    re.I,
+)
+_PARAGRAPH_RE = re.compile(r"\n[ \t]*\n")
+
+_CUE_RE = re.compile(
+    rf"{DATE}|\b(?:{CURRENCY_CODES})\b|[$€£¥₹]|@|\b(?:invoice|amount|total|balance|due|payable|payment|"
+    r"contact|subject|from|company|remit)\b",
+    re.I,
+)
+
+
+def clean_text(text: str) -> str:
+    """Unify line endings, drop control characters and collapse runs of blank lines"""
+    if not text:
+        return ""
+    text = text.replace("\r\n", "\n").replace("\r", "\n").translate(_CONTROL_CHARS)
+    return _BLANK_LINES_RE.sub("\n\n", text).strip()
+
+
+def strip_html(text: str) -> str:
+    if not _HTML_RE.search(text):
+        return text
+    text = _HTML_DROP_RE.sub("", text)
+    text = _HTML_BREAK_RE.sub("\n", text)
+    text = _HTML_CELL_RE.sub(" ", text)
+    text = html.unescape(_HTML_TAG_RE.sub("", text)).translate(_SPACES)
+    text = _TRAILING_SPACE_RE.sub("\n", _HTML_SPACES_RE.sub(" ", text))
+    return text
+
+
+# Fields the new message must have on its own before the quoted chain is dropped
+_QUOTE_FIELDS = ("amount", "company", "due_date", "contact")
+
+
+def strip_quotes(text: str) -> str:
+    # The From/Date/Subject block of a forwarded message is the invoice, not a quote
+    forward = _FORWARD_SEPARATOR_RE.search(text)
+    end = forward.start() if forward else len(text)
+    match = _REPLY_HEADER_RE.search(text, 0, end)
+    start = match.start() if match else None
+    if start is None or not text[:start].strip():
+        quoted = _QUOTED_LINE_RE.search(text, 0, end)
+        if quoted is None or not text[:quoted.start()].strip():
+            return text
+        start = quoted.start()
+    new = text[:start]
+    found = rules.extract(new).fields
+    if all(found[name] for name in _QUOTE_FIELDS):
+        return new
+    # Some invoice fields are only in the quoted part ("see below"): keep it, unquoted
+    return new + _QUOTED_LINE_RE.sub("", text[start:])
+
+
+def strip_forward_headers(text: str) -> str:
+    separator = _FORWARD_SEPARATOR_RE.search(text)
+    if separator is None:
+        return text
+    header_end = text.find("\n\n", separator.end())
+    header_end = len(text) if header_end < 0 else header_end
+    header = _FORWARD_HEADER_RE.sub("", text[separator.end():header_end] + "\n").rstrip("\n")
+    return text[:separator.start()] + header + text[header_end:]
+
+
+def strip_signature(text: str) -> str:
+    text = _MOBILE_RE.sub("", text)
+    match = _SIGNATURE_RE.search(text)
+    if match is None:
+        return text
+    # A reply chain the quotes stage kept ends the signature
+    reply = _REPLY_HEADER_RE.search(text, match.end())
+    end = reply.start() if reply else len(text)
+    # Contact details in the signature are still wanted
+    kept = [line for line in text[match.end():end].split("\n") if EMAIL_RE.search(line) or _PHONE_RE.search(line)]
+    return "\n".join([text[:match.start()].rstrip("\n")] + kept + ([text[end:]] if reply else []))
+
+
+def strip_footers(text: str) -> str:
+    paragraphs = _PARAGRAPH_RE.split(text)
+    # The first paragraph is the message itself, whatever it says
+    kept = paragraphs[:1] + [p for p in paragraphs[1:] if not _DISCLAIMER_RE.search(p) or MONEY_RE.search(p)]
+    return text if len(kept) == len(paragraphs) else "\n\n".join(kept)
+
+
+def relevance_window(text: str, min_chars: int = PREFILL_WINDOW_MIN_CHARS,
+                     radius: int = PREFILL_WINDOW_LINES) -> str:
+    if len(text) <= min_chars:
+        return text
+    lines = text.split("\n")
+    keep = [False] * len(lines)
+    for i, line in enumerate(lines):
+        if _CUE_RE.search(line):
+            low, high = max(i - radius, 0), min(i + radius + 1, len(lines))
+            keep[low:high] = [True] * (high - low)
+    if not any(keep):
+        return text
+    out, skipped = [], False
+    for line, wanted in zip(lines, keep):
+        if wanted:
+            out.append(line)
+            skipped = False
+        elif not skipped:
+            out.append("[...]")
+            skipped = True
+    return "\n".join(out)
+
+
+STAGES: Dict[str, Callable[[str], str]] = {
+    "html": strip_html,
+    "quotes": strip_quotes,
+    "forward": strip_forward_headers,
+    "signature": strip_signature,
+    "footer": strip_footers,
+    "window": relevance_window,
+}
+
+
+def parse_stages(spec: str) -> List[str]:
+    names = [name.strip() for name in spec.split(",") if name.strip()]
+    unknown = [name for name in names if name not in STAGES]
+    if unknown:
+        raise ValueError(f"PREFILL_PREPROCESS_STAGES has unknown stages {unknown}; known: {sorted(STAGES)}")
+    return names
+
+
+DEFAULT_STAGES = parse_stages(PREFILL_PREPROCESS_STAGES)
+
+
+@dataclass
+class PreprocessResult:
+    text: str
+    tokens_before: int
+    tokens_after: int
+    # Characters each stage removed, for the stages that changed something
+    removed: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(self.tokens_before - self.tokens_after, 0)
+
+
+def preprocess(text: str, stages: Sequence[str] = None) -> PreprocessResult:
+    """Run the stages over an already cleaned email (see clean_text)"""
+    stages = DEFAULT_STAGES if stages is None else stages
+    original = text
+    removed = {}
+    for name in stages:
+        before = len(text)
+        text = STAGES[name](text)
+        if len(text) != before:
+            removed[name] = before - len(text)
+    if removed:
+        text = _BLANK_LINES_RE.sub("\n\n", text).strip()
+        return PreprocessResult(text, count_tokens(original), count_tokens(text), removed)
+    tokens = count_tokens(original)
+    return PreprocessResult(text, tokens, tokens)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Show what preprocessing sends to the model for an email")
+    parser.add_argument("path", nargs="?", help="email text file (default: stdin)")
+    parser.add_argument("--stages", default=PREFILL_PREPROCESS_STAGES)
+    args = parser.parse_args(argv)
+
+    if args.path:
+        with open(args.path, "r", encoding="utf-8", errors="replace") as f:
+            text = f.read()
+    else:
+        text = sys.stdin.read()
+    result = preprocess(clean_text(text), parse_stages(args.stages))
+    print(result.text)
+    print(f"\n{result.tokens_before} -> {result.tokens_after} tokens ({result.tokens_saved} saved); "
+          f"characters removed per stage: {result.removed}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+from .normalize import parse_amount
+from .patterns import CURRENCY_CODES, CURRENCY_SYMBOLS, DATE, EMAIL_RE, MONEY_RE
+
+PREFILL_FAST_PATH_ENABLED = os.getenv("PREFILL_FAST_PATH_ENABLED", "1") == "1"
+PREFILL_FAST_PATH_MIN_CONFIDENCE = float(os.getenv("PREFILL_FAST_PATH_MIN_CONFIDENCE", "0.7"))
+
+FIELDS = ["amount", "currency", "due_date", "description", "company", "contact"]
+
+# "2.400" is 2400 or 2.4 depending on the currency
+_AMBIGUOUS_NUMBER_RE = re.compile(r"\d{1,3}\.\d{3}")
+
+_AMOUNT_LABEL_RE = re.compile(r"^[\s\-*•]*(?:total|amount(?: due)?|balance(?: due)?|total due|invoice total)\s*[:\-]\s*(?P<rest>.+)$", re.I | re.M)
+_AMOUNT_CUE_RE = re.compile(r"\b(?:total|amount due|balance|due|payable|owed|outstanding)\b", re.I)
+
+_DUE_LABEL_RE = re.compile(rf"^[\s\-*•]*due date\s*[:\-]\s*(?P<date>{DATE})", re.I | re.M)
+_DUE_CUE_RE = re.compile(
+    rf"\b(?:due (?:on|by|date(?: is)?)|payable (?:by|on|before)|no later than|pay(?:ment)? (?:by|before|on)|due)\s*:?\s*(?P<date>{DATE})",
+    re.I,
+)
+
+_COMPANY_LABEL_RE = re.compile(r"^[\s\-*•]*(?:company|vendor|supplier|from company)\s*:\s*(?P<value>.+?)\s*$", re.I | re.M)
+_COMPANY_SUBJECT_RE = re.compile(r"^subject:.*?\bfrom\s+(?P<value>[A-Z][\w&.,' ]+?)(?:\s+[-–|]|\s*$)", re.I | re.M)
+_COMPANY_THANKS_RE = re.compile(r"thank you for choosing\s+(?P<value>[A-Z][\w&.' ]+?)(?:\s+for\b|[.!,\n])")
+
+_CONTACT_LABEL_RE = re.compile(r"^[\s\-*•]*contact(?: us| person| email)?\s*:\s*(?P<value>.+?)\s*$", re.I | re.M)
+_EMAIL_LABEL_RE = re.compile(r"^[\s\-*•]*e-?mail\s*:\s*(?P<value>[\w.+-]+@[\w-]+(?:\.[\w-]+)+)", re.I | re.M)
+_FROM_RE = re.compile(r"^from:\s*.*?(?P<value>[\w.+-]+@[\w-]+(?:\.[\w-]+)+)", re.I | re.M)
+
+_DESCRIPTION_LABEL_RE = re.compile(r"^[\s\-*•]*(?:description|services?|for)\s*:\s*(?P<value>.+?)\s*$", re.I | re.M)
+_DESCRIPTION_SUBJECT_RE = re.compile(r"^subject:.*?\s[-–|]\s(?P<value>[^\n]+?)\s*$", re.I | re.M)
+_DESCRIPTION_INVOICE_RE = re.compile(
+    r"\binvoice\b[^.\n]*?\bfor\s+(?P<value>[^.\n]+?)(?:\s+(?:rendered|during|covering|in the amount)\b|[.\n])",
+    re.I,
+)
+
+
+@dataclass
+class RuleExtraction:
+    fields: Dict[str, str] = field(default_factory=lambda: {name: "" for name in FIELDS})
+    confidence: Dict[str, float] = field(default_factory=lambda: {name: 0.0 for name in FIELDS})
+
+    @property
+    def overall(self) -> float:
+        """The weakest field decides how much the whole extraction can be trusted"""
+        return min(self.confidence.values())
+
+    def is_confident(self, threshold: float = PREFILL_FAST_PATH_MIN_CONFIDENCE) -> bool:
+        return all(self.fields.values()) and self.overall >= threshold
+
+    def merge(self, llm_fields: dict, threshold: float = PREFILL_FAST_PATH_MIN_CONFIDENCE) -> dict:
+        """Keep confident rule fields and let the LLM fill the rest"""
+        merged = dict(llm_fields)
+        for name in FIELDS:
+            if self.fields[name] and (self.confidence[name] >= threshold or not llm_fields.get(name)):
+                merged[name] = self.fields[name]
+        return merged
+
+    def _set(self, name: str, value: Optional[str], confidence: float):
+        if value and confidence > self.confidence[name]:
+            self.fields[name] = value.strip().strip(",;")
+            self.confidence[name] = confidence
+
+
+def _parse_money(match: re.Match) -> Optional[Tuple[str, str, float, float]]:
+    """
+    (amount, currency, amount confidence, currency confidence) for a
+    MONEY_RE match, or None for a zero amount: "balance due is $0" is
+    what the invoice no longer asks for.
+    """
+    if match.group("num"):
+        number, code, symbol = match.group("num"), match.group("code"), match.group("sym")
+    elif match.group("num2"):
+        number, code, symbol = match.group("num2"), match.group("code2"), match.group("sym2")
+    else:
+        number, code, symbol = match.group("num3"), match.group("code3"), match.group("sym3")
+    currency = code.upper() if code else CURRENCY_SYMBOLS.get(symbol, "")
+    value = parse_amount(number, currency)
+    if not value:
+        return None
+    amount_confidence = 0.6 if _AMBIGUOUS_NUMBER_RE.fullmatch(number) else 1.0
+    # "$" alone could also be CAD/AUD/..., so trust it a little less
+    return str(value), currency, amount_confidence, 1.0 if code else 0.7
+
+
+def _money(text: str, start: int = 0, end: Optional[int] = None):
+    """(match, parsed) for every non-zero amount in text"""
+    for match in MONEY_RE.finditer(text, start, len(text) if end is None else end):
+        parsed = _parse_money(match)
+        if parsed is not None:
+            yield match, parsed
+
+
+def _set_money(result: RuleExtraction, parsed: Tuple[str, str, float, float], confidence: float,
+               currency_cap: float = 1.0):
+    amount, currency, amount_confidence, currency_confidence = parsed
+    result._set("amount", amount, min(confidence, amount_confidence))
+    result._set("currency", currency, min(currency_confidence, currency_cap))
+
+
+def _extract_amount(text: str, result: RuleExtraction):
+    for label in _AMOUNT_LABEL_RE.finditer(text):
+        for _, parsed in _money(text, label.start("rest"), label.end("rest")):
+            _set_money(result, parsed, 1.0)
+            return
+
+    found = list(_money(text))
+    if not found:
+        return
+    for money, parsed in found:
+        # Look for a cue word in the same sentence, before the amount
+        sentence_start = max(text.rfind(".", 0, money.start()), text.rfind("\n", 0, money.start())) + 1
+        if _AMOUNT_CUE_RE.search(text, sentence_start, money.start()):
+            _set_money(result, parsed, 0.9)
+            return
+    distinct = {parsed[0] for _, parsed in found}
+    _set_money(result, found[0][1], 0.6 if len(distinct) == 1 else 0.3, currency_cap=0.6)
+
+
+def _first(patterns, text: str):
+    for pattern, confidence in patterns:
+        match = pattern.search(text)
+        if match:
+            return match.group("value"), confidence
+    return None, 0.0
+
+
+def extract(text: str) -> RuleExtraction:
+    """Pull the six prefill fields out of a cleaned email with precompiled patterns"""
+    result = RuleExtraction()
+    _extract_amount(text, result)
+
+    match = _DUE_LABEL_RE.search(text)
+    if match:
+        result._set("due_date", match.group("date"), 1.0)
+    else:
+        match = _DUE_CUE_RE.search(text)
+        if match:
+            result._set("due_date", match.group("date"), 0.9)
+
+    result._set("company", *_first([
+        (_COMPANY_LABEL_RE, 1.0),
+        (_COMPANY_SUBJECT_RE, 0.8),
+        (_COMPANY_THANKS_RE, 0.8),
+    ], text))
+
+    contact, confidence = _first([
+        (_CONTACT_LABEL_RE, 1.0),
+        (_EMAIL_LABEL_RE, 0.9),
+        (_FROM_RE, 0.8),
+    ], text)
+    if not contact:
+        match = EMAIL_RE.search(text)
+        contact, confidence = (match.group(0), 0.6) if match else (None, 0.0)
+    result._set("contact", contact, confidence)
+
+    result._set("description", *_first([
+        (_DESCRIPTION_LABEL_RE, 1.0),
+        (_DESCRIPTION_SUBJECT_RE, 0.8),
+        (_DESCRIPTION_INVOICE_RE, 0.75),
+    ], text))
+    return result
@@ -0,0 +1,381 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import asyncio
+import hashlib
+import logging
+import ipaddress
+import threading
+from urllib.parse import urlsplit
+from dataclasses import dataclass, field, asdict
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+PREFILL_JOB_WORKERS = int(os.getenv("PREFILL_JOB_WORKERS", "8"))
+PREFILL_JOB_QUEUE_SIZE = int(os.getenv("PREFILL_JOB_QUEUE_SIZE", "1000"))
+PREFILL_JOB_RESULT_TTL_SECONDS = float(os.getenv("PREFILL_JOB_RESULT_TTL_SECONDS", "3600"))
+PREFILL_JOB_DB = os.getenv("PREFILL_JOB_DB", "")  # empty means jobs are lost on restart
+PREFILL_JOB_CALLBACK_TIMEOUT_SECONDS = float(os.getenv("PREFILL_JOB_CALLBACK_TIMEOUT_SECONDS", "10"))
+# A worker renews the lease on its unfinished jobs every third of this; jobs whose
+# lease ran out (the worker died) are taken over by another worker on the same DB
+PREFILL_JOB_LEASE_SECONDS = float(os.getenv("PREFILL_JOB_LEASE_SECONDS", "60"))
+# Comma-separated hosts callbacks may go to; empty allows any host that
+# resolves only to public addresses
+PREFILL_CALLBACK_HOSTS = {
+    host.strip().lower() for host in os.getenv("PREFILL_CALLBACK_HOSTS", "").split(",") if host.strip()
+}
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class QueueFull(Exception):
+    pass
+
+
+class InvalidCallbackUrl(ValueError):
+    pass
+
+
+async def check_callback_url(url: str, allowed_hosts=PREFILL_CALLBACK_HOSTS) -> Optional[str]:
+    """
+    Raise InvalidCallbackUrl unless `url` is http(s) and its host is in
+    `allowed_hosts` or, without an allowlist, resolves only to public addresses,
+    so callbacks cannot be aimed at the server's own network.
+
+    Returns the checked address to connect to, or None for an allowlisted host.
+    """
+    parsed = urlsplit(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise InvalidCallbackUrl("callback_url must be an http or https URL")
+    host = parsed.hostname.lower()
+    if allowed_hosts:
+        if host not in allowed_hosts:
+            raise InvalidCallbackUrl(f"callback_url host {host} is not allowed")
+        return None
+    try:
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (OSError, ValueError):
+        raise InvalidCallbackUrl(f"callback_url host {host} does not resolve")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            raise InvalidCallbackUrl(f"callback_url host {host} resolves to a non-public address")
+    return infos[0][4][0].split("%")[0]
+
+
+@dataclass
+class Job:
+    id: str
+    payload: dict
+    status: str = QUEUED
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    callback_url: Optional[str] = None
+    idempotency_key: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        del data["payload"]
+        return data
+
+
+_COLUMNS = "id, status, payload, result, error, callback_url, idempotency_key, created_at, finished_at"
+
+
+class JobQueue:
+    """
+    Bounded in-process job queue with a fixed pool of worker tasks.
+
+    submit() never waits for a worker: when `max_queued` jobs are already
+    waiting it raises QueueFull so the caller can shed load. With db_path set,
+    jobs are also kept in SQLite, always read and written in a worker thread. Each unfinished job records its owning queue and a lease the
+    owner keeps renewing, so several workers can share one DB: a job is only
+    taken over (by start() or the heartbeat) once its owner stopped renewing.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[dict], Awaitable[dict]],
+        workers: int = PREFILL_JOB_WORKERS,
+        max_queued: int = PREFILL_JOB_QUEUE_SIZE,
+        result_ttl_seconds: float = PREFILL_JOB_RESULT_TTL_SECONDS,
+        db_path: Optional[str] = None,
+        lease_seconds: float = PREFILL_JOB_LEASE_SECONDS,
+    ):
+        self.handler = handler
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.workers = workers
+        self.max_queued = max_queued
+        self.result_ttl_seconds = result_ttl_seconds
+        self._jobs: Dict[str, Job] = {}
+        self._by_idempotency_key: Dict[str, str] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._last_prune = time.monotonic()
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        if db_path:
+            self._open_db(db_path)
+
+    def _open_db(self, db_path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, payload TEXT NOT NULL, result TEXT, error TEXT, "
+            "callback_url TEXT, idempotency_key TEXT, created_at REAL NOT NULL, finished_at REAL, "
+            "owner TEXT, lease_until REAL)"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        for name, sql_type in (("owner", "TEXT"), ("lease_until", "REAL")):
+            if name not in columns:  # DB written before leases existed
+                self._db.execute(f"ALTER TABLE jobs ADD COLUMN {name} {sql_type}")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_idempotency_key ON jobs (idempotency_key)")
+
+    def _save(self, job: Job):
+        if self._db is None:
+            return
+        try:
+            with self._db_lock:
+                self._db.execute(
+                    f"INSERT OR REPLACE INTO jobs ({_COLUMNS}, owner, lease_until) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job.id, job.status, json.dumps(job.payload),
+                     None if job.result is None else json.dumps(job.result),
+                     job.error, job.callback_url, job.idempotency_key, job.created_at, job.finished_at,
+                     self.owner, None if job.finished_at is not None else time.time() + self.lease_seconds),
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Could not persist job {job.id}: {e}")
+
+    def _select_one(self, column: str, value: str):
+        with self._db_lock:
+            return self._db.execute(f"SELECT {_COLUMNS} FROM jobs WHERE {column} = ?", (value,)).fetchone()
+
+    def _load(self, job_id: str) -> Optional[Job]:
+        if self._db is None:
+            return None
+        row = self._select_one("id", job_id)
+        return None if row is None else self._from_row(row)
+
+    @staticmethod
+    def _from_row(row) -> Job:
+        return Job(
+            id=row[0], status=row[1], payload=json.loads(row[2]),
+            result=None if row[3] is None else json.loads(row[3]), error=row[4],
+            callback_url=row[5], idempotency_key=row[6], created_at=row[7], finished_at=row[8],
+        )
+
+    async def start(self):
+        if self._queue is not None:
+            return
+        # Created here so the queue belongs to the running event loop. It is
+        # unbounded so recovered jobs always fit; submit() enforces max_queued.
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if self._db is not None:
+            await self._recover()
+            self._tasks.append(asyncio.create_task(self._heartbeat()))
+
+    async def stop(self):
+        """Stop the workers; unfinished jobs stay in SQLite (when enabled) for the next start"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        if self._db is not None:
+            await asyncio.to_thread(self._close_db)
+
+    def _close_db(self):
+        with self._db_lock:
+            # Give up the leases so the next start, or a sibling worker, resumes at once
+            self._db.execute(
+                "UPDATE jobs SET owner = NULL, lease_until = NULL WHERE owner = ? AND status IN (?, ?)",
+                (self.owner, QUEUED, RUNNING),
+            )
+            self._db.close()
+            self._db = None
+
+    def _claim_expired(self, renew: bool = False) -> list:
+        """Rows of the unfinished jobs this queue owns, after taking over those whose lease expired"""
+        now = time.time()
+        with self._db_lock:
+            if renew:
+                self._db.execute(
+                    "UPDATE jobs SET lease_until = ? WHERE owner = ? AND status IN (?, ?)",
+                    (now + self.lease_seconds, self.owner, QUEUED, RUNNING),
+                )
+            self._db.execute(
+                "UPDATE jobs SET owner = ?, lease_until = ? WHERE status IN (?, ?) "
+                "AND (lease_until IS NULL OR lease_until < ?)",
+                (self.owner, now + self.lease_seconds, QUEUED, RUNNING, now),
+            )
+            return self._db.execute(
+                f"SELECT {_COLUMNS} FROM jobs WHERE owner = ? AND status IN (?, ?) ORDER BY created_at",
+                (self.owner, QUEUED, RUNNING),
+            ).fetchall()
+
+    async def _recover(self, renew: bool = False):
+        """Take over unfinished jobs whose lease expired (their owner is gone) and queue them"""
+        rows = await asyncio.to_thread(self._claim_expired, renew)
+        recovered = 0
+        for row in rows:
+            if row[0] in self._jobs:
+                continue
+            job = self._from_row(row)
+            job.status = QUEUED
+            self._remember(job)
+            self._queue.put_nowait(job.id)
+            recovered += 1
+        if recovered:
+            logger.info(f"Recovered {recovered} unfinished jobs")
+
+    async def _heartbeat(self):
+        """Renew the leases on this queue's unfinished jobs and adopt jobs of dead workers"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await self._recover(renew=True)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not renew job leases: {e}")
+
+    def _remember(self, job: Job):
+        self._jobs[job.id] = job
+        if job.idempotency_key:
+            self._by_idempotency_key[job.idempotency_key] = job.id
+
+    async def submit(self, payload: dict, callback_url: Optional[str] = None,
+                     idempotency_key: Optional[str] = None, client_id: str = "") -> Job:
+        """
+        Queue a job, or return the existing one for a repeated idempotency key.
+        Keys are scoped to `client_id`, so one client cannot fetch another's job
+        by guessing its key.
+        """
+        if self._queue is None:
+            raise RuntimeError("JobQueue is not started")
+        if idempotency_key:
+            client_hash = hashlib.sha256(client_id.encode("utf-8")).hexdigest()[:16]
+            idempotency_key = f"{client_hash}:{idempotency_key}"
+            existing = await self._find_by_idempotency_key(idempotency_key)
+            if existing is not None:
+                return existing
+        await self._prune()
+        # No awaits from here until the job is remembered, so a concurrent
+        # submit with the same key finds it
+        if idempotency_key in self._by_idempotency_key:
+            return self._jobs[self._by_idempotency_key[idempotency_key]]
+        if self._queue.qsize() >= self.max_queued:
+            self.rejected += 1
+            raise QueueFull(f"{self._queue.qsize()} jobs are already waiting")
+        job = Job(id=uuid.uuid4().hex, payload=payload, callback_url=callback_url, idempotency_key=idempotency_key)
+        self._remember(job)
+        await asyncio.to_thread(self._save, job)
+        self._queue.put_nowait(job.id)
+        return job
+
+    async def _find_by_idempotency_key(self, idempotency_key: str) -> Optional[Job]:
+        job_id = self._by_idempotency_key.get(idempotency_key)
+        if job_id is not None:
+            return await self.get(job_id)
+        if self._db is None:
+            return None
+        row = await asyncio.to_thread(self._select_one, "idempotency_key", idempotency_key)
+        return None if row is None else self._from_row(row)
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if job is None and job_id:
+            job = await asyncio.to_thread(self._load, job_id)
+        return job
+
+    async def _prune(self):
+        """Forget finished jobs older than the result TTL, at most once a minute"""
+        if time.monotonic() - self._last_prune < 60:
+            return
+        self._last_prune = time.monotonic()
+        cutoff = time.time() - self.result_ttl_seconds
+        expired = [job for job in self._jobs.values() if job.finished_at is not None and job.finished_at < cutoff]
+        for job in expired:
+            del self._jobs[job.id]
+            if job.idempotency_key:
+                self._by_idempotency_key.pop(job.idempotency_key, None)
+        if expired and self._db is not None:
+            await asyncio.to_thread(self._delete_finished, cutoff)
+
+    def _delete_finished(self, cutoff: float):
+        with self._db_lock:
+            self._db.execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (cutoff,))
+
+    async def _worker(self):
+        while True:
+            job = self._jobs.get(await self._queue.get())
+            if job is None:
+                continue
+            job.status = RUNNING
+            await asyncio.to_thread(self._save, job)
+            try:
+                job.result = await self.handler(job.payload)
+                job.status = DONE
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job {job.id} failed: {e}")
+                job.status, job.error = FAILED, str(e)
+                self.failed += 1
+            job.finished_at = time.time()
+            await asyncio.to_thread(self._save, job)
+            if job.callback_url:
+                await self._notify(job)
+
+    async def _notify(self, job: Job):
+        """POST the finished job to its callback URL; failures are logged, not retried"""
+        try:
+            # Checked again here: the host may resolve elsewhere than at submit time
+            address = await check_callback_url(job.callback_url)
+        except InvalidCallbackUrl as e:
+            logger.warning(f"Callback for job {job.id} skipped: {e}")
+            return
+        url, headers, extensions = httpx.URL(job.callback_url), {}, {}
+        if address is not None:
+            # Connect to the address just checked, not whatever the name resolves
+            # to a moment later; TLS is still verified against the host name
+            headers["Host"] = url.netloc.decode("ascii")
+            extensions["sni_hostname"] = url.host
+            url = url.copy_with(host=address)
+        try:
+            # A client of its own: pooled connections are keyed by address, not host name
+            async with httpx.AsyncClient(timeout=PREFILL_JOB_CALLBACK_TIMEOUT_SECONDS) as client:
+                response = await client.post(url, json=job.to_dict(), headers=headers, extensions=extensions)
+            if response.status_code >= 400:
+                logger.warning(f"Callback for job {job.id} returned HTTP {response.status_code}")
+        except httpx.HTTPError as e:
+            logger.warning(f"Callback for job {job.id} to {job.callback_url} failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "queued": 0 if self._queue is None else self._queue.qsize(),
+            "max_queued": self.max_queued,
+            "workers": self.workers,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
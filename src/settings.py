@@ -0,0 +1,80 @@
+"""
+Process-wide configuration, read once at import.
+
+.env is loaded first, then the environment is read; provider keys missing
+from both fall back to api_keys.txt. Component tuning knobs (router, cache,
+job queue, ...) stay next to the code they tune; this holds what the app
+and the provider clients share.
+"""
+
+import os
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROMPTS_DIR = os.path.join(BASE_DIR, "src", "prompts")
+
+
+class MissingAPIKey(RuntimeError):
+    pass
+
+
+def _read_api_keys(path: str = "api_keys.txt") -> Dict[str, str]:
+    keys = {}
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            for line in f:
+                if "=" in line:
+                    key, value = line.strip().split("=", 1)
+                    keys[key.strip()] = value.strip()
+    return keys
+
+
+@dataclass(frozen=True)
+class Settings:
+    groq_api_key: Optional[str]
+    groq_base_url: str
+    data_file: str
+    log_file: str
+    invoice_db: str
+    duplicate_db: str
+    parquet_dir: str
+    row_stores: Tuple[str, ...]
+    prefill_batch_max_items: int
+    prefill_batch_concurrency: int
+    chat_max_choices: int
+    warm_up_providers: bool
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        groq_api_key = os.getenv("GROQ_API_KEY") or _read_api_keys().get("GROQ_API_KEY")
+        return cls(
+            groq_api_key=groq_api_key or None,
+            # Same variable the Groq SDK reads; point it at bench/stub_llm.py for load tests
+            groq_base_url=os.getenv("GROQ_BASE_URL", "https://api.groq.com"),
+            data_file=os.getenv("DATA_FILE", os.path.join(BASE_DIR, "data.csv")),
+            log_file=os.getenv("LOG_FILE", os.path.join(BASE_DIR, "input_email_text.log")),
+            invoice_db=os.getenv("INVOICE_DB", os.path.join(BASE_DIR, "invoices.db")),
+            duplicate_db=os.getenv("PREFILL_DEDUP_DB", os.path.join(BASE_DIR, "duplicates.db")),
+            parquet_dir=os.getenv("PARQUET_DIR", os.path.join(BASE_DIR, "parquet")),
+            # Where extracted rows go: any of csv, parquet (comma-separated)
+            row_stores=tuple(name.strip() for name in os.getenv("ROW_STORES", "csv").split(",") if name.strip()),
+            # Bulk import limits for /v1/prefill/batch
+            prefill_batch_max_items=int(os.getenv("PREFILL_BATCH_MAX_ITEMS", "5000")),
+            prefill_batch_concurrency=int(os.getenv("PREFILL_BATCH_CONCURRENCY", "16")),
+            # Upper limit on "n": every choice is a separate upstream request
+            chat_max_choices=int(os.getenv("CHAT_MAX_CHOICES", "4")),
+            # Build the provider clients in the background after startup instead of on the first request
+            warm_up_providers=os.getenv("AI_WARM_UP_PROVIDERS", "1") == "1",
+        )
+
+    def require_groq_api_key(self) -> str:
+        if not self.groq_api_key:
+            raise MissingAPIKey("GROQ_API_KEY not set in env or api_keys.txt")
+        return self.groq_api_key
+
+
+load_dotenv()
+settings = Settings.from_env()
@@ -0,0 +1,57 @@
+import os
+import csv
+import logging
+from typing import List
+
+from .row_store import BatchedRowStore
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, run a single worker there
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+CSV_FLUSH_MAX_ROWS = int(os.getenv("CSV_FLUSH_MAX_ROWS", "500"))
+CSV_FLUSH_INTERVAL_SECONDS = float(os.getenv("CSV_FLUSH_INTERVAL_SECONDS", "0.01"))
+CSV_FSYNC = os.getenv("CSV_FSYNC", "0") == "1"  # fsync every batch instead of best effort
+
+
+class CsvSink(BatchedRowStore):
+    """
+    Appends rows to a CSV file in groups.
+
+    Each batch is appended under an exclusive file lock, so concurrent
+    workers never interleave partial lines.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        fieldnames: List[str],
+        max_rows: int = CSV_FLUSH_MAX_ROWS,
+        flush_interval: float = CSV_FLUSH_INTERVAL_SECONDS,
+        fsync: bool = CSV_FSYNC,
+    ):
+        super().__init__(max_rows, flush_interval)
+        self.path = path
+        self.fieldnames = fieldnames
+        self.fsync = fsync
+
+    def _append(self, rows: List[dict]):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "a", newline="", encoding="utf-8") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                writer = csv.DictWriter(f, fieldnames=self.fieldnames)
+                # Checked under the lock so only one worker writes the header
+                if f.seek(0, os.SEEK_END) == 0:
+                    writer.writeheader()
+                writer.writerows(rows)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,398 @@
+"""
+Near-duplicate index for extracted invoices
+
+Reminders and forwards of an invoice produce a second extraction of the same
+invoice. Before a row is written, DuplicateIndex.check_and_add() looks for an
+earlier invoice that is either:
+
+- exact: the same company, amount, currency and due date, or
+- near: an email whose MinHash signature agrees in at least
+  PREFILL_DEDUP_SIMILARITY of its positions (an estimate of the Jaccard
+  similarity of their 3-word shingles), with no conflicting amount, currency
+  or due date
+
+Signatures use one-permutation hashing: every shingle is hashed once and
+lands in one of 64 bins, and empty bins borrow from a filled one, so a
+signature costs one hash per shingle. LSH splits the signature into 16 bands
+of 4; emails sharing any band are the candidates, and only those signatures
+are compared. Everything lives in SQLite (WAL), so memory is the page cache
+(PREFILL_DEDUP_CACHE_MB) and a lookup is a few index probes however many
+invoices are stored. Entries older than PREFILL_DEDUP_RETENTION_DAYS
+are pruned a little at a time as new ones are added.
+
+To index the rows already in data.csv (exact keys only, the emails are not
+kept there) and count the duplicates among them:
+
+    python -m src.storage.duplicate_index data.csv
+"""
+
+import os
+import re
+import csv
+import sys
+import time
+import array
+import hashlib
+import sqlite3
+import logging
+import argparse
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from ..extract.normalize import normalize_currency, parse_amount, parse_date
+
+logger = logging.getLogger(__name__)
+
+# off, flag (write the row and report the earlier invoice) or merge (do not write it)
+PREFILL_DEDUP_MODE = os.getenv("PREFILL_DEDUP_MODE", "flag")
+PREFILL_DEDUP_SIMILARITY = float(os.getenv("PREFILL_DEDUP_SIMILARITY", "0.8"))
+PREFILL_DEDUP_RETENTION_DAYS = float(os.getenv("PREFILL_DEDUP_RETENTION_DAYS", "180"))  # 0 keeps everything
+PREFILL_DEDUP_CACHE_MB = int(os.getenv("PREFILL_DEDUP_CACHE_MB", "16"))
+
+DEDUP_MODES = ("off", "flag", "merge")
+
+SIGNATURE_BINS = 64
+BAND_ROWS = 4  # 16 bands: a pair at 0.8 similarity shares a band with probability 0.9998
+# Emails with fewer shingles say too little to compare; only the exact key is used
+MIN_SHINGLES = 4
+
+# A bin keeps the top 16 bits of its minimum (b-bit MinHash: two different
+# minima agree by chance 1 time in 65536)
+_VALUE_BITS = 16
+_MASK64 = (1 << 64) - 1
+_MIX_A, _MIX_B, _MIX_C = 0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0xBF58476D1CE4E5B9
+# Same columns, in the same order, as main.REQUIRED_FIELDS / data.csv
+DEFAULT_FIELDNAMES = ["amount", "currency", "due_date", "description", "company", "contact"]
+# Stored as written, for reporting the earlier invoice
+INVOICE_COLUMNS = ("company", "amount", "currency", "due_date")
+_WORD_RE = re.compile(r"\w+")
+_COMPANY_SUFFIXES = {"inc", "llc", "ltd", "limited", "corp", "corporation", "co", "company", "gmbh", "plc", "sa", "bv", "ag"}
+
+# Adds between two pruning steps; each step drops at most _PRUNE_BATCH old
+# entries and sweeps 1/_PRUNE_RANGES of the bucket table for their rows
+_PRUNE_EVERY = 100
+_PRUNE_BATCH = 1000
+_PRUNE_RANGES = 4096
+
+
+def _hash64(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def _signed(value: int) -> int:
+    """SQLite integers are signed 64-bit"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+# Probe order of every bin for densification: bin i steps by 2i+1, which is
+# odd, so each order visits all the other bins
+_PROBES = [[(i + k * (2 * i + 1)) % SIGNATURE_BINS for k in range(1, SIGNATURE_BINS)] for i in range(SIGNATURE_BINS)]
+
+
+@lru_cache(maxsize=65536)  # invoice emails reuse a small vocabulary
+def _word_hash(word: str) -> int:
+    return _hash64(word.encode("utf-8"))
+
+
+def signature(text: str) -> Optional[bytes]:
+    """MinHash signature of the 3-word shingles of an email (SIGNATURE_BINS uint16 values), or None when it is too short"""
+    words = [_word_hash(word) for word in _WORD_RE.findall(text.casefold())]
+    if len(words) < MIN_SHINGLES + 2:
+        return None
+    # A shingle's hash mixes the hashes of its three words (splitmix64 finalizer)
+    shingles = [(a * _MIX_A + b * _MIX_B + c) & _MASK64 for a, b, c in zip(words, words[1:], words[2:])]
+    bins = [-1] * SIGNATURE_BINS
+    for h in shingles:
+        h = ((h ^ (h >> 31)) * _MIX_C) & _MASK64
+        slot, value = h % SIGNATURE_BINS, h >> (64 - _VALUE_BITS)
+        if bins[slot] < 0 or value < bins[slot]:
+            bins[slot] = value
+    # Densify: an empty bin takes the value of the first filled bin in its
+    # own fixed probe order, so neighbouring empty bins borrow different values
+    if -1 in bins:
+        hashed = bins[:]
+        for i in range(SIGNATURE_BINS):
+            if hashed[i] < 0:
+                bins[i] = next(hashed[j] for j in _PROBES[i] if hashed[j] >= 0)
+    return array.array("H", bins).tobytes()
+
+
+def band_keys(sig: bytes) -> List[int]:
+    width = BAND_ROWS * 2
+    return [_signed(_hash64(bytes([band]) + sig[band * width:(band + 1) * width]))
+            for band in range(SIGNATURE_BINS // BAND_ROWS)]
+
+
+def similarity(a: bytes, b: bytes) -> float:
+    """Share of signature positions that agree: an estimate of the shingles' Jaccard similarity"""
+    left, right = array.array("H", a), array.array("H", b)
+    return sum(1 for x, y in zip(left, right) if x == y) / len(left)
+
+
+def _normalize_company(company: str) -> str:
+    words = _WORD_RE.findall((company or "").casefold())
+    while len(words) > 1 and words[-1] in _COMPANY_SUFFIXES:
+        words.pop()
+    return " ".join(words)
+
+
+def invoice_fields(row: dict) -> Tuple[str, str, str, str]:
+    """(company, amount, currency, due_date) in comparable form; empty where missing or unparsable"""
+    currency = normalize_currency(str(row.get("currency") or ""), str(row.get("amount") or ""))
+    currency = currency.upper() if len(currency) == 3 else ""
+    amount = parse_amount(str(row.get("amount") or ""), currency)
+    due_date = parse_date(str(row.get("due_date") or ""))
+    return (
+        _normalize_company(str(row.get("company") or "")),
+        "" if amount is None else format(amount.normalize(), "f"),
+        currency,
+        "" if due_date is None else due_date.isoformat(),
+    )
+
+
+def exact_key(fields: Tuple[str, str, str, str]) -> Optional[int]:
+    """Key on (company, amount, currency, due_date); None unless company, amount and due date are known"""
+    company, amount, currency, due_date = fields
+    if not (company and amount and due_date):
+        return None
+    return _signed(_hash64("\0".join(fields).encode("utf-8")))
+
+
+def _conflicts(a: Tuple[str, ...], b: Tuple[str, ...]) -> bool:
+    """Two invoices with a different known amount, currency or due date are different invoices"""
+    return any(x and y and x != y for x, y in zip(a[1:], b[1:]))
+
+
+@dataclass
+class DuplicateMatch:
+    id: int
+    match: str  # "exact" or "near"
+    similarity: Optional[float]
+    first_seen: float
+    seen: int
+    company: str
+    amount: str
+    currency: str
+    due_date: str
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id, "match": self.match, "similarity": self.similarity, "first_seen": self.first_seen,
+            "seen": self.seen, "company": self.company, "amount": self.amount, "currency": self.currency,
+            "due_date": self.due_date,
+        }
+
+
+class DuplicateIndex:
+    """
+    Exact-key and MinHash/LSH index of the invoices written so far.
+
+    check_and_add() looks an invoice up and, when it is new, adds it in the
+    same transaction, so two workers cannot both take the same invoice for
+    the first one. A duplicate is not added; the invoice it matched counts
+    how often it was seen instead.
+    """
+
+    def __init__(self, db_path: str, threshold: float = PREFILL_DEDUP_SIMILARITY,
+                 retention_seconds: float = PREFILL_DEDUP_RETENTION_DAYS * 86400,
+                 cache_mb: int = PREFILL_DEDUP_CACHE_MB):
+        self.db_path = db_path
+        self.threshold = threshold
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        self._adds_since_prune = 0
+        self._prune_range = 0
+        self._min_live_id = 0
+        self.lookups = 0
+        self.exact_matches = 0
+        self.near_matches = 0
+        self.lookup_seconds = 0.0
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(f"PRAGMA cache_size=-{cache_mb * 1024}")  # KiB
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS dedup_invoices (id INTEGER PRIMARY KEY, created_at REAL NOT NULL, "
+            "seen INTEGER NOT NULL DEFAULT 1, exact_key INTEGER, signature BLOB, "
+            "company TEXT NOT NULL, amount TEXT NOT NULL, currency TEXT NOT NULL, due_date TEXT NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS dedup_invoices_exact ON dedup_invoices (exact_key) WHERE exact_key IS NOT NULL"
+        )
+        # One row per LSH band of every signature; the primary key is the lookup index
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS dedup_buckets (bucket INTEGER NOT NULL, invoice_id INTEGER NOT NULL, "
+            "PRIMARY KEY (bucket, invoice_id)) WITHOUT ROWID"
+        )
+        self._refresh_min_live_id()
+
+    def _refresh_min_live_id(self):
+        # Buckets of pruned entries may linger until the sweep reaches them; ids below this are ignored
+        self._min_live_id = self._db.execute("SELECT COALESCE(MIN(id), 0) FROM dedup_invoices").fetchone()[0]
+
+    def check_and_add(self, text: str, row: dict) -> Tuple[Optional[int], Optional[DuplicateMatch]]:
+        """
+        Look up the invoice extracted from `text` as `row`. Returns (id, None)
+        for a new invoice, which is now indexed, or (None, match) for a duplicate.
+        """
+        started = time.perf_counter()
+        fields = invoice_fields(row)
+        key = exact_key(fields)
+        sig = signature(text) if text else None
+        if key is None and sig is None:
+            return None, None  # nothing to match it by, now or later
+        buckets = band_keys(sig) if sig is not None else []
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                match = self._lookup(key, sig, buckets, fields)
+                if match is not None:
+                    self._db.execute("UPDATE dedup_invoices SET seen = seen + 1 WHERE id = ?", (match.id,))
+                    match.seen += 1
+                    invoice_id = None
+                else:
+                    invoice_id = self._db.execute(
+                        "INSERT INTO dedup_invoices (created_at, exact_key, signature, company, amount, currency, due_date) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (now, key, sig, *(str(row.get(name) or "") for name in INVOICE_COLUMNS)),
+                    ).lastrowid
+                    if buckets:
+                        self._db.executemany(
+                            "INSERT OR IGNORE INTO dedup_buckets (bucket, invoice_id) VALUES (?, ?)",
+                            [(bucket, invoice_id) for bucket in buckets],
+                        )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self.lookups += 1
+            if match is not None:
+                if match.match == "exact":
+                    self.exact_matches += 1
+                else:
+                    self.near_matches += 1
+            else:
+                self._adds_since_prune += 1
+                if self._adds_since_prune >= _PRUNE_EVERY:
+                    self._adds_since_prune = 0
+                    self._prune_step(now)
+            self.lookup_seconds += time.perf_counter() - started
+        return invoice_id, match
+
+    def _lookup(self, key: Optional[int], sig: Optional[bytes], buckets: List[int],
+                fields: Tuple[str, ...]) -> Optional[DuplicateMatch]:
+        columns = "id, created_at, seen, signature, company, amount, currency, due_date"
+        if key is not None:
+            row = self._db.execute(
+                f"SELECT {columns} FROM dedup_invoices WHERE exact_key = ? AND id >= ? ORDER BY id LIMIT 1",
+                (key, self._min_live_id),
+            ).fetchone()
+            if row is not None:
+                return DuplicateMatch(row[0], "exact", None, row[1], row[2], *row[4:])
+        if not buckets:
+            return None
+        placeholders = ",".join("?" * len(buckets))
+        candidates = self._db.execute(
+            f"SELECT {columns} FROM dedup_invoices WHERE id IN "
+            f"(SELECT invoice_id FROM dedup_buckets WHERE bucket IN ({placeholders})) AND id >= ?",
+            (*buckets, self._min_live_id),
+        ).fetchall()
+        best = None
+        for row in candidates:
+            if row[3] is None or _conflicts(fields, invoice_fields(dict(zip(INVOICE_COLUMNS, row[4:])))):
+                continue
+            score = similarity(sig, row[3])
+            if score >= self.threshold and (best is None or score > best[0] or (score == best[0] and row[0] < best[1][0])):
+                best = (score, row)
+        if best is None:
+            return None
+        score, row = best
+        return DuplicateMatch(row[0], "near", round(score, 3), row[1], row[2], *row[4:])
+
+    def remove(self, invoice_id: int):
+        """Forget an invoice that was added but then not written"""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                sig = self._db.execute("SELECT signature FROM dedup_invoices WHERE id = ?", (invoice_id,)).fetchone()
+                if sig is not None and sig[0] is not None:
+                    self._db.executemany(
+                        "DELETE FROM dedup_buckets WHERE bucket = ? AND invoice_id = ?",
+                        [(bucket, invoice_id) for bucket in band_keys(sig[0])],
+                    )
+                self._db.execute("DELETE FROM dedup_invoices WHERE id = ?", (invoice_id,))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _prune_step(self, now: float):
+        """Drop a batch of expired entries and sweep one slice of the bucket table for their rows"""
+        if self.retention_seconds <= 0:
+            return
+        # Ids grow with time, so expired entries are the lowest ids
+        self._db.execute(
+            "DELETE FROM dedup_invoices WHERE id IN (SELECT id FROM dedup_invoices ORDER BY id LIMIT ?) "
+            "AND created_at < ?",
+            (_PRUNE_BATCH, now - self.retention_seconds),
+        )
+        self._refresh_min_live_id()
+        span = (1 << 64) // _PRUNE_RANGES
+        low = -(1 << 63) + self._prune_range * span
+        high = low + span - 1 if self._prune_range < _PRUNE_RANGES - 1 else (1 << 63) - 1
+        self._db.execute(
+            "DELETE FROM dedup_buckets WHERE bucket BETWEEN ? AND ? AND invoice_id < ?",
+            (low, high, self._min_live_id),
+        )
+        self._prune_range = (self._prune_range + 1) % _PRUNE_RANGES
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM dedup_invoices").fetchone()[0]
+            return {
+                "entries": entries,
+                "lookups": self.lookups,
+                "exact_matches": self.exact_matches,
+                "near_matches": self.near_matches,
+                "mean_lookup_ms": round(self.lookup_seconds / self.lookups * 1000, 3) if self.lookups else None,
+            }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def parse_mode(mode: str) -> str:
+    if mode not in DEDUP_MODES:
+        raise ValueError(f"PREFILL_DEDUP_MODE must be one of {DEDUP_MODES}, got {mode!r}")
+    return mode
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Index the invoices in a CSV file and count duplicates")
+    parser.add_argument("csv_path")
+    parser.add_argument("--db", default="duplicates.db")
+    args = parser.parse_args(argv)
+
+    index = DuplicateIndex(args.db)
+    rows = duplicates = 0
+    with open(args.csv_path, "r", newline="", encoding="utf-8", errors="replace") as f:
+        for values in csv.reader(f):
+            if not values or values == DEFAULT_FIELDNAMES:
+                continue
+            rows += 1
+            _, match = index.check_and_add("", dict(zip(DEFAULT_FIELDNAMES, values)))
+            if match is not None:
+                duplicates += 1
+    print(f"{rows} rows, {duplicates} duplicates of an earlier row; {index.stats()['entries']} invoices indexed in {args.db}")
+    index.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
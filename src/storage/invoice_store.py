@@ -0,0 +1,271 @@
+import os
+import csv
+import asyncio
+import sqlite3
+import logging
+import threading
+from typing import Dict, Iterator, List, Optional
+
+from ..extract.normalize import normalize_currency, parse_amount, parse_date
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, run a single worker there
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+INVOICE_QUERY_MAX_LIMIT = int(os.getenv("INVOICE_QUERY_MAX_LIMIT", "1000"))
+# Bytes before the sync offset remembered to notice a file rewritten in place
+SYNC_TAIL_BYTES = 256
+# Rows per INSERT while catching up, so a large CSV is never held in memory at once
+SYNC_BATCH_ROWS = 1000
+SYNC_READ_BYTES = 64 * 1024
+
+
+class InvoiceStore:
+    """
+    SQLite index over the rows in the CSV file.
+
+    The CSV file stays the source of truth. sync() reads whatever was appended
+    since the last sync (the byte offset is kept in the database) and inserts
+    it, so every worker that appends rows, and every restart, brings the
+    index up to date without double-counting. Amount and due date are also
+    stored parsed, so range filters use an index instead of string compares.
+
+    After start(), request_sync() hands syncing to a background task, so the
+    CSV flush that asks for it does not wait on indexing.
+    """
+
+    def __init__(self, db_path: str, csv_path: str, fieldnames: List[str]):
+        self.db_path = db_path
+        self.csv_path = csv_path
+        self.fieldnames = fieldnames
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        columns = ", ".join(f"{name} TEXT NOT NULL DEFAULT ''" for name in fieldnames)
+        self._db.execute(
+            f"CREATE TABLE IF NOT EXISTS invoices (id INTEGER PRIMARY KEY, {columns}, "
+            "amount_value REAL, due_date_iso TEXT)"
+        )
+        # Single-column indexes list rows in id order within one company or
+        # currency, so paging by id needs no sort
+        self._db.execute("CREATE INDEX IF NOT EXISTS invoices_company ON invoices (company COLLATE NOCASE)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS invoices_currency ON invoices (currency)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS invoices_due_date ON invoices (due_date_iso)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS invoices_amount ON invoices (amount_value)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS invoice_sync (source TEXT PRIMARY KEY, csv_offset INTEGER NOT NULL, csv_tail BLOB)"
+        )
+        if "csv_tail" not in {row[1] for row in self._db.execute("PRAGMA table_info(invoice_sync)")}:
+            self._db.execute("ALTER TABLE invoice_sync ADD COLUMN csv_tail BLOB")
+
+    async def start(self):
+        """Start the background sync task; it first catches up with rows written while stopped"""
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._wakeup = asyncio.Event()
+            self._wakeup.set()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background task and index whatever is still pending"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await asyncio.to_thread(self.sync)
+
+    def request_sync(self):
+        """Ask for a sync from any thread (e.g. a CSV flush listener); requests made meanwhile share one"""
+        if self._task is None:
+            self.sync()
+            return
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                await asyncio.to_thread(self.sync)
+            except Exception as e:
+                # The rows are safe in the CSV file; the next sync picks them up
+                logger.warning(f"Invoice index sync failed: {e}")
+
+    def sync(self) -> int:
+        """Index rows appended to the CSV file since the last sync; returns how many were added"""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")  # one worker at a time advances the offset
+            try:
+                added = self._sync_locked()
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        if added:
+            logger.debug(f"Indexed {added} new rows from {self.csv_path}")
+        return added
+
+    def _sync_locked(self) -> int:
+        row = self._db.execute(
+            "SELECT csv_offset, csv_tail FROM invoice_sync WHERE source = ?", (self.csv_path,)
+        ).fetchone()
+        offset, tail = (row[0], row[1]) if row else (0, None)
+        if not os.path.exists(self.csv_path):
+            if offset:
+                self._rebuild("is gone")
+            return 0
+
+        with open(self.csv_path, "rb") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_SH)  # appends are whole batches under LOCK_EX
+            try:
+                size = os.fstat(f.fileno()).st_size
+                if offset and tail is not None:
+                    f.seek(max(0, offset - len(tail)))
+                    unchanged = f.read(len(tail)) == tail
+                else:
+                    unchanged = size >= offset
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            if not unchanged:
+                # Truncated, replaced or rewritten (e.g. by the bulk normalizer)
+                self._rebuild("changed")
+                offset = 0
+            # Bytes before `size` are whole batches that appends never touch again,
+            # so they are read without holding up writers
+            end = size if fcntl is not None else self._last_line_end(f, offset, size)
+            if end <= offset:
+                return 0
+            added = self._index_rows(f, offset, end)
+            f.seek(max(0, end - SYNC_TAIL_BYTES))
+            tail = f.read(end - f.tell())
+
+        self._db.execute(
+            "INSERT OR REPLACE INTO invoice_sync (source, csv_offset, csv_tail) VALUES (?, ?, ?)",
+            (self.csv_path, end, tail),
+        )
+        return added
+
+    @staticmethod
+    def _last_line_end(f, offset: int, size: int) -> int:
+        """Where the last complete line ends, leaving a half-written one for next time"""
+        position = size
+        while position > offset:
+            start = max(offset, position - SYNC_READ_BYTES)
+            f.seek(start)
+            newline = f.read(position - start).rfind(b"\n")
+            if newline >= 0:
+                return start + newline + 1
+            position = start
+        return offset
+
+    @staticmethod
+    def _lines(f, end: int) -> Iterator[str]:
+        while f.tell() < end:
+            line = f.readline(end - f.tell())
+            if not line:
+                return
+            yield line.decode("utf-8", errors="replace")
+
+    def _index_rows(self, f, offset: int, end: int) -> int:
+        """Insert the rows between two byte offsets, a line at a time and SYNC_BATCH_ROWS per insert"""
+        columns = ", ".join(self.fieldnames + ["amount_value", "due_date_iso"])
+        placeholders = ", ".join("?" * (len(self.fieldnames) + 2))
+        insert = f"INSERT INTO invoices ({columns}) VALUES ({placeholders})"
+        f.seek(offset)
+        added, rows = 0, []
+        for values in csv.reader(self._lines(f, end)):
+            if not values or values == self.fieldnames:
+                continue
+            values = (values + [""] * len(self.fieldnames))[: len(self.fieldnames)]
+            record = dict(zip(self.fieldnames, values))
+            currency = normalize_currency(record.get("currency", ""), record.get("amount", ""))
+            amount, due_date = parse_amount(record.get("amount"), currency), parse_date(record.get("due_date"))
+            rows.append(values + [
+                None if amount is None else float(amount),
+                None if due_date is None else due_date.isoformat(),
+            ])
+            if len(rows) >= SYNC_BATCH_ROWS:
+                self._db.executemany(insert, rows)
+                added, rows = added + len(rows), []
+        if rows:
+            self._db.executemany(insert, rows)
+            added += len(rows)
+        return added
+
+    def _rebuild(self, reason: str):
+        logger.info(f"{self.csv_path} {reason}, rebuilding the invoice index")
+        self._db.execute("DELETE FROM invoices")
+        self._db.execute("DELETE FROM invoice_sync WHERE source = ?", (self.csv_path,))
+
+    @staticmethod
+    def _where(filters: Dict[str, object]) -> tuple:
+        clauses, params = [], []
+        if filters.get("company"):
+            clauses.append("company = ? COLLATE NOCASE")
+            params.append(filters["company"])
+        if filters.get("currency"):
+            clauses.append("currency = ?")
+            params.append(str(filters["currency"]).upper())
+        if filters.get("due_from"):
+            clauses.append("due_date_iso >= ?")
+            params.append(str(filters["due_from"]))
+        if filters.get("due_to"):
+            clauses.append("due_date_iso <= ?")
+            params.append(str(filters["due_to"]))
+        if filters.get("min_amount") is not None:
+            clauses.append("amount_value >= ?")
+            params.append(filters["min_amount"])
+        if filters.get("max_amount") is not None:
+            clauses.append("amount_value <= ?")
+            params.append(filters["max_amount"])
+        return clauses, params
+
+    def query(self, limit: int = 100, cursor: Optional[int] = None, **filters) -> dict:
+        """
+        One page of matching rows, oldest first. Pagination is keyset on the
+        row id, so page 10,000 costs the same as page 1.
+        """
+        limit = max(1, min(limit, INVOICE_QUERY_MAX_LIMIT))
+        clauses, params = self._where(filters)
+        # With only range filters, "+id" stops SQLite from walking the whole
+        # table in id order and makes it use the range index, then sort
+        order = "+id" if clauses and not (filters.get("company") or filters.get("currency")) else "id"
+        if cursor is not None:
+            clauses.append("id > ?")
+            params.append(cursor)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        columns = ", ".join(["id"] + self.fieldnames)
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {columns} FROM invoices {where} ORDER BY {order} LIMIT ?", params + [limit + 1]
+            ).fetchall()
+        items = [dict(zip(["id"] + self.fieldnames, row)) for row in rows[:limit]]
+        return {
+            "items": items,
+            "next_cursor": items[-1]["id"] if len(rows) > limit else None,
+        }
+
+    def iter_rows(self, page_size: int = 1000, **filters) -> Iterator[List[str]]:
+        """All matching rows as CSV value lists in fieldnames order, read a page at a time"""
+        cursor = None
+        while True:
+            page = self.query(limit=page_size, cursor=cursor, **filters)
+            for item in page["items"]:
+                yield [item[name] for name in self.fieldnames]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return
+
+    def close(self):
+        with self._lock:
+            self._db.close()
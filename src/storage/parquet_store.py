@@ -0,0 +1,377 @@
+"""Columnar storage for extracted rows
+
+Rows are written as Parquet files partitioned by due month
+(<dir>/due_month=2025-11/part-*.parquet), with amount stored as a decimal
+and due_date as a date. Every flush writes one small file, so nothing is
+buffered only in memory; compact() merges the small files of a partition.
+
+Compacted files name the small files they replace in their Parquet
+metadata, and readers go through live_files(): until every compacted file
+of a merge is written the small files are read, afterwards only the
+compacted ones, so no row is ever counted twice. A merge cut short by a
+crash is finished or rolled back the next time the store starts.
+
+    python -m src.storage.parquet_store convert data.csv parquet/
+    python -m src.storage.parquet_store compact parquet/
+    python -m src.storage.parquet_store totals parquet/
+"""
+
+import os
+import csv
+import sys
+import json
+import time
+import uuid
+import asyncio
+import logging
+import argparse
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, List, Optional
+
+from ..extract.normalize import normalize_currency, parse_amount, parse_date
+from .row_store import BatchedRowStore
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # optional: only needed when ROW_STORES includes parquet
+    pa = ds = pq = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, run a single worker there
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+PARQUET_FLUSH_MAX_ROWS = int(os.getenv("PARQUET_FLUSH_MAX_ROWS", "5000"))
+PARQUET_FLUSH_INTERVAL_SECONDS = float(os.getenv("PARQUET_FLUSH_INTERVAL_SECONDS", "0.05"))
+PARQUET_COMPRESSION = os.getenv("PARQUET_COMPRESSION", "zstd")
+PARQUET_COMPACT_MIN_FILES = int(os.getenv("PARQUET_COMPACT_MIN_FILES", "8"))
+PARQUET_COMPACT_TARGET_ROWS = int(os.getenv("PARQUET_COMPACT_TARGET_ROWS", "1000000"))
+PARQUET_COMPACT_INTERVAL_SECONDS = float(os.getenv("PARQUET_COMPACT_INTERVAL_SECONDS", "3600"))  # 0 disables
+
+AMOUNT_PRECISION, AMOUNT_SCALE = 18, 2
+_CENT = Decimal(1).scaleb(-AMOUNT_SCALE)
+_AMOUNT_MAX = Decimal(10) ** (AMOUNT_PRECISION - AMOUNT_SCALE)
+UNKNOWN_PARTITION = "unknown"
+# Parquet metadata key of compacted files: {"group", "files", "replaces"}
+COMPACTION_KEY = b"ai_server.compaction"
+
+# Same columns, in the same order, as main.REQUIRED_FIELDS / data.csv
+DEFAULT_FIELDNAMES = ["amount", "currency", "due_date", "description", "company", "contact"]
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("The parquet row store needs pyarrow: pip install pyarrow")
+
+
+def build_schema(fieldnames: List[str]):
+    _require_pyarrow()
+    fields = []
+    for name in fieldnames:
+        if name == "amount":
+            fields.append(pa.field(name, pa.decimal128(AMOUNT_PRECISION, AMOUNT_SCALE)))
+        elif name == "due_date":
+            fields.append(pa.field(name, pa.date32()))
+        else:
+            fields.append(pa.field(name, pa.string()))
+    # The original text, kept only when it did not parse (or would lose digits)
+    fields.append(pa.field("amount_text", pa.string()))
+    fields.append(pa.field("due_date_text", pa.string()))
+    fields.append(pa.field("written_at", pa.timestamp("ms", tz="UTC")))
+    return pa.schema(fields)
+
+
+def _typed_amount(text: str, currency: str = "") -> tuple:
+    """(Decimal or None, original text or None); the currency decides whether "2.400" is 2400"""
+    amount = parse_amount(text, normalize_currency(currency, text))
+    if amount is None or abs(amount) >= _AMOUNT_MAX:
+        return None, (text or None)
+    rounded = amount.quantize(_CENT, rounding=ROUND_HALF_UP)
+    return rounded, (None if rounded == amount else text)
+
+
+class ParquetStore(BatchedRowStore):
+    """Appends each flushed batch as a new Parquet file in its due-month partition"""
+
+    def __init__(
+        self,
+        directory: str,
+        fieldnames: List[str],
+        max_rows: int = PARQUET_FLUSH_MAX_ROWS,
+        flush_interval: float = PARQUET_FLUSH_INTERVAL_SECONDS,
+        compression: str = PARQUET_COMPRESSION,
+        compact_interval: float = PARQUET_COMPACT_INTERVAL_SECONDS,
+    ):
+        super().__init__(max_rows, flush_interval)
+        self.directory = directory
+        self.fieldnames = fieldnames
+        self.schema = build_schema(fieldnames)
+        self.compression = compression
+        self.compact_interval = compact_interval
+        self._sequence = 0
+        self._compactor: Optional[asyncio.Task] = None
+
+    async def start(self):
+        await super().start()
+        await asyncio.to_thread(self.recover)
+        if self.compact_interval > 0 and self._compactor is None:
+            self._compactor = asyncio.create_task(self._compact_periodically())
+
+    async def stop(self):
+        if self._compactor is not None:
+            self._compactor.cancel()
+            await asyncio.gather(self._compactor, return_exceptions=True)
+            self._compactor = None
+        await super().stop()
+
+    async def _compact_periodically(self):
+        while True:
+            await asyncio.sleep(self.compact_interval)
+            try:
+                await asyncio.to_thread(self.compact)
+            except Exception as e:
+                logger.error(f"Parquet compaction failed: {e}")
+
+    def _partitioned(self, rows: List[dict]) -> Dict[str, dict]:
+        """Column lists per due-month partition"""
+        written_at = int(time.time() * 1000)
+        partitions: Dict[str, dict] = {}
+        for row in rows:
+            amount, amount_text = _typed_amount(row.get("amount", ""), row.get("currency", ""))
+            due_date = parse_date(row.get("due_date", ""))
+            partition = due_date.strftime("%Y-%m") if due_date else UNKNOWN_PARTITION
+            columns = partitions.setdefault(partition, {name: [] for name in self.schema.names})
+            for name in self.fieldnames:
+                if name == "amount":
+                    columns[name].append(amount)
+                elif name == "due_date":
+                    columns[name].append(due_date)
+                else:
+                    columns[name].append(row.get(name, ""))
+            columns["amount_text"].append(amount_text)
+            columns["due_date_text"].append(None if due_date else (row.get("due_date") or None))
+            columns["written_at"].append(written_at)
+        return partitions
+
+    def _write_file(self, table, partition: str, prefix: str = "part") -> str:
+        directory = os.path.join(self.directory, f"due_month={partition}")
+        os.makedirs(directory, exist_ok=True)
+        self._sequence += 1
+        name = f"{prefix}-{time.time_ns()}-{os.getpid()}-{self._sequence}.parquet"
+        path = os.path.join(directory, name)
+        # The .tmp name does not end in .parquet, so live_files() never lists it
+        # Write under a temporary name so readers never see a half-written file
+        pq.write_table(table, path + ".tmp", compression=self.compression)
+        os.replace(path + ".tmp", path)
+        return path
+
+    def _append(self, rows: List[dict]):
+        for partition, columns in self._partitioned(rows).items():
+            self._write_file(pa.table(columns, schema=self.schema), partition)
+
+    def _lock(self):
+        """The compaction lock file, held exclusively (None when another process holds it)"""
+        lock = open(os.path.join(self.directory, ".compact.lock"), "w")
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock.close()
+                return None
+        return lock
+
+    def recover(self) -> dict:
+        """Finish merges whose compacted files were all written and roll back the rest"""
+        if not os.path.isdir(self.directory):
+            return {"finished": 0, "rolled_back": 0}
+        lock = self._lock()
+        if lock is None:
+            return {"finished": 0, "rolled_back": 0, "skipped": "another process is compacting"}
+        with lock:
+            return self._recover()
+
+    def _recover(self) -> dict:
+        finished = rolled_back = 0
+        for directory, names in _partitions(self.directory):
+            for group in _compaction_groups(directory, names).values():
+                if group["complete"]:
+                    leftovers = group["replaces"] & names
+                    finished += bool(leftovers)
+                    _remove(directory, leftovers)
+                elif group["replaces"] & names:
+                    rolled_back += 1
+                    _remove(directory, group["files"])
+        if finished or rolled_back:
+            logger.warning(f"Parquet compaction recovery: {finished} merges finished, {rolled_back} rolled back")
+        return {"finished": finished, "rolled_back": rolled_back}
+
+    def compact(self, min_files: int = PARQUET_COMPACT_MIN_FILES,
+                target_rows: int = PARQUET_COMPACT_TARGET_ROWS) -> dict:
+        """
+        Merge the small files of each partition into files of up to
+        target_rows rows. Only one process compacts at a time; the others
+        return straight away.
+        """
+        if not os.path.isdir(self.directory):
+            return {"partitions": 0, "files_merged": 0}
+        lock = self._lock()
+        if lock is None:
+            return {"partitions": 0, "files_merged": 0, "skipped": "another process is compacting"}
+        with lock:
+            # An interrupted merge is settled first, so its leftovers are never merged again
+            self._recover()
+            partitions = merged = 0
+            for directory, names in _partitions(self.directory):
+                small = []
+                for name in sorted(names):
+                    path = os.path.join(directory, name)
+                    if pq.ParquetFile(path).metadata.num_rows < target_rows:
+                        small.append(path)
+                if len(small) < max(min_files, 1):
+                    continue
+                table = pa.concat_tables(pq.read_table(path, schema=self.schema) for path in small)
+                table = table.sort_by([("due_date", "ascending"), ("written_at", "ascending")])
+                offsets = range(0, table.num_rows, target_rows)
+                group = json.dumps({
+                    "group": uuid.uuid4().hex, "files": len(offsets),
+                    "replaces": [os.path.basename(path) for path in small],
+                }).encode("utf-8")
+                metadata = {**(self.schema.metadata or {}), COMPACTION_KEY: group}
+                partition = os.path.basename(directory).split("=", 1)[1]
+                for offset in offsets:
+                    # Writing the last file is the switch from the small files to these
+                    chunk = table.slice(offset, target_rows).replace_schema_metadata(metadata)
+                    self._write_file(chunk, partition, prefix="compacted")
+                _remove(directory, {os.path.basename(path) for path in small})
+                partitions += 1
+                merged += len(small)
+            if merged:
+                logger.info(f"Compacted {merged} Parquet files in {partitions} partitions")
+            return {"partitions": partitions, "files_merged": merged}
+
+
+def _partitions(directory: str):
+    """(partition directory, names of its Parquet files) for every due_month partition"""
+    for entry in sorted(os.listdir(directory)):
+        path = os.path.join(directory, entry)
+        if entry.startswith("due_month=") and os.path.isdir(path):
+            yield path, {name for name in os.listdir(path) if name.endswith(".parquet") and not name.startswith((".", "_"))}
+
+
+def _compaction_groups(directory: str, names) -> Dict[str, dict]:
+    """The merges that wrote compacted files among `names`, by group id"""
+    groups: Dict[str, dict] = {}
+    for name in names:
+        if not name.startswith("compacted-"):
+            continue
+        try:
+            metadata = pq.read_schema(os.path.join(directory, name)).metadata or {}
+        except FileNotFoundError:
+            continue  # merged again and removed since the directory was listed
+        if COMPACTION_KEY not in metadata:
+            continue
+        info = json.loads(metadata[COMPACTION_KEY])
+        group = groups.setdefault(info["group"], {"expected": info["files"], "files": set(), "replaces": set(info["replaces"])})
+        group["files"].add(name)
+    for group in groups.values():
+        group["complete"] = len(group["files"]) == group["expected"]
+    return groups
+
+
+def _remove(directory: str, names):
+    for name in names:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+
+def live_files(directory: str) -> List[str]:
+    """
+    The Parquet files that hold the stored rows right now: the small files a
+    merge replaced are left out once all of its compacted files exist, and
+    the compacted files of a merge still being written are left out until then.
+    """
+    _require_pyarrow()
+    files = []
+    for partition, names in _partitions(directory):
+        hidden = set()
+        for group in _compaction_groups(partition, names).values():
+            if group["complete"]:
+                hidden |= group["replaces"]
+            elif group["replaces"] & names:
+                hidden |= group["files"]
+            # Otherwise the merge finished long ago and some of its files were merged again
+        files.extend(os.path.join(partition, name) for name in sorted(names - hidden))
+    return files
+
+
+def read_dataset(directory: str):
+    """All stored rows as a pyarrow Dataset (due_month becomes a column)"""
+    _require_pyarrow()
+    return ds.dataset(live_files(directory), format="parquet", partitioning="hive", partition_base_dir=directory)
+
+
+def totals(directory: str):
+    """Total amount and invoice count per currency and due month"""
+    table = read_dataset(directory).to_table(columns=["currency", "due_month", "amount"])
+    return (
+        table.group_by(["currency", "due_month"])
+        .aggregate([("amount", "sum"), ("amount", "count")])
+        .sort_by([("currency", "ascending"), ("due_month", "ascending")])
+    )
+
+
+def convert_csv(csv_path: str, directory: str, fieldnames: List[str], chunk_rows: int = 100_000) -> int:
+    """Load an existing CSV file (with or without a header row) into the Parquet store"""
+    store = ParquetStore(directory, fieldnames)
+    count = 0
+    chunk = []
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        for values in csv.reader(f):
+            if not values or values == fieldnames:
+                continue
+            chunk.append(dict(zip(fieldnames, values)))
+            if len(chunk) >= chunk_rows:
+                store._append(chunk)
+                count += len(chunk)
+                chunk = []
+    if chunk:
+        store._append(chunk)
+        count += len(chunk)
+    store.compact(min_files=2)
+    return count
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert = commands.add_parser("convert", help="load a data.csv file into a Parquet directory")
+    convert.add_argument("csv_path")
+    convert.add_argument("directory")
+    compact = commands.add_parser("compact", help="merge small Parquet files")
+    compact.add_argument("directory")
+    compact.add_argument("--min-files", type=int, default=2)
+    summary = commands.add_parser("totals", help="amount owed per currency and due month")
+    summary.add_argument("directory")
+    args = parser.parse_args(argv)
+
+    fieldnames = DEFAULT_FIELDNAMES
+    if args.command == "convert":
+        started = time.perf_counter()
+        count = convert_csv(args.csv_path, args.directory, fieldnames)
+        print(f"Converted {count} rows into {args.directory} in {time.perf_counter() - started:.1f}s")
+    elif args.command == "compact":
+        print(ParquetStore(args.directory, fieldnames, compact_interval=0).compact(min_files=args.min_files))
+    else:
+        for row in totals(args.directory).to_pylist():
+            print(f"{row['currency'] or '-':5s} {row['due_month']:8s} {row['amount_sum']!s:>18s} {row['amount_count']:8d}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RowStore(ABC):
+    """Where prefill() puts extracted rows"""
+
+    async def start(self):
+        pass
+
+    async def write(self, row: dict):
+        await self.write_many([row])
+
+    @abstractmethod
+    async def write_many(self, rows: List[dict]):
+        """Store rows; returns once they are durable (or raises)"""
+
+    async def stop(self):
+        pass
+
+
+class BatchedRowStore(RowStore):
+    """
+    Queues rows in memory and hands them to _append() in groups.
+
+    A background task takes everything queued so far (up to max_rows, waiting
+    at most flush_interval for more) and appends it in a worker thread.
+    write() waits until its rows are stored, so callers still see errors.
+    """
+
+    def __init__(self, max_rows: int, flush_interval: float):
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.rows_written = 0
+        self.flushes = 0
+        # Called (in the flushing thread) after every successful append
+        self.listeners: List[Callable[[], object]] = []
+
+    @abstractmethod
+    def _append(self, rows: List[dict]):
+        """Write one batch; runs in a worker thread"""
+
+    async def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def write_many(self, rows: List[dict]):
+        """Queue rows and wait until the batch containing them has been flushed"""
+        if not rows:
+            return
+        if self._task is None:
+            # Not started (e.g. used outside the app lifespan): write directly
+            await asyncio.to_thread(self._flush, rows)
+            return
+        done = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((rows, done))
+        await done
+
+    async def stop(self):
+        """Flush everything still queued and stop the background task"""
+        if self._task is None:
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+        self._queue = None
+
+    def _flush(self, rows: List[dict]):
+        self._append(rows)
+        self.rows_written += len(rows)
+        self.flushes += 1
+        for listener in self.listeners:
+            try:
+                listener()
+            except Exception as e:
+                # The rows are safely stored; a listener can catch up later
+                logger.warning(f"Row store flush listener failed: {e}")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            count = len(item[0])
+            deadline = loop.time() + self.flush_interval
+            while count < self.max_rows:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+                count += len(item[0])
+
+            rows = [row for batch_rows, _ in batch for row in batch_rows]
+            try:
+                await asyncio.to_thread(self._flush, rows)
+            except Exception as e:
+                logger.error(f"Failed to flush {len(rows)} rows in {type(self).__name__}: {e}")
+                for _, done in batch:
+                    if not done.done():
+                        done.set_exception(e)
+            else:
+                for _, done in batch:
+                    if not done.done():
+                        done.set_result(None)
+
+
+class FanoutStore(RowStore):
+    """Writes every row to several stores, e.g. CSV for compatibility plus Parquet for analytics"""
+
+    def __init__(self, stores: List[RowStore]):
+        self.stores = stores
+
+    async def start(self):
+        for store in self.stores:
+            await store.start()
+
+    async def write_many(self, rows: List[dict]):
+        await asyncio.gather(*(store.write_many(rows) for store in self.stores))
+
+    async def stop(self):
+        for store in self.stores:
+            await store.stop()
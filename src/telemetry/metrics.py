@@ -0,0 +1,202 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# Latency buckets in seconds, from sub-millisecond local stages up to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in list(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram. observe() is a bisect plus two list updates,
+    cheap enough to leave on for every request.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], list] = {}  # key -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the block's duration, labelled outcome="ok" or outcome="error" """
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            yield
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            self.observe(time.perf_counter() - started, outcome=outcome, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, series in list(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, 'le="%g"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class GaugeCallback:
+    """Gauge read from a callback at scrape time, for stats other components already keep"""
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], float]):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+
+    def render(self) -> List[str]:
+        try:
+            value = float(self.callback())
+        except Exception:
+            return []
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge", f"{self.name} {value:g}"]
+
+
+class LabelledGaugeCallback:
+    """Like GaugeCallback, for a callback returning {(label values...): value}"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str],
+                 callback: Callable[[], Dict[Tuple[str, ...], float]]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def render(self) -> List[str]:
+        try:
+            series = dict(self.callback())
+        except Exception:
+            return []
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for key, value in sorted(series.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {float(value):g}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUEST_SECONDS = registry.register(Histogram(
+    "ai_server_http_request_seconds", "HTTP request latency", ("endpoint", "method", "status"),
+))
+STAGE_SECONDS = registry.register(Histogram(
+    "ai_server_stage_seconds", "Latency of each request stage", ("endpoint", "stage", "model", "outcome"),
+))
+UPSTREAM_SECONDS = registry.register(Histogram(
+    "ai_server_upstream_seconds", "Latency of AIPlatform calls to the LLM provider", ("provider", "model", "outcome"),
+))
+UPSTREAM_TOKENS = registry.register(Counter(
+    "ai_server_upstream_tokens_total", "Tokens reported by the LLM provider", ("provider", "model", "kind"),
+))
+PREFILL_PATH = registry.register(Counter(
+    "ai_server_prefill_extractions_total", "How prefill extractions were answered", ("path",),
+))
+
+PREFILL_JSON = registry.register(Counter(
+    "ai_server_prefill_json_total", "Model extraction output: valid, repaired, retried or failed", ("model", "outcome"),
+))
+
+PREFILL_PREPROCESS_TOKENS = registry.register(Counter(
+    "ai_server_prefill_preprocess_tokens_total", "Email tokens before and after preprocessing", ("endpoint", "kind"),
+))
+
+PREFILL_DUPLICATES = registry.register(Counter(
+    "ai_server_prefill_duplicates_total", "Extracted invoices by duplicate check result: new, exact or near",
+    ("endpoint", "match"),
+))
+
+CHAT_CONTEXT_TRIMMED_TOKENS = registry.register(Counter(
+    "ai_server_chat_context_trimmed_tokens_total", "Prompt tokens not sent upstream because old turns were trimmed", ("model",),
+))
+
+ROUTER_EVENTS = registry.register(Counter(
+    "ai_server_router_events_total", "Model router hedges, hedge wins, retries and breaker trips", ("route", "backend", "event"),
+))
+
+
+def stage(endpoint: str, name: str, model: str = ""):
+    """Time one request stage: `with stage("prefill", "csv_write", model): ...`"""
+    return STAGE_SECONDS.time(endpoint=endpoint, stage=name, model=model)
+
+
+def upstream(provider: str, model: str):
+    return UPSTREAM_SECONDS.time(provider=provider, model=model)
+
+
+def record_usage(provider: str, model: str, usage):
+    """Count prompt/completion tokens from an OpenAI-style completion.usage object"""
+    if usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = getattr(usage, kind, None)
+        if value is None and isinstance(usage, dict):
+            value = usage.get(kind)
+        if value:
+            UPSTREAM_TOKENS.inc(value, provider=provider, model=model, kind=kind.split("_")[0])
@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import uuid
+import queue
+import random
+import hashlib
+import logging
+import contextvars
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Optional
+
+from . import metrics
+
+REQUEST_LOG_MAX_BYTES = int(os.getenv("REQUEST_LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+REQUEST_LOG_BACKUP_COUNT = int(os.getenv("REQUEST_LOG_BACKUP_COUNT", "5"))
+REQUEST_LOG_SAMPLE_RATE = float(os.getenv("REQUEST_LOG_SAMPLE_RATE", "1.0"))
+REQUEST_LOG_BODIES = os.getenv("REQUEST_LOG_BODIES", "1") == "1"  # 0 logs a digest instead of the email
+REQUEST_LOG_QUEUE_SIZE = int(os.getenv("REQUEST_LOG_QUEUE_SIZE", "10000"))
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+_sampled_var = contextvars.ContextVar("request_log_sampled", default=True)
+
+
+class JsonLineFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "event": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        payload.update(getattr(record, "fields", {}))
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """Never blocks the caller: when the queue is full the record is dropped"""
+
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # Formatting happens on the listener thread, not the event loop
+        return record
+
+
+class RequestLog:
+    """
+    Structured JSON-lines request log.
+
+    event() only puts a record on a bounded queue; a QueueListener thread
+    formats it and writes it to a size-rotated file. Sampling is decided once
+    per request so a sampled request keeps all of its events.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = REQUEST_LOG_MAX_BYTES,
+        backup_count: int = REQUEST_LOG_BACKUP_COUNT,
+        sample_rate: float = REQUEST_LOG_SAMPLE_RATE,
+        log_bodies: bool = REQUEST_LOG_BODIES,
+        queue_size: int = REQUEST_LOG_QUEUE_SIZE,
+    ):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.log_bodies = log_bodies
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        file_handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True)
+        file_handler.setFormatter(JsonLineFormatter())
+        self._handler = _DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+        self._listener = QueueListener(self._handler.queue, file_handler)
+        self._logger = logging.getLogger(f"ai_server.requests.{id(self)}")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        self._logger.addHandler(self._handler)
+        self._running = False
+
+    def start(self):
+        if not self._running:
+            self._listener.start()
+            self._running = True
+
+    def stop(self):
+        """Write out everything still queued and stop the writer thread"""
+        if self._running:
+            self._listener.stop()
+            self._running = False
+
+    @property
+    def dropped(self) -> int:
+        return self._handler.dropped
+
+    def begin_request(self, request_id: Optional[str] = None) -> str:
+        request_id = request_id or uuid.uuid4().hex
+        request_id_var.set(request_id)
+        _sampled_var.set(self.sample_rate >= 1.0 or random.random() < self.sample_rate)
+        return request_id
+
+    def event(self, event: str, **fields):
+        if not _sampled_var.get():
+            return
+        self._logger.info(event, extra={"request_id": request_id_var.get(), "fields": fields})
+
+    def body(self, text: str):
+        """The email itself, or only its digest and size when bodies are not logged"""
+        if self.log_bodies:
+            return text
+        return {"sha256": hashlib.sha256(text.encode("utf-8")).hexdigest(), "chars": len(text)}
+
+
+class RequestLogMiddleware:
+    """
+    ASGI middleware that assigns each request an id (honouring an incoming
+    X-Request-ID), returns it as a header and logs method, path, status and
+    duration once the response is finished.
+    """
+
+    def __init__(self, app, request_log: RequestLog):
+        self.app = app
+        self.request_log = request_log
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = None
+        for name, value in scope.get("headers", []):
+            if name == b"x-request-id":
+                incoming = value.decode("latin-1")[:128]
+                break
+        request_id = self.request_log.begin_request(incoming)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_request_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            elapsed = time.perf_counter() - started
+            # Label by route template, not raw path, to keep label cardinality bounded
+            route = scope.get("route")
+            metrics.HTTP_REQUEST_SECONDS.observe(
+                elapsed,
+                endpoint=getattr(route, "path", "unmatched"),
+                method=scope.get("method"),
+                status=status_code,
+            )
+            self.request_log.event(
+                "http_request",
+                method=scope.get("method"),
+                path=scope.get("path"),
+                status=status_code,
+                duration_ms=round(elapsed * 1000, 3),
+            )
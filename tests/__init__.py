@@ -0,0 +1,5 @@
+"""
+Offline unit tests: no server, no network, no model API key.
+
+    python -m tests            # or: python -m pytest tests
+"""
@@ -0,0 +1,33 @@
+"""Run every test_* function in the tests package, in file order"""
+
+import sys
+import pkgutil
+import inspect
+import importlib
+import traceback
+
+import tests
+
+
+def main() -> int:
+    failed = 0
+    for module_info in sorted(pkgutil.iter_modules(tests.__path__), key=lambda m: m.name):
+        if not module_info.name.startswith("test_"):
+            continue
+        module = importlib.import_module(f"tests.{module_info.name}")
+        functions = [fn for name, fn in vars(module).items() if name.startswith("test_") and inspect.isfunction(fn)]
+        for fn in sorted(functions, key=lambda fn: fn.__code__.co_firstlineno):
+            try:
+                fn()
+            except Exception:
+                failed += 1
+                print(f"✗ {module_info.name}.{fn.__name__}")
+                traceback.print_exc()
+            else:
+                print(f"✓ {module_info.name}.{fn.__name__}")
+    print("All tests passed!" if not failed else f"{failed} tests failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
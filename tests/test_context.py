@@ -0,0 +1,60 @@
+import asyncio
+
+from src.ai import context
+from src.ai.base import AIPlatform
+from src.ai.context import ContextWindowExceeded, count_tokens, fit_messages
+
+
+class EchoPlatform(AIPlatform):
+    def chat(self, prompt: str) -> str:
+        return "First line.\nSecond line with several more words in it."
+
+
+def test_fit_messages_keeps_system_and_newest_turns():
+    messages = [{"role": "system", "content": "Be brief."}]
+    messages += [{"role": "user" if i % 2 == 0 else "assistant", "content": f"turn {i} " + "word " * 50} for i in range(20)]
+    fit = fit_messages(messages, budget=300, summary_tokens=60)
+    assert fit.messages[0] == messages[0]
+    assert fit.messages[-1] == messages[-1]
+    assert fit.dropped > 0 and fit.prompt_tokens <= 300
+    assert fit.messages[1]["role"] == "system" and "earlier messages were left out" in fit.messages[1]["content"]
+
+
+def test_fit_messages_rejects_oversized_system_prompt():
+    messages = [{"role": "system", "content": "rule " * 500}, {"role": "user", "content": "hi"}]
+    try:
+        fit_messages(messages, budget=100)
+        raise AssertionError("an oversized system prompt was accepted")
+    except ContextWindowExceeded as e:
+        assert e.status_code == 400
+
+
+def test_encoding_load_failure_falls_back():
+    """Without network access tiktoken cannot fetch its encoding; counting must keep working"""
+    class OfflineTiktoken:
+        @staticmethod
+        def get_encoding(name):
+            raise OSError("network unreachable")
+
+    saved = context.tiktoken, context._encoding, context._encoding_failed
+    context.tiktoken, context._encoding, context._encoding_failed = OfflineTiktoken, None, False
+    try:
+        assert context.load_encoding() is False
+        assert count_tokens("x" * 40) == 10
+        assert context._encoding_failed  # not retried on every call
+    finally:
+        context.tiktoken, context._encoding, context._encoding_failed = saved
+
+
+def test_default_acomplete_applies_stop_and_max_tokens():
+    platform = EchoPlatform()
+    messages = [{"role": "user", "content": "hi"}]
+    completion = asyncio.run(platform.acomplete(messages, stop=["\n"]))
+    assert completion["choices"][0] == {
+        "index": 0, "message": {"role": "assistant", "content": "First line."}, "finish_reason": "stop",
+    }
+    completion = asyncio.run(platform.acomplete(messages, n=2, max_tokens=3))
+    for choice in completion["choices"]:
+        assert choice["finish_reason"] == "length"
+        assert count_tokens(choice["message"]["content"]) <= 3
+    assert completion["usage"]["completion_tokens"] <= 6
@@ -0,0 +1,57 @@
+from src.storage.duplicate_index import DuplicateIndex, band_keys, signature, similarity
+
+EMAIL = (
+    "Dear Ms. Patel, this is a gentle reminder regarding Invoice INV-7841 issued on October 28, 2025 for "
+    "digital advertising campaign management and analytics reporting. The total amount due is $5,320 USD, "
+    "payable no later than November 25, 2025. Kindly remit payment to the account listed on your invoice."
+)
+ROW = {"amount": "$5,320", "currency": "USD", "due_date": "November 25, 2025", "company": "Apex Marketing Group Inc."}
+
+
+def test_signature_similarity():
+    resent = EMAIL.replace("Dear Ms. Patel,", "Hello again Ms. Patel,")
+    other = "Your order 5512 has shipped and will arrive on Tuesday; track it any time from your account page online."
+    assert signature("too short") is None
+    assert similarity(signature(EMAIL), signature(EMAIL)) == 1.0
+    assert similarity(signature(EMAIL), signature(resent)) >= 0.8
+    assert similarity(signature(EMAIL), signature(other)) < 0.3
+    # Near-duplicates share at least one LSH band
+    assert set(band_keys(signature(EMAIL))) & set(band_keys(signature(resent)))
+
+
+def test_exact_duplicate():
+    index = DuplicateIndex(":memory:")
+    try:
+        invoice_id, match = index.check_and_add(EMAIL, ROW)
+        assert invoice_id is not None and match is None
+        # The same invoice in other words and formats: same company, amount and due date
+        same = {"amount": "5320.00", "currency": "usd", "due_date": "2025-11-25", "company": "apex marketing group"}
+        invoice_id, match = index.check_and_add("Pay the Apex invoice please.", same)
+        assert invoice_id is None and match.match == "exact" and match.seen == 2
+    finally:
+        index.close()
+
+
+def test_near_duplicate_and_conflicts():
+    index = DuplicateIndex(":memory:")
+    try:
+        # No due date, so no exact key: only the text can match
+        index.check_and_add(EMAIL, {"amount": "$5,320", "company": "Apex"})
+        _, match = index.check_and_add(EMAIL.replace("Dear Ms. Patel,", "Hello again Ms. Patel,"), {"company": "Apex"})
+        assert match is not None and match.match == "near" and match.similarity >= 0.8
+        # Same wording, different amount: the next month's invoice, not a duplicate
+        invoice_id, match = index.check_and_add(EMAIL.replace("$5,320", "$6,100"), {"amount": "$6,100", "company": "Apex"})
+        assert invoice_id is not None and match is None
+    finally:
+        index.close()
+
+
+def test_remove():
+    index = DuplicateIndex(":memory:")
+    try:
+        invoice_id, _ = index.check_and_add(EMAIL, ROW)
+        index.remove(invoice_id)
+        assert index.check_and_add(EMAIL, ROW)[1] is None
+        assert index.stats()["entries"] == 1
+    finally:
+        index.close()
@@ -0,0 +1,25 @@
+import os
+import asyncio
+import tempfile
+
+from src.cache.extraction import ExtractionCache
+
+
+def test_extraction_cache_disk():
+    """The async API reads back entries persisted to SQLite"""
+    async def run():
+        db_path = os.path.join(tempfile.mkdtemp(), "cache.db")
+        writer = ExtractionCache(db_path=db_path)
+        await writer.aset("key", '{"amount": "10"}')
+        writer.close()
+        reader = ExtractionCache(db_path=db_path)
+        try:
+            assert await reader.aget("key") == '{"amount": "10"}'
+            assert await reader.aget("key") == '{"amount": "10"}'
+            assert await reader.aget("missing") is None
+            stats = reader.stats()
+            assert (stats["hits"], stats["disk_hits"], stats["misses"]) == (2, 1, 1), stats
+        finally:
+            reader.close()
+
+    asyncio.run(run())
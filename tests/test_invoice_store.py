@@ -0,0 +1,23 @@
+import os
+import csv
+import tempfile
+
+from src.storage.invoice_store import InvoiceStore
+
+FIELDNAMES = ["amount", "currency", "due_date", "description", "company", "contact"]
+
+
+def test_invoice_index_currency():
+    """The index reads "2.400" as 2,400 for currencies with a decimal comma"""
+    directory = tempfile.mkdtemp()
+    csv_path = os.path.join(directory, "data.csv")
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(FIELDNAMES)
+        writer.writerow(["€2.400", "EUR", "2025-11-25", "consulting", "Müller GmbH", "rechnung@mueller.de"])
+    store = InvoiceStore(os.path.join(directory, "invoices.db"), csv_path, FIELDNAMES)
+    try:
+        store.sync()
+        assert store.query(min_amount=2000)["items"], "€2.400 was indexed as 2.4"
+    finally:
+        store.close()
@@ -0,0 +1,89 @@
+import os
+import asyncio
+import tempfile
+
+from src.jobs import job_queue
+from src.jobs.job_queue import InvalidCallbackUrl, Job, JobQueue, check_callback_url
+
+
+def test_job_lease():
+    """A queue sharing the job DB leaves a live sibling's jobs alone and adopts a dead one's"""
+    async def run():
+        db_path = os.path.join(tempfile.mkdtemp(), "jobs.db")
+        blocked = asyncio.Event()
+
+        async def never_finishes(payload):
+            await blocked.wait()
+
+        async def echo(payload):
+            return payload
+
+        owner = JobQueue(never_finishes, workers=1, db_path=db_path, lease_seconds=0.6)
+        await owner.start()
+        job = await owner.submit({"n": 1}, idempotency_key="k", client_id="client-a")
+        assert (await owner.submit({"n": 2}, idempotency_key="k", client_id="client-a")).id == job.id
+        assert (await owner.submit({"n": 3}, idempotency_key="k", client_id="client-b")).id != job.id
+        await asyncio.sleep(0.05)
+
+        sibling = JobQueue(echo, workers=1, db_path=db_path, lease_seconds=0.6)
+        await sibling.start()
+        await asyncio.sleep(1.0)  # several renewals by the live owner
+        assert (await sibling.get(job.id)).status == "running", "a live worker's job was taken over"
+
+        for task in owner._tasks:  # the owner dies without releasing its leases
+            task.cancel()
+        await asyncio.sleep(1.5)
+        assert (await sibling.get(job.id)).status == "done", "a dead worker's job was not taken over"
+        await sibling.stop()
+
+    asyncio.run(run())
+
+
+def test_check_callback_url():
+    async def run():
+        assert await check_callback_url("https://93.184.216.34/hook") == "93.184.216.34"
+        assert await check_callback_url("https://hooks.example.com/x", {"hooks.example.com"}) is None
+        for url in ("http://127.0.0.1/hook", "http://[::ffff:10.0.0.1]/hook", "http://169.254.169.254/",
+                    "ftp://93.184.216.34/", "https://other.example.com/x"):
+            try:
+                await check_callback_url(url, {"hooks.example.com"} if "example" in url else set())
+                raise AssertionError(f"{url} was allowed")
+            except InvalidCallbackUrl:
+                pass
+
+    asyncio.run(run())
+
+
+def test_callback_connects_to_checked_address():
+    """The POST goes to the address that passed the check, with the original Host header"""
+    async def run():
+        requests = []
+
+        async def handle(reader, writer):
+            head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+            headers = dict(line.lower().split(": ", 1) for line in head.split("\r\n")[1:] if ": " in line)
+            await reader.readexactly(int(headers.get("content-length", "0")))
+            requests.append((head.split(" ")[1], headers.get("host")))
+            writer.write(b"HTTP/1.1 204 No Content\r\nContent-Length: 0\r\n\r\n")
+            await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+
+        async def checked(url, allowed_hosts=()):
+            return "127.0.0.1"  # what the name resolved to when it was checked
+
+        original = job_queue.check_callback_url
+        job_queue.check_callback_url = checked
+        try:
+            queue = JobQueue(lambda payload: None, workers=0)
+            job = Job(id="j1", payload={}, status="done", callback_url=f"http://hooks.invalid:{port}/done?x=1")
+            await queue._notify(job)
+        finally:
+            job_queue.check_callback_url = original
+            server.close()
+            await server.wait_closed()
+        assert requests == [("/done?x=1", f"hooks.invalid:{port}")], requests
+
+    asyncio.run(run())
@@ -0,0 +1,62 @@
+from src.extract.json_repair import ExtractionParseError, ObjectScanner, parse_extraction, parse_extraction_batch
+
+
+def _raises(fn, *args):
+    try:
+        fn(*args)
+    except ExtractionParseError:
+        return True
+    return False
+
+
+def test_parse_valid_json():
+    fields, repaired = parse_extraction('{"amount": "5320", "currency": "USD", "company": "  Apex\\n Group "}')
+    assert not repaired
+    assert fields == {"amount": "5320", "currency": "USD", "due_date": "", "description": "",
+                      "company": "Apex Group", "contact": ""}
+
+
+def test_parse_repairs_common_defects():
+    output = "Sure! ```json\n{'amount': 5320, currency: 'USD', due_date: None, // no date\n 'company': \"Apex\" 'contact': 'a@b.co',}\n```"
+    fields, repaired = parse_extraction(output)
+    assert repaired
+    assert (fields["amount"], fields["currency"], fields["due_date"]) == ("5320", "USD", "")
+    assert (fields["company"], fields["contact"]) == ("Apex", "a@b.co")
+
+
+def test_parse_nested_and_unclosed_objects():
+    fields, _ = parse_extraction('{"invoice": {"Amount": "10", "Due Date": "2025-11-25"}}')
+    assert (fields["amount"], fields["due_date"]) == ("10", "2025-11-25")
+    fields, repaired = parse_extraction('{"amount": "10", "company": "Acme"')
+    assert repaired and fields["company"] == "Acme"
+
+
+def test_parse_rejects_unusable_output():
+    assert _raises(parse_extraction, "no json here")
+    assert _raises(parse_extraction, '{"amount": "10')  # cut off inside a value
+    assert _raises(parse_extraction, '{"foo": 1}')
+    error = None
+    try:
+        parse_extraction("nothing")
+    except ExtractionParseError as e:
+        error = e
+    assert error.status_code == 422 and error.output == "nothing"
+
+
+def test_parse_batch():
+    results = parse_extraction_batch(
+        '[{"id": "a", "amount": "1"}, {"id": "b", "amount": "2"}, {"id": "c", "amount": "3"}]', ["a", "b"])
+    assert {item_id: fields["amount"] for item_id, fields in results.items()} == {"a": "1", "b": "2"}
+    # Unusable items are left out for the caller to retry on their own
+    results = parse_extraction_batch('{"a": {"amount": "1"}, "b": {"nope": 1}}', ["a", "b"])
+    assert list(results) == ["a"]
+    assert _raises(parse_extraction_batch, '[{"id": "x", "amount": "1"}]', ["a"])
+
+
+def test_object_scanner_chunks():
+    scanner = ObjectScanner()
+    assert not scanner.feed('text {"a": "}')
+    assert not scanner.feed('{", "b": [1')
+    assert scanner.closers() == "]}"
+    assert scanner.feed("]} tail")
+    assert scanner.text() == '{"a": "}{", "b": [1]}'
@@ -0,0 +1,29 @@
+import time
+import asyncio
+
+from src.ai.limiter import AdaptiveLimiter, Overloaded
+
+
+def test_limiter_queue():
+    """The queue counts follow grants, timeouts and cancellations"""
+    async def run():
+        limiter = AdaptiveLimiter("test", initial=1, min_limit=1)
+        await limiter.acquire()
+        first = asyncio.create_task(limiter.acquire(priority=2))
+        second = asyncio.create_task(limiter.acquire(priority=0))
+        expiring = asyncio.create_task(limiter.acquire(priority=1, deadline=time.monotonic() + 0.05))
+        await asyncio.sleep(0)
+        assert limiter.queued == 3
+        try:
+            await expiring
+            raise AssertionError("the call should have missed its deadline")
+        except Overloaded:
+            pass
+        first.cancel()
+        await asyncio.sleep(0)
+        assert limiter.queued == 1
+        limiter.release()
+        await second
+        assert limiter.queued == 0 and limiter.in_flight == 1
+
+    asyncio.run(run())
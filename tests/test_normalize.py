@@ -0,0 +1,68 @@
+import os
+import csv
+import tempfile
+from decimal import Decimal
+
+from src.extract.normalize import (
+    normalize_amount, normalize_columns, normalize_csv, normalize_currency, normalize_date, normalize_row, parse_amount,
+)
+
+FIELDNAMES = ["amount", "currency", "due_date", "description", "company", "contact"]
+
+
+def test_parse_amount_formats():
+    cases = [
+        ("$5,320 USD", "USD", "5320"),
+        ("€2.400,50", "EUR", "2400.50"),
+        ("€2.400", "EUR", "2400"),  # thousands for a decimal-comma currency
+        ("2.400", "USD", "2.400"),  # a decimal point elsewhere
+        ("CHF 1'250.00", "CHF", "1250.00"),
+        ("1,234,567", "", "1234567"),
+        ("(1,000.00)", "USD", "-1000.00"),
+    ]
+    for text, currency, expected in cases:
+        assert parse_amount(text, currency) == Decimal(expected), (text, currency)
+    assert parse_amount("n/a") is None
+
+
+def test_normalize_amount_minor_units():
+    assert normalize_amount("$5,320 USD", "USD") == "5320.00"
+    assert normalize_amount("¥5000", "JPY") == "5000"
+    assert normalize_amount("n/a") == "n/a"
+
+
+def test_normalize_currency():
+    assert normalize_currency("usd") == "USD"
+    assert normalize_currency("$") == "USD"
+    assert normalize_currency("euros") == "EUR"
+    assert normalize_currency("", "€2.400") == "EUR"
+    assert normalize_currency("weird") == "weird"
+
+
+def test_normalize_date():
+    for text in ("November 25, 2025", "25th Nov. 2025", "25/11/2025", "11/25/2025", "2025-11-25"):
+        assert normalize_date(text) == "2025-11-25", text
+    assert normalize_date("Sept 3, 2025") == "2025-09-03"
+    assert normalize_date("soon") == "soon"
+
+
+def test_normalize_row_and_columns_agree():
+    rows = [
+        {"amount": "€2.400,50", "currency": "", "due_date": "Nov 25, 2025"},
+        {"amount": "$5", "currency": "", "due_date": "25/11/2025"},
+        {"amount": "€2.400,50", "currency": "", "due_date": "Nov 25, 2025"},
+    ]
+    columns = normalize_columns({name: [row[name] for row in rows] for name in rows[0]})
+    assert [dict(zip(columns, values)) for values in zip(*columns.values())] == [normalize_row(row) for row in rows]
+    assert columns["amount"] == ["2400.50", "5.00", "2400.50"]
+
+
+def test_normalize_csv_in_place():
+    path = os.path.join(tempfile.mkdtemp(), "data.csv")
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(FIELDNAMES)
+        writer.writerow(["$5,320 USD", "", "November 25, 2025", "ads", "Apex", "a@b.co"])
+    assert normalize_csv(path, FIELDNAMES) == 1
+    with open(path, newline="") as f:
+        assert list(csv.reader(f)) == [FIELDNAMES, ["5320.00", "USD", "2025-11-25", "ads", "Apex", "a@b.co"]]
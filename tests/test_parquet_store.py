@@ -0,0 +1,79 @@
+import os
+import tempfile
+
+from src.storage import parquet_store
+from src.storage.parquet_store import DEFAULT_FIELDNAMES, ParquetStore, totals
+
+
+def _store_with_rows(amounts):
+    store = ParquetStore(tempfile.mkdtemp(), DEFAULT_FIELDNAMES, compact_interval=0)
+    for amount in amounts:
+        store._append([{"amount": amount, "currency": "USD", "due_date": "2025-11-25", "description": "ads",
+                        "company": "Apex", "contact": "a@b.co"}])
+    return store
+
+
+def _count_and_sum(store):
+    (row,) = totals(store.directory).to_pylist()
+    return row["amount_count"], str(row["amount_sum"])
+
+
+def _files(store):
+    return sorted(os.listdir(os.path.join(store.directory, "due_month=2025-11")))
+
+
+def test_compact_keeps_totals():
+    if parquet_store.pa is None:
+        return  # pyarrow is optional
+    store = _store_with_rows(["1", "2", "3", "4", "5"])
+    assert store.compact(min_files=2, target_rows=2) == {"partitions": 1, "files_merged": 5}
+    assert [name.split("-")[0] for name in _files(store)] == ["compacted"] * 3
+    assert _count_and_sum(store) == (5, "15.00")
+
+
+def test_crash_after_compacted_files_are_written():
+    """The small files are left behind: readers skip them and recovery removes them"""
+    if parquet_store.pa is None:
+        return
+    store = _store_with_rows(["1", "2", "3"])
+    remove = parquet_store._remove
+    parquet_store._remove = lambda directory, names: None
+    try:
+        store.compact(min_files=2)
+    finally:
+        parquet_store._remove = remove
+    assert len(_files(store)) == 4
+    assert _count_and_sum(store) == (3, "6.00")
+    assert store.recover() == {"finished": 1, "rolled_back": 0}
+    assert len(_files(store)) == 1 and _count_and_sum(store) == (3, "6.00")
+
+
+def test_crash_while_compacted_files_are_written():
+    """Only some compacted files exist: readers use the small files and recovery rolls back"""
+    if parquet_store.pa is None:
+        return
+    store = _store_with_rows(["1", "2", "3", "4"])
+    write_file, written = store._write_file, []
+
+    def crash_on_second(table, partition, prefix="part"):
+        if written:
+            raise RuntimeError("crash")
+        written.append(write_file(table, partition, prefix))
+
+    store._write_file = crash_on_second
+    try:
+        store.compact(min_files=2, target_rows=2)
+        raise AssertionError("the compaction should have crashed")
+    except RuntimeError:
+        pass
+    finally:
+        store._write_file = write_file
+    assert len(_files(store)) == 5
+    assert _count_and_sum(store) == (4, "10.00")
+    assert store.recover() == {"finished": 0, "rolled_back": 1}
+    assert len(_files(store)) == 4 and _count_and_sum(store) == (4, "10.00")
+    # Files of a merge that finished long ago stay visible after being merged again
+    store.compact(min_files=2, target_rows=3)  # a file of 3 rows and one of 1
+    store._append([{"amount": "5", "currency": "USD", "due_date": "2025-11-25"}])
+    assert store.compact(min_files=2, target_rows=3)["files_merged"] == 2
+    assert _count_and_sum(store) == (5, "15.00")
@@ -0,0 +1,73 @@
+from src.extract.preprocess import clean_text, parse_stages, preprocess, relevance_window, strip_html
+
+FORWARDED_INVOICE = """Company: Apex Marketing Group
+The total amount due is $5,320 USD, payable no later than November 25, 2025.
+Contact: finance@apexmktg.com"""
+
+
+def test_preprocess_forward():
+    """A forwarded invoice survives preprocessing when the note above it has an amount"""
+    email_text = f"""Hi team, please pay this $5,320 invoice today.
+
+---------- Forwarded message ---------
+From: Apex Billing <finance@apexmktg.com>
+Date: Mon, Nov 3, 2025 at 9:14 AM
+Subject: Invoice INV-7841
+To: ap@client.example
+
+{FORWARDED_INVOICE}"""
+    text = preprocess(clean_text(email_text)).text
+    for kept in ("Apex Marketing Group", "November 25, 2025", "finance@apexmktg.com"):
+        assert kept in text, f"{kept!r} was dropped"
+    assert "Date: Mon" not in text
+
+
+def test_preprocess_reply():
+    """A reply keeps the quoted invoice unless the new message has every field"""
+    quoted = "\n".join(f"> {line}" for line in FORWARDED_INVOICE.splitlines())
+    email_text = f"""Thanks, we will pay the $5,320 shortly.
+
+On Mon, Nov 3, 2025 at 9:14 AM Apex Billing <finance@apexmktg.com> wrote:
+{quoted}"""
+    text = preprocess(clean_text(email_text)).text
+    for kept in ("Apex Marketing Group", "November 25, 2025", "finance@apexmktg.com"):
+        assert kept in text, f"{kept!r} was dropped"
+    assert not any(line.startswith(">") for line in text.splitlines())
+
+    complete = f"{FORWARDED_INVOICE}\n\nOn Mon, Nov 3, 2025 at 9:14 AM John <john@client.example> wrote:\n> Could you resend it?"
+    assert "resend" not in preprocess(clean_text(complete)).text
+
+
+def test_preprocess_signature_and_footer():
+    email_text = (
+        f"{FORWARDED_INVOICE}\n\n"
+        "-- \nJane Doe\nAccounts Receivable\n+1 (646) 221-9988\n\n"
+        "CONFIDENTIALITY NOTICE: this message is intended only for the named recipient."
+    )
+    result = preprocess(clean_text(email_text))
+    assert "Accounts Receivable" not in result.text
+    assert "+1 (646) 221-9988" in result.text
+    assert "CONFIDENTIALITY" not in result.text
+    assert result.tokens_after < result.tokens_before
+
+
+def test_strip_html():
+    text = strip_html("<html><body><p>Total:&nbsp;<b>$5,320</b></p><script>x()</script></body></html>")
+    assert text.strip() == "Total: $5,320"
+
+
+def test_relevance_window():
+    lines = [f"filler line {i}" for i in range(200)]
+    lines[100] = "The total amount due is $5,320 USD."
+    text = relevance_window("\n".join(lines), min_chars=100, radius=1)
+    assert text.splitlines() == ["[...]", "filler line 99", lines[100], "filler line 101", "[...]"]
+
+
+def test_parse_stages():
+    assert parse_stages(" html, quotes ,") == ["html", "quotes"]
+    try:
+        parse_stages("html,nope")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("an unknown stage was accepted")
@@ -0,0 +1,93 @@
+import asyncio
+
+from src.ai.base import AIPlatform
+from src.ai.router import Backend, CircuitBreaker, ModelRouter, NoBackendAvailable
+
+
+class UpstreamError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class FakePlatform(AIPlatform):
+    """Answers with its name after `delay` seconds, or raises `error`"""
+
+    def __init__(self, name: str, error: Exception = None, delay: float = 0.0):
+        self.name = name
+        self.error = error
+        self.delay = delay
+        self.calls = 0
+
+    def chat(self, prompt: str) -> str:
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return self.name
+
+    async def achat(self, prompt: str) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.name
+
+
+def _router(*platforms: FakePlatform, hedge: bool = False) -> ModelRouter:
+    return ModelRouter("test", [Backend(p.name, p, limit=False) for p in platforms], hedge=hedge)
+
+
+def test_failover_on_server_error():
+    broken, healthy = FakePlatform("broken", UpstreamError(503)), FakePlatform("healthy")
+    router = _router(broken, healthy)
+    assert asyncio.run(router.achat("hi")) == "healthy"
+    assert router.chat("hi") == "healthy"
+    # After a failure the broken backend is tried last
+    assert broken.calls == 1 and router.backends[0].breaker.failures == 1
+
+
+def test_client_error_is_not_retried():
+    rejected, healthy = FakePlatform("rejected", UpstreamError(400)), FakePlatform("healthy")
+    router = _router(rejected, healthy)
+    try:
+        asyncio.run(router.achat("hi"))
+        raise AssertionError("a 400 was failed over")
+    except UpstreamError as e:
+        assert e.status_code == 400
+    assert healthy.calls == 0 and router.backends[0].breaker.failures == 0
+
+
+def test_open_breaker_is_skipped():
+    broken, healthy = FakePlatform("broken", UpstreamError(500)), FakePlatform("healthy")
+    router = _router(broken, healthy)
+    router.backends[0].breaker = CircuitBreaker(failure_threshold=1, cooldown_seconds=60)
+    asyncio.run(router.achat("hi"))
+    assert router.backends[0].breaker.state == "open"
+    asyncio.run(router.achat("hi"))
+    assert broken.calls == 1
+
+
+def test_every_backend_failing():
+    router = _router(FakePlatform("a", UpstreamError(502)), FakePlatform("b", UpstreamError(502)))
+    try:
+        asyncio.run(router.achat("hi"))
+        raise AssertionError("expected the last upstream error")
+    except UpstreamError:
+        pass
+    for backend in router.backends:
+        backend.breaker.opened_at = 0.0
+        backend.breaker.cooldown_seconds = 1e12  # open
+    try:
+        asyncio.run(router.achat("hi"))
+        raise AssertionError("expected NoBackendAvailable")
+    except NoBackendAvailable:
+        pass
+
+
+def test_hedge_to_second_backend():
+    slow, fast = FakePlatform("slow", delay=1.0), FakePlatform("fast")
+    router = _router(slow, fast, hedge=True)
+    for _ in range(50):
+        router.backends[0].observe(0.01)  # p95 known and short: hedge after 50 ms
+    assert asyncio.run(router.achat("hi")) == "fast"
+    assert router.targets == "fast,slow"
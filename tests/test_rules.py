@@ -0,0 +1,89 @@
+from src.extract import rules
+
+HEADER = """Company: Müller GmbH
+Contact: rechnung@mueller.de
+Description: Consulting, October 2025
+Due date: 2025-11-25
+"""
+
+SIMPLE_INVOICE = """Dear Ms. Patel,
+
+This is a gentle reminder regarding Invoice #INV-7841 issued on October 28, 2025 for digital advertising.
+
+The total amount due is $5,320 USD, payable no later than November 25, 2025.
+
+Company: Apex Marketing Group
+Contact: finance@apexmktg.com"""
+
+
+def _amount(line: str):
+    result = rules.extract(HEADER + line)
+    return result.fields["amount"], result.fields["currency"], result.confidence["amount"]
+
+
+def test_amount_formats():
+    cases = {
+        "Total: $5,320 USD": ("5320", "USD"),
+        "Total: $1,500.00": ("1500.00", "USD"),
+        "Invoice total: USD 1,500.00": ("1500.00", "USD"),
+        "Total: 1500 EUR": ("1500", "EUR"),
+        "Total: 2,400.00 EUR": ("2400.00", "EUR"),
+        "Total: 2.400,00 EUR": ("2400.00", "EUR"),
+        "Amount due: 1.234,56 €": ("1234.56", "EUR"),
+        "Total: 12,50 EUR": ("12.50", "EUR"),
+    }
+    for line, expected in cases.items():
+        amount, currency, confidence = _amount(line)
+        assert (amount, currency) == expected, (line, amount, currency)
+        assert confidence == 1.0, line
+
+
+def test_decimal_comma_amount_is_not_cut():
+    """The tail of "2.400,00" used to be taken as the whole amount and skip the LLM"""
+    result = rules.extract(HEADER + "Total: 2.400,00 EUR")
+    assert result.fields["amount"] == "2400.00"
+    assert result.is_confident()
+    assert result.merge({"amount": "2400.00", "currency": "EUR"})["amount"] == "2400.00"
+
+
+def test_ambiguous_grouping_asks_the_llm():
+    amount, currency, confidence = _amount("Total: €2.400")
+    assert (amount, currency) == ("2400", "EUR")
+    assert confidence < rules.PREFILL_FAST_PATH_MIN_CONFIDENCE
+    result = rules.extract(HEADER + "Total: €2.400")
+    assert not result.is_confident()
+    assert result.merge({"amount": "2400.00"})["amount"] == "2400.00"
+
+
+def test_zero_amount_is_skipped():
+    assert _amount("The remaining balance due is $0.")[0] == ""
+    amount, _, confidence = _amount("Invoice total: $0.00\nThe amount due is $450.00 by Friday.")
+    assert (amount, confidence) == ("450.00", 0.9)
+
+
+def test_amount_cues():
+    amount, currency, confidence = _amount("We delivered 3 items. The balance of $1,200 is payable now.")
+    assert (amount, currency, confidence) == ("1200", "USD", 0.9)
+    amount, _, confidence = _amount("Items: $10 and $20.")
+    assert (amount, confidence) == ("10", 0.3)
+
+
+def test_simple_invoice_fast_path():
+    result = rules.extract(SIMPLE_INVOICE)
+    assert result.fields == {
+        "amount": "5320",
+        "currency": "USD",
+        "due_date": "November 25, 2025",
+        "description": "digital advertising",
+        "company": "Apex Marketing Group",
+        "contact": "finance@apexmktg.com",
+    }
+    assert result.is_confident()
+
+
+def test_merge_prefers_confident_rules():
+    result = rules.extract("Total: $5,320\nsee you")
+    merged = result.merge({"amount": "9999", "company": "Apex", "contact": ""})
+    assert merged["amount"] == "5320" and merged["company"] == "Apex"
+    # A guessed field only fills a gap the LLM left
+    assert rules.extract("Items: $10 and $20.").merge({"amount": "30"})["amount"] == "30"
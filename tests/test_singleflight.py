@@ -0,0 +1,78 @@
+import asyncio
+
+from src.ai.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_upstream_call():
+    async def run():
+        flight = SingleFlight()
+        calls = []
+
+        async def fetch(value):
+            calls.append(value)
+            await asyncio.sleep(0.01)
+            return value
+
+        results = await asyncio.gather(*(flight.do("k", lambda: fetch("a")) for _ in range(5)), flight.do("other", lambda: fetch("b")))
+        assert results == ["a"] * 5 + ["b"]
+        assert calls == ["a", "b"]
+        assert flight.stats() == {"calls": 2, "shared": 4, "in_flight": 0}
+
+    asyncio.run(run())
+
+
+def test_failures_are_not_remembered():
+    async def run():
+        flight = SingleFlight(window_seconds=60)
+        attempts = []
+
+        async def flaky():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise RuntimeError("upstream down")
+            return "ok"
+
+        try:
+            await flight.do("k", flaky)
+            raise AssertionError("the failure was swallowed")
+        except RuntimeError:
+            pass
+        assert await flight.do("k", flaky) == "ok"
+        # A success is kept for the window
+        assert await flight.do("k", flaky) == "ok" and len(attempts) == 2
+
+    asyncio.run(run())
+
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    async def run():
+        flight = SingleFlight()
+        started = asyncio.Event()
+
+        async def slow():
+            started.set()
+            await asyncio.sleep(0.05)
+            return "done"
+
+        first = asyncio.create_task(flight.do("k", slow))
+        await started.wait()
+        second = asyncio.create_task(flight.do("k", slow))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == "done"
+
+    asyncio.run(run())
+
+
+def test_disabled_calls_every_time():
+    async def run():
+        flight = SingleFlight(enabled=False)
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            return len(calls)
+
+        assert await asyncio.gather(flight.do("k", fetch), flight.do("k", fetch)) == [1, 2]
+
+    asyncio.run(run())